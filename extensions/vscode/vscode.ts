@@ -8,7 +8,7 @@ import { performance } from "node:perf_hooks";
 
 let g_daemon: cp.ChildProcessWithoutNullStreams | null = null;
 let g_nextId = 1;
-const g_pending_events = new Map<number, { resolve: (s: string) => void, reject: (e: any) => void }>();
+const g_pending_events = new Map<number, { resolve: (msg: any) => void, reject: (e: any) => void }>();
 const g_canceled_ids = new Set<number>();
 let g_stdoutBuf = "";
 
@@ -66,12 +66,7 @@ function startDaemon(exePath: string, out: vscode.OutputChannel) {
                     }
 
                     if (msg.ok) {
-                        try {
-                            const buf = Buffer.from(msg.b64, 'base64');
-                            p.resolve(buf.toString('utf8'));
-                        } catch {
-                            p.resolve("");
-                        }
+                        p.resolve(msg);
                     } else {
                         p.reject(new Error(msg.error ?? "unknown error"));
                     }
@@ -89,19 +84,36 @@ function startDaemon(exePath: string, out: vscode.OutputChannel) {
     });
 }
 
+function decodeB64(b64: string | undefined): string {
+    try {
+        return Buffer.from(b64 ?? "", "base64").toString("utf8");
+    } catch {
+        return "";
+    }
+}
+
 async function requestFormat(
     text: string,
     token: vscode.CancellationToken,
     out: vscode.OutputChannel
 ): Promise<string> {
+    const b64 = Buffer.from(text, "utf8").toString("base64");
+    const reply = await sendRequest({ op: "format", b64: b64 }, token, out);
+    return decodeB64(reply.b64);
+}
+
+async function sendRequest(
+    request: object,
+    token: vscode.CancellationToken,
+    out: vscode.OutputChannel
+): Promise<any> {
     return new Promise((resolve, reject) => {
         if (!g_daemon || !g_daemon.stdin) {
             return reject(new Error("daemon not running"));
         }
 
         const id = g_nextId++;
-        const b64 = Buffer.from(text, "utf8").toString("base64");
-        const msg = JSON.stringify({ id, op: "format", b64: b64 }) + "\n";
+        const msg = JSON.stringify({ id, ...request }) + "\n";
 
         g_pending_events.set(id, { resolve, reject });
 
@@ -109,6 +121,8 @@ async function requestFormat(
             if (g_pending_events.has(id)) {
                 g_canceled_ids.add(id);
                 g_pending_events.delete(id);
+                // let the daemon drop or kill the work, its "canceled" reply is swallowed
+                try { g_daemon?.stdin.write(JSON.stringify({ id, op: "cancel" }) + "\n"); } catch { }
                 out.appendLine(`request canceled id=${id}`);
                 reject(new Error("canceled"));
             }
@@ -152,6 +166,42 @@ async function formatSelection(
     return edits;
 }
 
+async function formatRange(
+    out: vscode.OutputChannel,
+    doc: vscode.TextDocument,
+    range: vscode.Range,
+    token: vscode.CancellationToken,
+): Promise<vscode.TextEdit[]> {
+    out.appendLine(`Formatting range: ${doc.uri.fsPath} START`);
+    const start = performance.now();
+
+    let edits: vscode.TextEdit[] = [];
+    try {
+        // the daemon formats just these lines and replies with the affected region only
+        const first = range.start.line + 1;
+        const last = range.end.character === 0 && range.end.line > range.start.line
+            ? range.end.line
+            : range.end.line + 1;
+        const b64 = Buffer.from(doc.getText(), "utf8").toString("base64");
+        const reply = await sendRequest({ op: "format_range", b64: b64, lines: [[first, last]] }, token, out);
+        if (!reply.unchanged) {
+            const region = new vscode.Range(
+                new vscode.Position(reply.start_line - 1, 0),
+                doc.validatePosition(new vscode.Position(reply.end_line, 0)),
+            );
+            edits = [vscode.TextEdit.replace(region, decodeB64(reply.b64))];
+        }
+    } catch (e: any) {
+        let msg = String(e?.message ?? e);
+        if (msg === "canceled") msg = "canceled by VS Code";
+        out.appendLine(`error: ${msg}`);
+        vscode.window.showErrorMessage(`wformat error: ${msg}`);
+    }
+
+    out.appendLine(`Formatting range: ${doc.uri.fsPath} END (${(performance.now() - start).toFixed(1)} ms)`);
+    return edits;
+}
+
 async function formatDocument(
     out: vscode.OutputChannel,
     doc: vscode.TextDocument,
@@ -217,8 +267,14 @@ export function activate(context: vscode.ExtensionContext) {
             formatDocument(out, doc, token)
     };
 
+    const rangeProvider: vscode.DocumentRangeFormattingEditProvider = {
+        provideDocumentRangeFormattingEdits: (doc: vscode.TextDocument, range: vscode.Range, _opts: vscode.FormattingOptions, token: vscode.CancellationToken) =>
+            formatRange(out, doc, range, token)
+    };
+
     context.subscriptions.push(
         vscode.languages.registerDocumentFormattingEditProvider(selector, provider),
+        vscode.languages.registerDocumentRangeFormattingEditProvider(selector, rangeProvider),
         out
     );
 }
@@ -0,0 +1,153 @@
+"""Compare --serve throughput of the JSON/base64 protocol and binary framing.
+
+Run with:
+    python scripts/bench_daemon_protocol.py [--size-mb 1] [--requests 8] [--codec-only]
+
+The codec benchmark measures only the encode/decode work each protocol does
+per request and reply (no formatting). The end-to-end benchmark drives a
+real `python -m wformat --serve` process and needs the formatter binaries.
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+import time
+
+# Ensure the local 'src' directory is on sys.path when running from a fresh clone
+ROOT = Path(__file__).resolve().parent.parent
+SRC = ROOT / "src"
+if str(SRC) not in sys.path:
+    sys.path.insert(0, str(SRC))
+
+from wformat.daemon import FRAME_HEADER, OP_FORMAT, encode_frame
+
+
+def make_source(size: int) -> str:
+    unit = "int   f( int a ,int b ) {  return  a+b ; }\n"
+    return unit * (size // len(unit) + 1)
+
+
+def json_roundtrip(text: str) -> str:
+    # client -> daemon
+    line = json.dumps(
+        {
+            "id": 1,
+            "op": "format",
+            "b64": base64.b64encode(text.encode("utf-8")).decode("ascii"),
+        }
+    )
+    req = json.loads(line)
+    data = base64.b64decode(req["b64"], validate=True).decode("utf-8", "replace")
+    # daemon -> client (pretend the formatter returned the input)
+    reply = json.dumps(
+        {
+            "id": 1,
+            "ok": True,
+            "b64": base64.b64encode(data.encode("utf-8")).decode("ascii"),
+        },
+        ensure_ascii=False,
+    )
+    return base64.b64decode(json.loads(reply)["b64"]).decode("utf-8")
+
+
+def binary_roundtrip(text: str) -> str:
+    frame = encode_frame(1, OP_FORMAT, text.encode("utf-8"))
+    _, _, _, length = FRAME_HEADER.unpack_from(frame)
+    data = frame[FRAME_HEADER.size : FRAME_HEADER.size + length].decode(
+        "utf-8", "replace"
+    )
+    reply = encode_frame(1, OP_FORMAT, data.encode("utf-8"))
+    return reply[FRAME_HEADER.size :].decode("utf-8")
+
+
+def bench_codec(text: str, requests: int) -> None:
+    size_mb = len(text.encode("utf-8")) * requests / (1024 * 1024)
+    for name, fn in (("json+base64", json_roundtrip), ("binary", binary_roundtrip)):
+        start = time.perf_counter()
+        for _ in range(requests):
+            fn(text)
+        elapsed = time.perf_counter() - start
+        print(
+            f"codec  {name:12} {elapsed * 1000:9.1f} ms  {size_mb / elapsed:9.1f} MB/s"
+        )
+
+
+def read_exact(stream, n: int) -> bytes:
+    buf = b""
+    while len(buf) < n:
+        chunk = stream.read(n - len(buf))
+        if not chunk:
+            raise EOFError("daemon closed stdout")
+        buf += chunk
+    return buf
+
+
+def bench_daemon(text: str, requests: int, binary: bool) -> float:
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "wformat", "--serve", "--no-cache"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        env={**os.environ, "PYTHONPATH": str(SRC)},
+    )
+    assert proc.stdin and proc.stdout
+    if binary:
+        proc.stdin.write(b'{"id": 0, "op": "hello", "framing": "binary"}\n')
+        proc.stdin.flush()
+        assert json.loads(proc.stdout.readline())["framing"] == "binary"
+    payload = text.encode("utf-8")
+    start = time.perf_counter()
+    # one request at a time so the numbers reflect per-request latency
+    for rid in range(1, requests + 1):
+        if binary:
+            proc.stdin.write(encode_frame(rid, OP_FORMAT, payload))
+            proc.stdin.flush()
+            _, _, status, length = FRAME_HEADER.unpack(
+                read_exact(proc.stdout, FRAME_HEADER.size)
+            )
+            out = read_exact(proc.stdout, length)
+            assert status == 0, out
+        else:
+            b64 = base64.b64encode(payload).decode("ascii")
+            proc.stdin.write(
+                json.dumps({"id": rid, "op": "format", "b64": b64}).encode() + b"\n"
+            )
+            proc.stdin.flush()
+            reply = json.loads(proc.stdout.readline())
+            assert reply["ok"], reply
+            base64.b64decode(reply["b64"])
+    elapsed = time.perf_counter() - start
+    proc.stdin.close()
+    proc.wait()
+    return elapsed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=float, default=1.0)
+    parser.add_argument("--requests", type=int, default=8)
+    parser.add_argument("--codec-only", action="store_true")
+    args = parser.parse_args()
+
+    text = make_source(int(args.size_mb * 1024 * 1024))
+    print(f"-- {args.requests} request(s) of {len(text) / (1024 * 1024):.1f} MB")
+    bench_codec(text, args.requests)
+    if args.codec_only:
+        return 0
+
+    size_mb = len(text.encode("utf-8")) * args.requests / (1024 * 1024)
+    for name, binary in (("json+base64", False), ("binary", True)):
+        elapsed = bench_daemon(text, args.requests, binary)
+        print(
+            f"serve  {name:12} {elapsed * 1000:9.1f} ms  {size_mb / elapsed:9.1f} MB/s"
+        )
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    raise SystemExit(main())
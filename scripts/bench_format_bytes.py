@@ -0,0 +1,93 @@
+"""Compare time and peak Python memory of format_bytes and the text path.
+
+Run with:
+    python scripts/bench_format_bytes.py [--size-mb 1] [--repeat 1]
+
+The text path is what a daemon request used to do: decode the request
+bytes, format_memory the text and encode the result again. format_bytes
+keeps the document as bytes from the request to the reply. Peak memory is
+measured with tracemalloc, so it only counts Python allocations (not the
+formatter processes). Needs the formatter binaries, the cache is off.
+"""
+
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+import sys
+import time
+import tracemalloc
+from typing import Callable
+
+# Ensure the local 'src' directory is on sys.path when running from a fresh clone
+ROOT = Path(__file__).resolve().parent.parent
+SRC = ROOT / "src"
+if str(SRC) not in sys.path:
+    sys.path.insert(0, str(SRC))
+
+from wformat.wformat import WFormat
+
+UNIT = """int   f{n}( int a ,int b ) {{
+    // comment with a non-ASCII character: é
+    return  call( a+b , 0x{n:x}u ) ;
+}}
+"""
+
+
+def make_source(size: int) -> bytes:
+    parts: list[str] = []
+    total = 0
+    n = 0
+    while total < size:
+        part = UNIT.format(n=n)
+        parts.append(part)
+        total += len(part.encode("utf-8"))
+        n += 1
+    return "".join(parts).encode("utf-8")
+
+
+def measure(fn: Callable[[], bytes], repeat: int) -> tuple[float, int, bytes]:
+    best = float("inf")
+    peak = 0
+    out = b""
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return best, peak, out
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=float, default=1)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    data = make_source(int(args.size_mb * 1024 * 1024))
+    formatter = WFormat()
+
+    def text_path() -> bytes:
+        text = data.decode("utf-8", "replace")
+        return formatter.format_memory(text).encode("utf-8", "replace")
+
+    def bytes_path() -> bytes:
+        return formatter.format_bytes(data)
+
+    mb = len(data) / 1e6
+    results = {}
+    for name, fn in (("text", text_path), ("format_bytes", bytes_path)):
+        seconds, peak, out = measure(fn, args.repeat)
+        results[name] = out
+        print(
+            f"{name:13} {mb:7.1f} MB  {seconds:7.2f} s  {mb / seconds:7.2f} MB/s  "
+            f"peak {peak / 1e6:8.1f} MB ({peak / len(data):.1f}x input)"
+        )
+    assert results["text"] == results["format_bytes"]
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    raise SystemExit(main())
@@ -0,0 +1,86 @@
+"""Measure the tree-sitter normalizer on large generated sources.
+
+Run with:
+    python scripts/bench_normalizer.py [--sizes 64,256,1024,4096] [--legacy]
+
+For each size (in KB) the script reports the time spent parsing, collecting
+edits and applying them. --legacy also times the previous applier, which
+re-sliced the whole buffer once per edit, to show how it scaled.
+"""
+
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+import sys
+import time
+
+# Ensure the local 'src' directory is on sys.path when running from a fresh clone
+ROOT = Path(__file__).resolve().parent.parent
+SRC = ROOT / "src"
+if str(SRC) not in sys.path:
+    sys.path.insert(0, str(SRC))
+
+from wformat.normalizer import Edit, _get_parser, apply_edits, collect_edits
+
+UNIT = """int
+    f{n}(int a);
+
+void g{n}()
+{{
+    foo( {n} );
+    bar( x, y );
+}}
+"""
+
+
+def make_source(size: int) -> bytes:
+    parts: list[str] = []
+    total = 0
+    n = 0
+    while total < size:
+        part = UNIT.format(n=n)
+        parts.append(part)
+        total += len(part)
+        n += 1
+    return "".join(parts).encode("utf-8")
+
+
+def legacy_apply(src: bytes, edits: list[Edit]) -> bytes:
+    for start, end, rep in sorted(edits, key=lambda e: e[0], reverse=True):
+        src = src[:start] + rep + src[end:]
+    return src
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="64,256,1024,4096")
+    parser.add_argument("--legacy", action="store_true")
+    args = parser.parse_args()
+
+    for kb in (int(s) for s in args.sizes.split(",")):
+        src = make_source(kb * 1024)
+
+        start = time.perf_counter()
+        tree = _get_parser().parse(src)
+        parsed = time.perf_counter()
+        edits = [e for _, _, e in collect_edits(src, tree)]
+        collected = time.perf_counter()
+        out = apply_edits(src, list(edits))
+        applied = time.perf_counter()
+
+        line = (
+            f"{kb:6} KB  {len(edits):7} edits  parse {(parsed - start) * 1000:8.1f} ms"
+            f"  collect {(collected - parsed) * 1000:8.1f} ms"
+            f"  apply {(applied - collected) * 1000:8.1f} ms"
+        )
+        if args.legacy:
+            start = time.perf_counter()
+            assert legacy_apply(src, edits) == out
+            line += f"  legacy apply {(time.perf_counter() - start) * 1000:9.1f} ms"
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    raise SystemExit(main())
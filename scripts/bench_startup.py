@@ -0,0 +1,105 @@
+"""Measure the startup cost of each wformat entry point.
+
+Run with:
+    python scripts/bench_startup.py [--repeat 5] [--json startup.json]
+
+Every entry point is run as `python -X importtime -m wformat ...` from a
+scratch git repository holding a single source file. For each one the
+script reports the best wall time of --repeat runs, the total import time
+and the slowest imported modules. --stdin and --serve format a small input
+and need the formatter binaries, the other entry points do not.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = Path(__file__).resolve().parent.parent
+SRC = ROOT / "src"
+
+ENTRY_POINTS: dict[str, tuple[list[str], str]] = {
+    # name: (arguments, stdin)
+    "--version": (["--version"], ""),
+    "--help": (["--help"], ""),
+    "--ls --all": (["--ls", "--all"], ""),
+    "--ls -m": (["--ls", "-m"], ""),
+    "--stdin": (["--stdin", "--no-cache"], "int   a ;\n"),
+    "--serve": (["--serve", "--no-cache"], '{"op": "shutdown"}\n'),
+}
+
+
+def parse_importtime(stderr: str) -> tuple[float, list[tuple[float, str]]]:
+    """Total import time and (self time, module) per module, in ms."""
+    total = 0.0
+    modules: list[tuple[float, str]] = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        modules.append((int(self_us) / 1000, name.strip()))
+        # top level imports are not indented, their cumulative times add up
+        if not name[1:].startswith(" "):
+            total += int(cumulative_us) / 1000
+    modules.sort(reverse=True)
+    return total, modules
+
+
+def run(args: list[str], stdin: str, cwd: str, repeat: int) -> dict[str, object]:
+    env = dict(os.environ, PYTHONPATH=str(SRC), WFORMAT_NO_CACHE="1")
+    command = [sys.executable, "-X", "importtime", "-m", "wformat", *args]
+    best = float("inf")
+    stderr = ""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run(
+            command, input=stdin, cwd=cwd, env=env, capture_output=True, text=True
+        )
+        best = min(best, time.perf_counter() - start)
+        stderr = proc.stderr
+    imports, modules = parse_importtime(stderr)
+    return {
+        "args": args,
+        "returncode": proc.returncode,
+        "wall_ms": best * 1000,
+        "import_ms": imports,
+        "slowest_imports": [[name, ms] for ms, name in modules[:5]],
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", metavar="FILE", help="Write the results to FILE.")
+    args = parser.parse_args()
+
+    results: dict[str, dict[str, object]] = {}
+    with tempfile.TemporaryDirectory(prefix="wformat-startup-") as tmp:
+        subprocess.run(["git", "init", "-q"], cwd=tmp, capture_output=True)
+        Path(tmp, "a.cpp").write_text("int a;\n", encoding="utf-8")
+        for name, (entry_args, stdin) in ENTRY_POINTS.items():
+            result = run(entry_args, stdin, tmp, args.repeat)
+            results[name] = result
+            slowest = ", ".join(
+                f"{module} {ms:.1f}" for module, ms in result["slowest_imports"][:3]  # type: ignore[index]
+            )
+            print(
+                f"{name:12} wall {result['wall_ms']:7.1f} ms  "
+                f"imports {result['import_ms']:7.1f} ms  ({slowest})"
+            )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    raise SystemExit(main())
@@ -0,0 +1,253 @@
+"""Benchmark the formatting stages, format_memory and multi-file scaling.
+
+Run with:
+    python scripts/bench_suite.py [--lines 10000,100000] [--workers 1,2,4,8]
+        [--repeat 3] [--json results.json] [--compare baseline.json]
+
+Inputs are the originals in tests/sample plus generated C++ files of the
+given line counts. Three groups of results are produced:
+
+  stage    time of clang-format, uncrustify, fix_with_tree_sitter and
+           normalize_integer_literal_in_memory on each input
+  memory   end-to-end WFormat.format_memory throughput in MB/s
+  scaling  format_inplace_many_mt over a copy of every input per worker
+           count, in files/s
+
+Every result is the best of --repeat runs. --json writes them with the git
+commit and platform so that runs of two commits can be compared with
+--compare, which prints the ratio of each timing to the baseline file.
+The formatter binaries are needed, the cache is never enabled.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+from pathlib import Path
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable
+
+# Ensure the local 'src' directory is on sys.path when running from a fresh clone
+ROOT = Path(__file__).resolve().parent.parent
+SRC = ROOT / "src"
+if str(SRC) not in sys.path:
+    sys.path.insert(0, str(SRC))
+
+from wformat.normalizer import (
+    fix_with_tree_sitter,
+    normalize_integer_literal_in_memory,
+)
+from wformat.wformat import WFormat
+
+SAMPLE_DIR = ROOT / "tests" / "sample"
+
+UNIT = """namespace ns{n} {{
+template <typename T> class Box{n} : public Base {{
+public:
+  Box{n}( T value ,int flags=0x{n:x}u ) : value_( value ) , flags_( flags ) {{}}
+  [[nodiscard]] T get( ) const {{ return value_; }}
+  int   sum( const std::vector<int>& v ) {{
+    int total = 0;
+    for ( auto x : v ) {{ if ( x > {n} ) total += x*0XffUL; else total -= x; }}
+    return total;
+  }}
+private:
+  T value_; int flags_;
+}};
+static auto lambda{n} = [ & ]( int a ,int b ) {{ return call( a , b , {n}ll ); }};
+}}  // namespace ns{n}
+"""
+
+
+def make_source(lines: int) -> str:
+    unit_lines = UNIT.count("\n")
+    return "#include <vector>\n" + "".join(
+        UNIT.format(n=n) for n in range(max(1, lines // unit_lines))
+    )
+
+
+def load_inputs(line_counts: list[int]) -> dict[str, str]:
+    inputs: dict[str, str] = {}
+    for path in sorted(SAMPLE_DIR.glob("*.cpp")):
+        if path.name.count(".") == 1:
+            inputs[f"sample/{path.name}"] = path.read_text(encoding="utf-8")
+    for lines in line_counts:
+        inputs[f"generated/{lines}-lines.cpp"] = make_source(lines)
+    return inputs
+
+
+def best_of(repeat: int, fn: Callable[[], object]) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_stages(
+    formatter: WFormat, name: str, text: str, repeat: int
+) -> list[dict[str, object]]:
+    data = text.encode("utf-8")
+    clang_args = formatter.clang_format.args_for_stdin()
+    uncrustify_args = formatter.uncrustify.args_for_stdin()
+    # every stage gets the output of the one before, as in format_memory
+    clang_out = formatter._run_tool("clang-format", clang_args, data)
+    uncrustify_out = formatter._run_tool("uncrustify", uncrustify_args, clang_out)
+    normalized = fix_with_tree_sitter(uncrustify_out.decode("utf-8"))
+    stages: list[tuple[str, Callable[[], object]]] = [
+        ("clang-format", lambda: formatter._run_tool("clang-format", clang_args, data)),
+        (
+            "uncrustify",
+            lambda: formatter._run_tool("uncrustify", uncrustify_args, clang_out),
+        ),
+        (
+            "fix_with_tree_sitter",
+            lambda: fix_with_tree_sitter(uncrustify_out.decode("utf-8")),
+        ),
+        (
+            "normalize_integer_literal_in_memory",
+            lambda: normalize_integer_literal_in_memory(normalized),
+        ),
+    ]
+    return [
+        {
+            "group": "stage",
+            "input": name,
+            "stage": stage,
+            "bytes": len(data),
+            "seconds": best_of(repeat, fn),
+        }
+        for stage, fn in stages
+    ]
+
+
+def bench_memory(
+    formatter: WFormat, name: str, text: str, repeat: int
+) -> dict[str, object]:
+    size = len(text.encode("utf-8"))
+    seconds = best_of(repeat, lambda: formatter.format_memory(text))
+    return {
+        "group": "memory",
+        "input": name,
+        "bytes": size,
+        "seconds": seconds,
+        "mb_per_s": size / seconds / 1e6 if seconds > 0 else None,
+    }
+
+
+def bench_scaling(
+    formatter: WFormat, inputs: dict[str, str], workers: int, repeat: int
+) -> dict[str, object]:
+    best = float("inf")
+    with tempfile.TemporaryDirectory(prefix="wformat-bench-") as tmp:
+        for run in range(repeat):
+            # fresh unformatted copies every run
+            run_dir = Path(tmp) / str(run)
+            run_dir.mkdir()
+            paths: list[Path] = []
+            for i, text in enumerate(inputs.values()):
+                path = run_dir / f"f{i}.cpp"
+                path.write_text(text, encoding="utf-8")
+                paths.append(path)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                formatter.format_inplace_many_mt(paths, workers)
+            best = min(best, time.perf_counter() - start)
+    return {
+        "group": "scaling",
+        "workers": workers,
+        "files": len(inputs),
+        "seconds": best,
+        "files_per_s": len(inputs) / best if best > 0 else None,
+    }
+
+
+def result_key(result: dict[str, object]) -> str:
+    parts = [result["group"], result.get("input"), result.get("stage")]
+    if "workers" in result:
+        parts.append(f"{result['workers']} worker(s)")
+    return " ".join(str(p) for p in parts if p is not None)
+
+
+def format_result(result: dict[str, object]) -> str:
+    line = f"{result_key(result):80} {result['seconds']:9.4f} s"
+    if result.get("mb_per_s") is not None:
+        line += f" {result['mb_per_s']:8.2f} MB/s"
+    if result.get("files_per_s") is not None:
+        line += f" {result['files_per_s']:8.2f} files/s"
+    return line
+
+
+def git_commit() -> str | None:
+    try:
+        res = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True
+        )
+    except OSError:
+        return None
+    return res.stdout.strip() or None
+
+
+def compare(results: list[dict[str, object]], baseline_path: str) -> None:
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {result_key(r): r for r in json.load(f)["results"]}
+    print(f"-- Compared with {baseline_path} (ratio > 1 is slower)")
+    for result in results:
+        old = baseline.get(result_key(result))
+        if old is None or not old["seconds"]:
+            continue
+        ratio = float(result["seconds"]) / float(old["seconds"])
+        print(f"{ratio:7.2f}x  {result_key(result)}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", default="10000,100000")
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", metavar="FILE", help="Write the results to FILE.")
+    parser.add_argument(
+        "--compare", metavar="FILE", help="Compare with the results in FILE."
+    )
+    args = parser.parse_args()
+
+    line_counts = [int(s) for s in args.lines.split(",") if s]
+    worker_counts = [int(s) for s in args.workers.split(",") if s]
+    inputs = load_inputs(line_counts)
+    formatter = WFormat()
+    results: list[dict[str, object]] = []
+
+    for name, text in inputs.items():
+        results += bench_stages(formatter, name, text, args.repeat)
+    for name, text in inputs.items():
+        results.append(bench_memory(formatter, name, text, args.repeat))
+    for workers in worker_counts:
+        results.append(bench_scaling(formatter, inputs, workers, args.repeat))
+    for result in results:
+        print(format_result(result))
+
+    if args.json:
+        report = {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "results": results,
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    raise SystemExit(main())
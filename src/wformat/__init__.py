@@ -3,28 +3,37 @@
 Exposes the package version as __version__.
 """
 
-from importlib import metadata as _metadata
 
-try:  # Prefer distribution metadata when installed
-    __version__ = _metadata.version("wformat")
-except Exception:  # Fallback to parsing pyproject.toml in editable/source checkout
+def _find_version() -> str:
+    from importlib import metadata as _metadata
+
+    try:  # Prefer distribution metadata when installed
+        return _metadata.version("wformat")
+    except Exception:  # Fallback to parsing pyproject.toml in editable/source checkout
+        pass
     try:
         import tomllib  # Python 3.11+
     except ModuleNotFoundError:  # pragma: no cover - earlier Python fallback
-        tomllib = None  # type: ignore
-    if tomllib:  # pragma: no branch
-        import pathlib
-
-        pyproject = pathlib.Path(__file__).resolve().parents[1] / "pyproject.toml"
-        if pyproject.is_file():
-            try:
-                data = tomllib.loads(pyproject.read_text(encoding="utf-8"))
-                __version__ = data.get("project", {}).get("version", "0.0.0+unknown")  # type: ignore
-            except Exception:  # pragma: no cover - very unlikely
-                __version__ = "0.0.0+unknown"
-        else:
-            __version__ = "0.0.0+unknown"
-    else:
-        __version__ = "0.0.0+unknown"
+        return "0.0.0+unknown"
+    import pathlib
+
+    pyproject = pathlib.Path(__file__).resolve().parents[1] / "pyproject.toml"
+    if not pyproject.is_file():
+        return "0.0.0+unknown"
+    try:
+        data = tomllib.loads(pyproject.read_text(encoding="utf-8"))
+        return data.get("project", {}).get("version", "0.0.0+unknown")  # type: ignore
+    except Exception:  # pragma: no cover - very unlikely
+        return "0.0.0+unknown"
+
+
+def __getattr__(name: str) -> str:
+    # importlib.metadata is slow to import, only look the version up on use
+    if name == "__version__":
+        version = _find_version()
+        globals()["__version__"] = version
+        return version
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 __all__ = ["__version__"]
@@ -0,0 +1,319 @@
+import hashlib
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Sequence
+
+_DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+_DEFAULT_MAX_CLEAN_ENTRIES = 200_000
+# the clean index of another toolchain is removed once unused for this long,
+# so that two installations sharing the cache do not delete each other's
+_STALE_CLEAN_INDEX_SECONDS = 24 * 60 * 60
+
+
+def default_cache_dir() -> Path:
+    """Per-user cache directory, overridable with WFORMAT_CACHE_DIR."""
+    override = os.environ.get("WFORMAT_CACHE_DIR")
+    if override:
+        return Path(override)
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA") or str(Path.home() / "AppData" / "Local")
+        return Path(base) / "wformat" / "cache"
+    if sys.platform == "darwin":
+        return Path.home() / "Library" / "Caches" / "wformat"
+    base = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    return Path(base) / "wformat"
+
+
+def cache_disabled_by_env() -> bool:
+    return os.environ.get("WFORMAT_NO_CACHE", "") not in ("", "0")
+
+
+def toolchain_fingerprint(paths: Sequence[Path]) -> str:
+    """
+    Hash the contents of the given files (formatter executables and configs)
+    together with the wformat version, so that any change to the toolchain
+    invalidates previously cached results.
+    """
+    from wformat import __version__
+
+    h = hashlib.sha256()
+    h.update(f"wformat {__version__}\0".encode("utf-8"))
+    for path in paths:
+        h.update(str(Path(path).name).encode("utf-8") + b"\0")
+        try:
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    h.update(chunk)
+        except OSError:
+            h.update(b"<missing>")
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class FormatCache:
+    """
+    Persistent, size-bounded, content-addressed cache of formatted results.
+
+    Entries live under <cache_dir>/<key[:2]>/<key>, where key hashes the
+    toolchain fingerprint and the input bytes. A hit refreshes the entry's
+    mtime; once the cache grows past max_bytes the least recently used
+    entries are evicted until it is back under 90% of the limit.
+    """
+
+    def __init__(
+        self,
+        fingerprint: str,
+        cache_dir: Path | None = None,
+        max_bytes: int = _DEFAULT_MAX_BYTES,
+    ) -> None:
+        self.fingerprint: str = fingerprint
+        self.cache_dir: Path = (
+            cache_dir if cache_dir is not None else default_cache_dir()
+        )
+        self.max_bytes: int = max_bytes
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self._lock = threading.Lock()
+        self._size: int | None = None  # lazily measured on first store
+
+    def key(self, data: bytes, *extra: str) -> str:
+        h = hashlib.sha256()
+        h.update(self.fingerprint.encode("ascii"))
+        for part in extra:
+            h.update(b"\0" + part.encode("utf-8"))
+        h.update(b"\0")
+        h.update(data)
+        return h.hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / key
+
+    def get(self, key: str) -> bytes | None:
+        path = self._entry_path(key)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self._entry_path(key)
+        tmp_path = path.with_name(f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            tmp_path.unlink(missing_ok=True)
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = self._measure()
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self) -> list[tuple[float, int, Path]]:
+        entries: list[tuple[float, int, Path]] = []
+        if not self.cache_dir.is_dir():
+            return entries
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir(follow_symlinks=False) or len(shard.name) != 2:
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, Path(entry.path)))
+        return entries
+
+    def _measure(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self) -> None:
+        entries = self._entries()
+        entries.sort(key=lambda e: e[0])
+        size = sum(e[1] for e in entries)
+        target = int(self.max_bytes * 0.9)
+        for _, entry_size, path in entries:
+            if size <= target:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            size -= entry_size
+            self.evictions += 1
+        self._size = size
+
+    def clear(self) -> None:
+        with self._lock:
+            for _, _, path in self._entries():
+                path.unlink(missing_ok=True)
+            self._size = 0
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def print_stats(self) -> None:
+        s = self.stats()
+        sys.stderr.write(
+            f"-- Cache: {s['hits']} hit(s), {s['misses']} miss(es), "
+            f"{s['evictions']} eviction(s) [{self.cache_dir}]\n"
+        )
+        sys.stderr.flush()
+
+
+def git_blob_sha(data: bytes) -> str:
+    """The SHA-1 git would give data as a blob (git hash-object)."""
+    h = hashlib.sha1()
+    h.update(b"blob %d\0" % len(data))
+    h.update(data)
+    return h.hexdigest()
+
+
+def _path_key(path: Path | str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+class CleanIndex:
+    """
+    Git blob SHAs of file contents known to be formatted already, for one
+    toolchain fingerprint.
+
+    Tracked files that git reports as unmodified are looked up by the blob
+    SHA from the git index, so known-clean files are skipped without being
+    read at all. Other files are looked up by the SHA of their bytes. New
+    entries are appended to <cache_dir>/clean-<fingerprint> by save(); once
+    it holds more than max_entries, it is rewritten with the 90% most
+    recently added or used ones. Indexes of other fingerprints are removed.
+    """
+
+    def __init__(
+        self,
+        fingerprint: str,
+        cache_dir: Path | None = None,
+        max_entries: int = _DEFAULT_MAX_CLEAN_ENTRIES,
+    ) -> None:
+        cache_dir = cache_dir if cache_dir is not None else default_cache_dir()
+        self.path: Path = cache_dir / f"clean-{fingerprint[:32]}"
+        self.max_entries: int = max_entries
+        self.skipped: int = 0
+        self._lock = threading.Lock()
+        self._tracked: dict[str, str] = {}
+        self._new: list[str] = []
+        self._used: set[str] = set()
+        # in file order, which is the order the entries were added in
+        try:
+            self._known: dict[str, None] = dict.fromkeys(
+                self.path.read_text("ascii").split()
+            )
+        except (OSError, UnicodeDecodeError):
+            self._known = {}
+
+    def load_git_shas(self) -> None:
+        """Learn the blob SHAs of the unmodified tracked files from git."""
+        from wformat.git import get_clean_blob_shas
+
+        self._tracked = {
+            _path_key(path): sha for path, sha in get_clean_blob_shas().items()
+        }
+
+    def tracked_sha(self, path: Path) -> str | None:
+        return self._tracked.get(_path_key(path))
+
+    def is_clean(self, path: Path, data: bytes | None = None) -> bool:
+        """
+        Whether path is known to be clean, judged by its git index entry or,
+        if data is given, by the SHA of data.
+        """
+        sha = self.tracked_sha(path) if data is None else git_blob_sha(data)
+        if sha is None or sha not in self._known:
+            return False
+        with self._lock:
+            self.skipped += 1
+            self._used.add(sha)
+        return True
+
+    def mark_clean(self, data: bytes) -> None:
+        sha = git_blob_sha(data)
+        with self._lock:
+            if sha not in self._known:
+                self._known[sha] = None
+                self._new.append(sha)
+
+    def save(self) -> None:
+        with self._lock:
+            new, self._new = self._new, []
+            compact = len(self._known) > self.max_entries
+            if compact:
+                self._known = dict.fromkeys(self._recent())
+        if not new and not compact:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if compact:
+                tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+                tmp_path.write_text(
+                    "".join(f"{sha}\n" for sha in self._known), "ascii"
+                )
+                os.replace(tmp_path, self.path)
+            else:
+                with open(self.path, "a", encoding="ascii") as f:
+                    f.write("".join(f"{sha}\n" for sha in new))
+        except OSError:
+            return
+        self._remove_stale()
+
+    def _recent(self) -> list[str]:
+        """The entries to keep when compacting, least recent first."""
+        used = [sha for sha in self._known if sha in self._used]
+        ordered = [sha for sha in self._known if sha not in self._used] + used
+        return ordered[len(ordered) - int(self.max_entries * 0.9) :]
+
+    def _remove_stale(self) -> None:
+        now = time.time()
+        try:
+            with os.scandir(self.path.parent) as entries:
+                stale = [
+                    entry.path
+                    for entry in entries
+                    if entry.name.startswith("clean-")
+                    and entry.name != self.path.name
+                    and now - entry.stat().st_mtime > _STALE_CLEAN_INDEX_SECONDS
+                ]
+        except OSError:
+            return
+        for path in stale:
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+
+    def print_stats(self) -> None:
+        sys.stderr.write(
+            f"-- Clean index: {self.skipped} known-clean file(s) skipped, "
+            f"{len(self._known)} known [{self.path}]\n"
+        )
+        sys.stderr.flush()
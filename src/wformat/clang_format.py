@@ -1,8 +1,9 @@
 from pathlib import Path
 import subprocess
 import traceback
+from typing import Sequence
 
-from wformat.utils import wheel_bin_path, wheel_data_path
+from wformat.utils import run_batched, wheel_bin_path, wheel_data_path
 
 
 class ClangFormat:
@@ -32,6 +33,25 @@ class ClangFormat:
             check=True,
         )
 
+    def format_many(self, file_paths: Sequence[Path]) -> dict[Path, str]:
+        """
+        format the given files in place with one clang-format process,
+        returns the error message of every file that failed
+        """
+
+        def run(paths: Sequence[Path]) -> "subprocess.CompletedProcess[bytes]":
+            return subprocess.run(
+                [
+                    str(self.exe_path),
+                    "-i",
+                    f"-style=file:{self.config_path}",
+                    *(str(p) for p in paths),
+                ],
+                capture_output=True,
+            )
+
+        return run_batched("clang-format", run, file_paths)
+
     def format_data(self, data: str) -> str:
         """
         Format in-memory source code and return the formatted text.
@@ -51,15 +71,20 @@ class ClangFormat:
         )
         return res.stdout
 
-    def args_for_stdin(self) -> list[str]:
+    def args_for_stdin(
+        self, lines: Sequence[tuple[int, int]] | None = None
+    ) -> list[str]:
         # Pretend the code comes from a .cpp file next to the config so
         # '-style=file' finds the config directory.
         assume_file = str(self.config_path.parent / "dummy.cpp")
-        return [
+        args = [
             str(self.exe_path),
             f"-style=file:{self.config_path}",
             f"-assume-filename={assume_file}",
         ]
+        # only reformat these 1-based inclusive line ranges
+        args += [f"--lines={first}:{last}" for first, last in lines or ()]
+        return args
 
     def self_clean_config(self) -> None:
         """
@@ -1,22 +1,98 @@
+from __future__ import annotations
+
 import argparse
-import re
 import sys
 from pathlib import Path
-from typing import Sequence
-
-from importlib import metadata as _metadata
+from typing import TYPE_CHECKING, Iterable, Iterator, Sequence
 
-from wformat.wformat import WFormat
-from wformat.daemon import WFormatDaemon
-from wformat.utils import (
-    valid_path_in_args,
-    search_files,
+from wformat.cache import cache_disabled_by_env
+from wformat.profile import active_profiler, enable_profiling, span
+from wformat.walker import filter_source_files, iter_source_files, read_file_list
+from wformat.git import (
     get_files_changed_against_branch,
+    get_lines_changed_against_branch,
     get_modified_files,
+    get_modified_lines,
     get_staged_files,
+    get_staged_lines,
     get_files_in_last_n_commits,
+    get_lines_in_last_n_commits,
     restage_files,
 )
+from wformat.utils import (
+    valid_jobs_in_args,
+    valid_path_in_args,
+    valid_timeout_in_args,
+)
+
+# the formatter, the daemon and the engine are imported where they are used,
+# so that --version, --help, --ls and the git listings start fast
+if TYPE_CHECKING:
+    from wformat.client import ServerClient
+    from wformat.normalizer import LineRange
+    from wformat.wformat import WFormat
+
+
+def _enable_cache(args: argparse.Namespace, wformat: WFormat) -> None:
+    if args.no_cache or cache_disabled_by_env():
+        return
+    wformat.enable_cache(Path(args.cache_dir) if args.cache_dir else None)
+
+
+def _set_timeouts(args: argparse.Namespace, wformat: WFormat) -> None:
+    from wformat.wformat import Timeouts
+
+    stage = args.stage_timeout
+    wformat.timeouts = Timeouts(stage, stage, stage, file=args.timeout)
+
+
+def _socket_path(args: argparse.Namespace) -> Path:
+    from wformat.client import default_socket_path
+
+    return Path(args.socket) if args.socket else default_socket_path()
+
+
+def _connect_server(args: argparse.Namespace) -> ServerClient | None:
+    """Connect to the shared server, starting it if needed, None on failure."""
+    from wformat.client import ServerClient
+
+    server_args = ["--serve-idle-timeout", str(args.serve_idle_timeout)]
+    if args.serve_jobs:
+        server_args += ["--serve-jobs", str(args.serve_jobs)]
+    if args.no_cache:
+        server_args.append("--no-cache")
+    if args.cache_dir:
+        server_args += ["--cache-dir", args.cache_dir]
+    if args.timeout:
+        server_args += ["--timeout", str(args.timeout)]
+    if args.stage_timeout:
+        server_args += ["--stage-timeout", str(args.stage_timeout)]
+    try:
+        return ServerClient.connect(
+            _socket_path(args), start=True, server_args=server_args
+        )
+    except OSError as e:
+        sys.stderr.write(
+            f"[Warning] wformat server unavailable, formatting in process: {e}\n"
+        )
+        return None
+
+
+def _write_profile(args: argparse.Namespace) -> None:
+    profiler = active_profiler()
+    if profiler is not None:
+        profiler.write(Path(args.profile))
+        profiler.print_summary()
+        sys.stderr.write(f"-- Profile trace written to {args.profile}\n")
+
+
+def _report(args: argparse.Namespace, wformat: WFormat) -> None:
+    if wformat.clean_index is not None:
+        wformat.clean_index.save()
+    if args.cache_stats and wformat.cache is not None:
+        wformat.cache.print_stats()
+        if wformat.clean_index is not None:
+            wformat.clean_index.print_stats()
 
 
 def cli_app(argv: Sequence[str] | None = None) -> int:
@@ -24,8 +100,6 @@ def cli_app(argv: Sequence[str] | None = None) -> int:
     if sys.version_info < (3, 0):
         sys.exit("This script requires Python 3 or higher.")
 
-    wformat = WFormat()
-
     parser = argparse.ArgumentParser(
         description=(
             "tutorials:\n\n"
@@ -44,6 +118,9 @@ def cli_app(argv: Sequence[str] | None = None) -> int:
             "format last N commits: (-c/--commits)\n"
             "   wformat -c N\n"
             "   → Formats files from last N commits in your Git repository.\n\n"
+            "format only the changed lines: (--lines-changed)\n"
+            "   wformat -a origin/develop --lines-changed\n"
+            "   → Formats just the lines that differ from origin/develop.\n\n"
         ),
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
@@ -84,6 +161,22 @@ def cli_app(argv: Sequence[str] | None = None) -> int:
         type=int,
         help="Run auto format on all files modified in the last N commits.",
     )
+    parser.add_argument(
+        "--lines-changed",
+        action="store_true",
+        help="With -a/-m/-s/-c, only format the lines changed in the git diff instead of whole files.",
+    )
+    parser.add_argument(
+        "--files-from",
+        metavar="FILE",
+        help="Read the paths to process from FILE ('-' for stdin), one per line.",
+    )
+    parser.add_argument(
+        "-0",
+        "--null",
+        action="store_true",
+        help="Paths read from --files-from or stdin are separated by NUL characters (find -print0, git ls-files -z).",
+    )
     parser.add_argument(
         "--all",
         action="store_true",
@@ -92,13 +185,59 @@ def cli_app(argv: Sequence[str] | None = None) -> int:
     parser.add_argument(
         "--check",
         action="store_true",
-        help="Only check the format correctness without changing files.",
+        help="Only check the format correctness without changing files, exit with 1 if any file needs formatting.",
+    )
+    parser.add_argument(
+        "--diff",
+        action="store_true",
+        help="With --check, print a unified diff for every file that needs formatting.",
+    )
+    parser.add_argument(
+        "--fail-fast",
+        action="store_true",
+        help="With --check, stop at the first file that needs formatting.",
     )
     parser.add_argument(
         "--serial",
         action="store_true",
         help="Run in serial mode or not. By default, script will use multi threading.",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=valid_jobs_in_args,
+        metavar="N|auto",
+        help="Number of files formatted in parallel. 'auto' sizes it by the cores the current load leaves idle (default: (cpu-1)/2).",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Run clang-format, uncrustify and the normalizer as pipelined stages with their own workers and report per-stage utilization.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        metavar="N",
+        help="With --pipeline, format files in place in chunks of N with one clang-format and one uncrustify process per chunk.",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=valid_timeout_in_args,
+        metavar="SECONDS",
+        help="Give up on a file that takes longer than SECONDS to format, its tools are killed (see --on-timeout).",
+    )
+    parser.add_argument(
+        "--stage-timeout",
+        type=valid_timeout_in_args,
+        metavar="SECONDS",
+        help="Give up on a file when clang-format, uncrustify or tree-sitter alone takes longer than SECONDS on it.",
+    )
+    parser.add_argument(
+        "--on-timeout",
+        choices=("fail", "skip", "retry"),
+        default="fail",
+        help="What a file that timed out counts as: an error (fail), nothing (skip), or retry it once with doubled timeouts after all other files (default: %(default)s).",
+    )
     parser.add_argument(
         "--ls",
         action="store_true",
@@ -114,6 +253,67 @@ def cli_app(argv: Sequence[str] | None = None) -> int:
         action="store_true",
         help="Run a persistent stdio server (JSON Lines) for IDE integration.",
     )
+    parser.add_argument(
+        "--serve-jobs",
+        type=int,
+        metavar="N",
+        help="Maximum number of requests --serve formats concurrently (default: (cpu-1)/2, at most 4).",
+    )
+    parser.add_argument(
+        "--serve-max-sessions",
+        type=int,
+        metavar="N",
+        default=32,
+        help="Maximum number of open documents --serve keeps state for (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--serve-stats-interval",
+        type=float,
+        metavar="SECONDS",
+        help="With --serve, write the daemon stats to stderr every SECONDS.",
+    )
+    parser.add_argument(
+        "--serve-socket",
+        action="store_true",
+        help="Run a server shared by all wformat clients of this user on a Unix domain socket (see --socket).",
+    )
+    parser.add_argument(
+        "--serve-idle-timeout",
+        type=float,
+        metavar="SECONDS",
+        default=600,
+        help="With --serve-socket, stop after SECONDS without clients, 0 to never stop (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--use-server",
+        action="store_true",
+        help="Format --stdin input and whole files on the shared server instead of in this process, starting the server if none is running.",
+    )
+    parser.add_argument(
+        "--socket",
+        metavar="PATH",
+        help="Socket of --serve-socket and --use-server (default: one per user and installation, or WFORMAT_SOCKET).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not use the on-disk cache of formatted results and known-clean files (or set WFORMAT_NO_CACHE=1).",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        help="Location of the formatted results cache (default: per-user cache dir, or WFORMAT_CACHE_DIR).",
+    )
+    parser.add_argument(
+        "--cache-stats",
+        action="store_true",
+        help="Print cache hit/miss counts and skipped known-clean files to stderr when done.",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="Write a Chrome/Perfetto trace of every file and stage to FILE and print the slowest files to stderr.",
+    )
     parser.add_argument(
         "-v",
         "--version",
@@ -123,16 +323,24 @@ def cli_app(argv: Sequence[str] | None = None) -> int:
 
     args = parser.parse_args(argv)
 
+    if args.profile:
+        enable_profiling()
+    # early returns, the server paths and errors write the trace too
+    try:
+        return _dispatch(parser, args)
+    finally:
+        _write_profile(args)
+
+
+def _dispatch(parser: argparse.ArgumentParser, args: argparse.Namespace) -> int:
     if len(sys.argv) == 1:
         parser.print_help()
         return 0
 
     if args.version:
-        try:
-            ver = _metadata.version("wformat")
-        except Exception:
-            # fallback import (should already work) but just in case reuse package attr
-            from wformat import __version__ as ver  # type: ignore
+        # distribution metadata, or pyproject.toml in a source checkout
+        from wformat import __version__ as ver
+
         print(ver)
         return 0
 
@@ -140,84 +348,212 @@ def cli_app(argv: Sequence[str] | None = None) -> int:
         if sys.stdin.isatty():
             sys.stderr.write("[Error] --stdin used but no input piped\n")
             return 64  # EX_USAGE
-        sys.exit(wformat.run_stdin_pipeline())
+        client = _connect_server(args) if args.use_server else None
+        if client is not None:
+            from wformat.client import ServerError
+
+            with client:
+                try:
+                    out = client.format_source(sys.stdin.buffer.read())
+                except (OSError, ServerError) as e:
+                    sys.stderr.write(f"[Error] wformat server: {e}\n")
+                    sys.exit(1)
+            sys.stdout.buffer.write(out)
+            sys.stdout.flush()
+            sys.exit(0)
+        from wformat.wformat import WFormat
+
+        wformat = WFormat()
+        _enable_cache(args, wformat)
+        _set_timeouts(args, wformat)
+        rc = wformat.run_stdin_pipeline()
+        _report(args, wformat)
+        sys.exit(rc)
 
     if args.serve:
-        sys.exit(WFormatDaemon(wformat).serve())
+        from wformat.daemon import WFormatDaemon
+        from wformat.wformat import WFormat
+
+        wformat = WFormat()
+        _enable_cache(args, wformat)
+        _set_timeouts(args, wformat)
+        rc = WFormatDaemon(
+            wformat,
+            max_workers=args.serve_jobs,
+            max_sessions=args.serve_max_sessions,
+            stats_interval=args.serve_stats_interval,
+        ).serve()
+        _report(args, wformat)
+        sys.exit(rc)
+
+    if args.serve_socket:
+        from wformat.server import WFormatServer
+        from wformat.wformat import WFormat
+
+        wformat = WFormat()
+        _enable_cache(args, wformat)
+        _set_timeouts(args, wformat)
+        rc = WFormatServer(
+            wformat,
+            _socket_path(args),
+            max_workers=args.serve_jobs,
+            max_sessions=args.serve_max_sessions,
+            idle_timeout=args.serve_idle_timeout,
+            stats_interval=args.serve_stats_interval,
+        ).serve()
+        _report(args, wformat)
+        sys.exit(rc)
 
     file_paths: list[Path] = []
+    # a directory walk or --files-from is streamed to the workers as it goes
+    streamed: Iterator[Path] | None = None
+    # --lines-changed: the changed line ranges of every file
+    changed_lines: dict[Path, list[LineRange]] | None = None
 
-    if not sys.stdin.isatty():
-        for line in sys.stdin:
-            file_paths += [Path(line.strip())]
+    if args.files_from:
+        if args.files_from == "-":
+            file_list = read_file_list(sys.stdin, args.null)
+        else:
+            file_list = read_file_list(
+                open(args.files_from, encoding="utf-8", newline=""), args.null
+            )
+        streamed = filter_source_files(file_list)
+    elif not sys.stdin.isatty():
+        file_paths = list(read_file_list(sys.stdin, args.null))
 
-    if len(file_paths) == 0:
+    if streamed is None and len(file_paths) == 0:
         file_paths = [Path(path) for path in args.paths]
         if len(file_paths) > 1000:
-            print("[Warning] Could break console command length limit.")
+            print(
+                "[Warning] Could break console command length limit, use --files-from instead."
+            )
             return 0
 
-    if args.all:
+    if streamed is not None:
+        print(f"-- Will read the files to process from {args.files_from}")
+    elif args.all:
         print(f"-- Will do recursive search for related files from ./")
-        file_paths = search_files(Path("./"))
+        streamed = iter_source_files(Path("./"))
     elif args.dir:
         print(f"-- Will do recursive search for related files from {args.dir}")
-        file_paths = search_files(Path(args.dir))
+        streamed = iter_source_files(Path(args.dir))
     elif args.against:
         print(
             f"-- Will search files changed compared to branch '{args.against}' (merge-base diff)"
         )
-        file_paths = get_files_changed_against_branch(args.against)
+        if args.lines_changed:
+            changed_lines = get_lines_changed_against_branch(args.against)
+        else:
+            file_paths = get_files_changed_against_branch(args.against)
     elif len(sys.argv) == 1 or args.modified:
         print(f"-- Will search modified and not yet staged files by git")
-        file_paths = get_modified_files()
+        if args.lines_changed:
+            changed_lines = get_modified_lines()
+        else:
+            file_paths = get_modified_files()
     elif args.staged:
         print(f"-- Will search staged files by git")
-        file_paths = get_staged_files()
+        if args.lines_changed:
+            changed_lines = get_staged_lines()
+        else:
+            file_paths = get_staged_files()
     elif args.commits:
         print(f"-- Will search files changed in the last {args.commits} commits by git")
-        file_paths = get_files_in_last_n_commits(args.commits)
+        if args.lines_changed:
+            changed_lines = get_lines_in_last_n_commits(args.commits)
+        else:
+            file_paths = get_files_in_last_n_commits(args.commits)
 
-    if len(file_paths) == 0:
-        print("[Warning] No file found for formatting")
-        return 0
+    if changed_lines is not None:
+        file_paths = list(changed_lines)
 
-    print(f"-- {len(file_paths)} file paths provided")
+    if streamed is None:
+        if len(file_paths) == 0:
+            print("[Warning] No file found for formatting")
+            return 0
 
-    file_paths = [
-        file_path
-        for file_path in file_paths
-        if file_path.is_file()
-        and file_path.exists()
-        and re.match(r"^.*(?<!\.pb)\.(h|cpp)$", str(file_path.resolve()))
-    ]
+        print(f"-- {len(file_paths)} file paths provided")
 
-    if len(file_paths) == 0:
-        print("[Warning] No file found for formatting")
-        return 0
+        with span("filter_source_files", files=len(file_paths)):
+            file_paths = list(filter_source_files(file_paths))
 
-    print(f"-- {len(file_paths)} file paths matched criteria")
+        if len(file_paths) == 0:
+            print("[Warning] No file found for formatting")
+            return 0
+
+        print(f"-- {len(file_paths)} file paths matched criteria")
 
     if args.ls:
-        for p in file_paths:
+        for p in streamed if streamed is not None else file_paths:
             print(p)
         return 0
 
+    targets: Iterable[Path] = streamed if streamed is not None else file_paths
+    git_files = bool(args.modified or args.staged or args.commits or args.against)
+
+    # the server formats whole files only, line ranges and --pipeline run here
+    client = (
+        _connect_server(args)
+        if args.use_server and changed_lines is None and not args.pipeline
+        else None
+    )
+    if client is not None:
+        from wformat.client import format_files_with_server
+
+        print(f"-- Formatting on the wformat server at {_socket_path(args)}")
+        with client:
+            failed = format_files_with_server(
+                client, targets, args.check, args.diff, args.fail_fast
+            )
+        if git_files and not args.check:
+            restage_files(file_paths)
+        return 1 if failed else 0
+
+    from wformat.wformat import WFormat, auto_jobs
+
+    wformat = WFormat()
+    _enable_cache(args, wformat)
+    _set_timeouts(args, wformat)
+    if wformat.clean_index is not None and changed_lines is None:
+        # known-clean tracked files are then skipped without being read
+        wformat.clean_index.load_git_shas()
+    jobs: int | None = auto_jobs() if args.jobs == "auto" else args.jobs
+
     if args.check:
-        (
-            wformat.format_inplace_many_mt(file_paths)
-            if not args.serial
-            else wformat.format_inplace_many(file_paths)
+        failed = wformat.check_many(
+            targets,
+            1 if args.serial else jobs,
+            diff=args.diff,
+            fail_fast=args.fail_fast,
+            lines=changed_lines,
+            on_timeout=args.on_timeout,
         )
-        return 0
+        _report(args, wformat)
+        return 1 if failed else 0
 
-    (
-        wformat.format_inplace_many_mt(file_paths)
-        if not args.serial
-        else wformat.format_inplace_many(file_paths)
-    )
+    # files that failed or timed out fail the run, like --check does
+    failed = 0
+    if changed_lines is not None:
+        failed = wformat.format_inplace_many_mt(
+            targets,
+            1 if args.serial else jobs,
+            lines=changed_lines,
+            on_timeout=args.on_timeout,
+        )
+    elif args.pipeline and not args.serial:
+        from wformat.engine import PipelineEngine
+
+        engine = PipelineEngine(wformat, jobs, jobs, batch_size=args.batch_size)
+        failed = engine.run(targets, args.on_timeout)
+    elif not args.serial:
+        failed = wformat.format_inplace_many_mt(
+            targets, jobs, on_timeout=args.on_timeout
+        )
+    else:
+        wformat.format_inplace_many(targets)
 
-    if args.modified or args.staged or args.commits or args.against:
+    if git_files:
         restage_files(file_paths)
 
-    return 0
+    _report(args, wformat)
+    return 1 if failed else 0
@@ -0,0 +1,351 @@
+import base64
+import hashlib
+import json
+import os
+from pathlib import Path
+import socket
+import stat
+import sys
+import time
+from typing import Any, Iterable, Sequence
+
+from wformat.encoding import join_bom, native_newlines, split_bom, universal_newlines
+from wformat.utils import wheel_bin_path, wheel_data_path
+
+# keep in sync with WFormatDaemon._MAX_REQUEST_BYTES, the client must not
+# import the daemon (and with it the formatter) to know it
+_MAX_REQUEST_BYTES = 16 * 1024 * 1024
+# one format_many request carries at most this many files or source bytes
+_BATCH_FILES = 64
+_BATCH_BYTES = 4 * 1024 * 1024
+
+
+class ServerError(Exception):
+    """An error reply of the wformat server."""
+
+
+def _toolchain_signature() -> bytes:
+    """
+    Cheap stand-in for WFormat.fingerprint: the wformat version and the
+    size and mtime of every packaged tool and config, without hashing them.
+    """
+    from wformat import __version__
+
+    parts = [f"wformat {__version__}"]
+    directories = (
+        wheel_bin_path("clang-format").parent,
+        wheel_data_path("uncrustify.cfg").parent,
+    )
+    for directory in directories:
+        try:
+            entries = sorted(directory.iterdir())
+        except OSError:
+            continue
+        for entry in entries:
+            st = entry.stat()
+            parts.append(f"{entry.name} {st.st_size} {st.st_mtime_ns}")
+    return "\0".join(parts).encode("utf-8")
+
+
+def default_socket_path() -> Path:
+    """
+    Socket of the shared server of this user. Every wformat installation
+    and toolchain has its own, so a server never formats with another
+    version's tools; one left behind by an upgrade stops when idle.
+    WFORMAT_SOCKET overrides it.
+    """
+    env = os.environ.get("WFORMAT_SOCKET")
+    if env:
+        return Path(env)
+    h = hashlib.sha1(str(Path(__file__).resolve().parent).encode("utf-8"))
+    h.update(b"\0" + _toolchain_signature())
+    name = f"wformat-{h.hexdigest()[:12]}.sock"
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return Path(runtime) / name
+    tmp = os.environ.get("TMPDIR", "/tmp")
+    return Path(tmp) / f"wformat-{os.getuid()}" / name
+
+
+def _server_argv() -> list[str]:
+    # a frozen build is the wformat binary itself, it takes no -m
+    if getattr(sys, "frozen", False):
+        return [sys.executable]
+    return [sys.executable, "-m", "wformat"]
+
+
+def _check_private(path: Path) -> None:
+    """
+    Refuse a socket that another user could have put in place: its
+    directory must belong to this user and be closed to everyone else,
+    and so must the socket, if it exists.
+    """
+    uid = os.getuid()
+    directory = path.parent.stat()
+    if directory.st_uid != uid or directory.st_mode & 0o077:
+        raise PermissionError(
+            f"{path.parent} must belong to this user and have mode 0700"
+        )
+    try:
+        sock = path.lstat()
+    except FileNotFoundError:
+        return
+    if sock.st_uid != uid or not stat.S_ISSOCK(sock.st_mode):
+        raise PermissionError(f"{path} is not a socket of this user")
+
+
+def start_server(path: Path, server_args: Sequence[str] = ()) -> None:
+    """Start a detached server on path, its stderr goes to <path>.log."""
+    import subprocess
+
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    _check_private(path)
+    with open(path.with_suffix(".log"), "ab") as log:
+        subprocess.Popen(
+            _server_argv()
+            + ["--serve-socket", "--socket", str(path)]
+            + list(server_args),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=log,
+            start_new_session=True,
+        )
+
+
+def _connect(path: Path) -> socket.socket:
+    if not hasattr(socket, "AF_UNIX"):
+        raise OSError("Unix domain sockets are not supported on this platform")
+    _check_private(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(path))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+class ServerClient:
+    """
+    Blocking client of a shared wformat server (see wformat.server). It
+    speaks the JSON Lines protocol of WFormatDaemon, one request at a time,
+    and needs neither tree-sitter nor the formatter in this process.
+    """
+
+    def __init__(self, sock: socket.socket) -> None:
+        self._sock = sock
+        self._reader = sock.makefile("rb")
+        self._next_id = 0
+
+    @classmethod
+    def connect(
+        cls,
+        path: Path | None = None,
+        start: bool = False,
+        server_args: Sequence[str] = (),
+        timeout: float = 10.0,
+    ) -> "ServerClient":
+        """
+        Connect to the server on path (default_socket_path by default). With
+        start, a server is started with server_args if none is listening.
+        """
+        path = path or default_socket_path()
+        try:
+            return cls(_connect(path))
+        except (FileNotFoundError, ConnectionRefusedError):
+            if not start:
+                raise
+        start_server(path, server_args)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return cls(_connect(path))
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    raise ConnectionError(
+                        f"no wformat server came up on {path}, see "
+                        f"{path.with_suffix('.log')}"
+                    ) from None
+                time.sleep(0.02)
+
+    def __enter__(self) -> "ServerClient":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._reader.close()
+        self._sock.close()
+
+    def _send(self, req: dict[str, Any]) -> None:
+        self._sock.sendall(json.dumps(req).encode("utf-8") + b"\n")
+
+    def _receive(self) -> dict[str, Any]:
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("the wformat server closed the connection")
+        return json.loads(line)
+
+    def request(self, req: dict[str, Any]) -> dict[str, Any]:
+        """Send one request and return its reply, ServerError if it failed."""
+        self._next_id += 1
+        self._send(dict(req, id=self._next_id))
+        reply = self._receive()
+        if not reply.get("ok"):
+            raise ServerError(reply.get("error", "unknown error"))
+        return reply
+
+    def shutdown(self) -> None:
+        """Stop the server once its in-flight requests are answered."""
+        self._send({"op": "shutdown"})
+        self._receive()
+
+    def format_bytes(self, data: bytes) -> bytes:
+        """Format source bytes, like WFormat.format_bytes."""
+        reply = self.request(
+            {"op": "format", "b64": base64.b64encode(data).decode("ascii")}
+        )
+        return base64.b64decode(reply["b64"])
+
+    def format_many(self, docs: Sequence[bytes]) -> list[bytes | ServerError]:
+        """
+        Format several sources concurrently, the results in docs order.
+        While the server is busy with other batches, the batch is sent
+        again until it is taken.
+        """
+        request = {
+            "op": "format_many",
+            "docs": [{"b64": base64.b64encode(d).decode("ascii")} for d in docs],
+        }
+        delay = 0.05
+        while True:
+            results = self._format_many(request, len(docs))
+            if results is not None:
+                return results
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    def _format_many(
+        self, request: dict[str, Any], count: int
+    ) -> list[bytes | ServerError] | None:
+        self._next_id += 1
+        self._send(dict(request, id=self._next_id))
+        results: list[bytes | ServerError] = [ServerError("no reply")] * count
+        while True:
+            reply = self._receive()
+            if "index" not in reply:
+                if reply.get("error") == "busy":
+                    return None
+                if not reply.get("ok"):
+                    raise ServerError(reply.get("error", "unknown error"))
+                return results
+            if reply.get("ok"):
+                results[reply["index"]] = base64.b64decode(reply["b64"])
+            else:
+                results[reply["index"]] = ServerError(reply.get("error"))
+
+    def format_source(self, raw: bytes) -> bytes:
+        """Format the bytes of a source file, like WFormat._format_source."""
+        out = self.format_sources([raw])[0]
+        if isinstance(out, ServerError):
+            raise out
+        return out
+
+    def format_sources(self, raws: Sequence[bytes]) -> list[bytes | ServerError]:
+        """
+        Format the bytes of several source files concurrently, with the
+        newline translation of text mode reads and writes.
+        """
+        boms: list[bytes] = []
+        bodies: list[bytes] = []
+        for raw in raws:
+            bom, body = split_bom(raw)
+            boms.append(bom)
+            bodies.append(universal_newlines(body))
+        return [
+            out if isinstance(out, ServerError) else join_bom(bom, native_newlines(out))
+            for bom, out in zip(boms, self.format_many(bodies))
+        ]
+
+
+def _batches(
+    file_paths: Iterable[Path],
+) -> Iterable[list[tuple[Path, bytes | OSError]]]:
+    # a file that cannot be read comes with its error, for the caller to report
+    batch: list[tuple[Path, bytes | OSError]] = []
+    size = 0
+    for p in file_paths:
+        try:
+            raw: bytes | OSError = p.read_bytes()
+        except OSError as e:
+            raw = e
+        if batch and (len(batch) >= _BATCH_FILES or size + len(raw) > _BATCH_BYTES):
+            yield batch
+            batch, size = [], 0
+        batch.append((p, raw))
+        size += 0 if isinstance(raw, OSError) else len(raw)
+    if batch:
+        yield batch
+
+
+def format_files_with_server(
+    client: ServerClient,
+    file_paths: Iterable[Path],
+    check: bool = False,
+    diff: bool = False,
+    fail_fast: bool = False,
+) -> int:
+    """
+    Format files in place (or with check, only compare them) on the server.
+    Returns the number of files that failed or, with check, need formatting.
+    """
+    done = 0
+    failed: list[Path] = []
+    for batch in _batches(file_paths):
+        sources: list[tuple[Path, bytes]] = []
+        for p, raw in batch:
+            if isinstance(raw, OSError):
+                failed.append(p)
+                print(f"-- ERROR while processing {p}: {raw!r}")
+            elif len(raw) > _MAX_REQUEST_BYTES:
+                failed.append(p)
+                print(f"-- ERROR while processing {p}: too large for the server")
+            else:
+                sources.append((p, raw))
+        if not sources:
+            continue
+        outs = client.format_sources([raw for _, raw in sources])
+        for (p, raw), formatted in zip(sources, outs):
+            done += 1
+            if isinstance(formatted, ServerError):
+                failed.append(p)
+                print(f"-- ERROR while processing {p}: {formatted}")
+                continue
+            if not check:
+                try:
+                    if formatted != raw:
+                        p.write_bytes(formatted)
+                except OSError as e:
+                    failed.append(p)
+                    print(f"-- ERROR while processing {p}: {e!r}")
+                    continue
+                print(f"-- [{done}] {p}")
+            elif formatted != raw:
+                failed.append(p)
+                print(f"-- Needs formatting: {p}")
+                if diff:
+                    from wformat.wformat import _source_text, _unified_diff
+
+                    print(_unified_diff(p, _source_text(formatted)), end="")
+        if check and failed and fail_fast:
+            print("-- Stopped at the first violation (--fail-fast)")
+            return len(failed)
+    if not check:
+        if done == 0:
+            print("-- No files to process")
+    elif failed:
+        print(f"-- {len(failed)} of {done} file(s) need formatting")
+    else:
+        print(f"-- All {done} file(s) are formatted")
+    return len(failed)
@@ -1,10 +1,152 @@
 import base64
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 import json
+import multiprocessing
+import queue
+import struct
 import sys
+import threading
+import time
 import traceback
-from typing import Any
+from typing import Any, BinaryIO
 
-from wformat.wformat import WFormat
+from wformat.encoding import split_lines
+from wformat.normalizer import IncrementalNormalizer, LineRange
+from wformat.profile import add_span_listener, remove_span_listener
+from wformat.stats import DaemonStats
+from wformat.wformat import Cancellation, FormatCanceled, FormatTimeout, WFormat
+
+
+def default_daemon_workers() -> int:
+    # every format request runs a clang-format | uncrustify process pair
+    cpu = multiprocessing.cpu_count()
+    return max(1, min(4, (cpu - 1) // 2))
+
+
+# Binary framing: every request and reply is a 12 byte little-endian header
+# (id: u32, op: u8, status: u8, reserved: u16, length: u32) followed by
+# `length` payload bytes.
+FRAME_HEADER = struct.Struct("<IBBxxI")
+
+# payload is a JSON request object, the reply payload is a JSON reply object
+OP_JSON = 0
+# payload is raw UTF-8 source, the reply payload is the raw formatted source
+OP_FORMAT = 1
+OP_PING = 2
+OP_CANCEL = 3
+OP_SHUTDOWN = 4
+
+_FRAME_OPS: dict[int, str] = {
+    OP_FORMAT: "format",
+    OP_PING: "ping",
+    OP_CANCEL: "cancel",
+    OP_SHUTDOWN: "shutdown",
+}
+
+# every op a request may name, the rest are counted as "unknown"
+_OPS = frozenset(
+    {
+        "format",
+        "format_range",
+        "format_many",
+        "open",
+        "change",
+        "close",
+        "cancel",
+        "ping",
+        "stats",
+        "hello",
+        "shutdown",
+    }
+)
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+
+def encode_frame(rid: int, op: int, payload: bytes, status: int = STATUS_OK) -> bytes:
+    return FRAME_HEADER.pack(rid, op, status, len(payload)) + payload
+
+
+def byte_ranges_to_lines(data: bytes, ranges: list[tuple[int, int]]) -> list[LineRange]:
+    """Convert [start, end) byte offsets into 1-based inclusive line ranges."""
+    lines: list[LineRange] = []
+    for start, end in ranges:
+        start = min(max(start, 0), len(data))
+        end = min(max(end, start + 1), len(data))
+        first = data.count(b"\n", 0, start) + 1
+        last = first + data.count(b"\n", start, max(end - 1, start))
+        lines.append((first, last))
+    return lines
+
+
+def changed_region(old: str, new: str) -> tuple[int, int, str] | None:
+    """
+    The smallest block of whole lines of old that has to be replaced to get
+    new, as (first_line, last_line, replacement) with 1-based inclusive lines.
+    last_line is first_line - 1 for a pure insertion. None if old == new.
+    """
+    if old == new:
+        return None
+    old_lines = split_lines(old)
+    new_lines = split_lines(new)
+    prefix = 0
+    limit = min(len(old_lines), len(new_lines))
+    while prefix < limit and old_lines[prefix] == new_lines[prefix]:
+        prefix += 1
+    suffix = 0
+    while (
+        suffix < limit - prefix
+        and old_lines[len(old_lines) - 1 - suffix]
+        == new_lines[len(new_lines) - 1 - suffix]
+    ):
+        suffix += 1
+    replacement = "".join(new_lines[prefix : len(new_lines) - suffix])
+    return prefix + 1, len(old_lines) - suffix, replacement
+
+
+class _Session:
+    """An open document: its current text and incremental normalizer state."""
+
+    def __init__(self, data: bytes) -> None:
+        self.data: bytes = data
+        self.normalizer: IncrementalNormalizer = IncrementalNormalizer()
+        # one format at a time may use the normalizer's tree
+        self.lock = threading.Lock()
+
+    def apply_changes(self, edits: list[dict[str, Any]]) -> None:
+        """Apply {"start", "end", "b64"} byte-offset edits in order."""
+        data = self.data
+        for edit in edits:
+            start, end = int(edit["start"]), int(edit["end"])
+            if not 0 <= start <= end <= len(data):
+                raise ValueError(f"edit out of range: [{start}, {end})")
+            text = base64.b64decode(edit.get("b64", ""), validate=True)
+            data = data[:start] + text + data[end:]
+        self.data = data
+
+
+class _Batch:
+    """A format_many request: its cancellation and the documents left to answer."""
+
+    def __init__(self, rid: Any, frame: int | None, count: int) -> None:
+        self.rid: Any = rid
+        self.frame: int | None = frame
+        self.count: int = count
+        self.remaining: int = count
+        self.cancel: Cancellation = Cancellation()
+        # stands for the whole batch in _inflight, already running so that
+        # a cancel kills the documents instead of dropping the batch
+        self.future: Future = Future()
+        self.future.set_running_or_notify_cancel()
+        self._lock = threading.Lock()
+
+    def finish_one(self) -> bool:
+        """Count one document as answered, True for the last one."""
+        with self._lock:
+            self.remaining -= 1
+            return self.remaining == 0
 
 
 class WFormatDaemon:
@@ -12,96 +154,738 @@ class WFormatDaemon:
     Persistent stdio daemon for wformat.
     JSON Lines protocol (one JSON object per line).
 
+    Requests are read continuously and formatted on a bounded worker pool,
+    so replies may arrive out of order; clients match them by "id".
+
     Requests:
     {"id": 1, "op": "format", "b64": "<source>"}
     {"id": 2, "op": "ping"}
+    {"id": 1, "op": "cancel"}  # cancel the pending format request with id 1
+    {"id": 3, "op": "hello", "framing": "binary"}
+    {"id": 4, "op": "format_range", "b64": "<source>", "lines": [[10, 12]]}
+    {"id": 5, "op": "format_range", "b64": "<source>", "bytes": [[120, 180]]}
+    {"id": 6, "op": "open", "doc": "file:///a.cpp", "b64": "<source>"}
+    {"id": 7, "op": "change", "doc": "file:///a.cpp",
+     "edits": [{"start": 10, "end": 12, "b64": "<text>"}]}
+    {"id": 8, "op": "format", "doc": "file:///a.cpp"}
+    {"id": 9, "op": "close", "doc": "file:///a.cpp"}
+    {"id": 10, "op": "stats"}
+    {"id": 11, "op": "format_many",
+     "docs": [{"b64": "<source>"}, {"doc": "file:///a.cpp"}]}
     {"op": "shutdown"}
 
     Replies:
     {"id": 1, "ok": true,  "b64": "<formatted>"}
     {"id": 1, "ok": false, "error": "<message>"}
+    {"id": 1, "ok": false, "error": "canceled"}  # the canceled request's reply
     {"id": 2, "ok": true}
-    {"ok": true}  # for shutdown
+    {"id": 3, "ok": true, "framing": "binary"}
+    {"id": 4, "ok": true, "start_line": 10, "end_line": 13, "b64": "<lines>"}
+    {"id": 5, "ok": true, "unchanged": true}
+    {"id": 6, "ok": true}  # same for change and close
+    {"id": 8, "ok": false, "error": "unknown document"}  # evicted, open again
+    {"id": 10, "ok": true, "stats": {"requests": {"format": 3}, ...}}
+    {"id": 11, "index": 1, "ok": true, "b64": "<formatted>"}  # one per doc
+    {"id": 11, "index": 0, "ok": false, "error": "<message>"}
+    {"id": 11, "ok": true, "done": true, "count": 2}  # after all docs
+    {"ok": true}  # for shutdown, sent after in-flight requests are answered
+
+    "cancel" has no reply of its own. A queued request is dropped, a running
+    one has its clang-format/uncrustify processes killed. Either way the
+    canceled request is answered with error "canceled", unless it already
+    finished, in which case its normal reply has been sent.
+
+    "hello" with "framing": "binary" switches both directions to binary
+    frames (see FRAME_HEADER) right after its JSON reply. It is only
+    accepted while no other request is in flight. In binary mode OP_FORMAT
+    carries raw UTF-8 in and out, and any other JSON request can be sent
+    as an OP_JSON frame.
+
+    "format_range" formats only the given lines (1-based, inclusive) or byte
+    ranges ([start, end) offsets into the UTF-8 source). Its reply carries
+    just the affected region: lines start_line..end_line of the original
+    source are to be replaced by the "b64" text (end_line is start_line - 1
+    for a pure insertion).
+
+    "open"/"change"/"close" keep document sessions. "change" edits are
+    [start, end) byte offsets applied in order, like editor change events.
+    "format" and "format_range" with "doc" instead of "b64" format the
+    session's current text; the session remembers the last tree-sitter tree
+    so only changed regions are normalized again. Formatting does not
+    update the session text, the client sends the resulting change. Only
+    the most recently used sessions are kept (see max_sessions and
+    max_session_bytes).
+
+    "format_many" formats a list of documents, each given by "b64" or by an
+    open session's "doc", concurrently on the worker pool. Every document
+    is answered as soon as it is done, by its "index" in "docs" and in any
+    order, and a final "done" reply follows the last one. "cancel" with the
+    batch id cancels the documents that are still queued or running. While
+    other batches hold more than _MAX_BATCH_BYTES of sources, a batch is
+    refused as "busy" and can be sent again later.
+
+    "stats" reports request counts per op, error counts per kind, bytes in
+    and out, p50/p95/p99 latency per stage ("queue", the time from reading
+    a request to a worker picking it up, the ops and the formatter stages),
+    the queue depth, and current and peak memory. With stats_interval the
+    same object is also written to stderr as {"stats": {...}} periodically.
     """
 
     _MAX_REQUEST_BYTES = 16 * 1024 * 1024
+    # base64 of the largest request plus room for the JSON envelope
+    _MAX_LINE_BYTES = _MAX_REQUEST_BYTES * 4 // 3 + 4096
+    # sources of format_many batches queued or running, a bound in place of
+    # the worker slots the reader cannot wait for
+    _MAX_BATCH_BYTES = 4 * _MAX_REQUEST_BYTES
+    _MAX_BATCH_DOCS = 4096
+    # what a queued document costs beyond its source
+    _BATCH_DOC_BYTES = 4096
 
-    def __init__(self, formatter: WFormat) -> None:
+    def __init__(
+        self,
+        formatter: WFormat,
+        max_workers: int | None = None,
+        max_sessions: int = 32,
+        max_session_bytes: int = 128 * 1024 * 1024,
+        stats_interval: float | None = None,
+        stats: DaemonStats | None = None,
+    ) -> None:
         self.wformat: WFormat = formatter
+        self.max_workers: int = max(1, max_workers or default_daemon_workers())
+        self.max_sessions: int = max(1, max_sessions)
+        self.max_session_bytes: int = max_session_bytes
+        # least recently used first, only touched by the reader thread
+        self._sessions: "OrderedDict[Any, _Session]" = OrderedDict()
+        self._replies: "queue.Queue[bytes | None]" = queue.Queue()
+        # bounds requests that are queued or running, the reader blocks beyond it
+        self._slots = threading.BoundedSemaphore(self.max_workers * 2)
+        self._inflight: dict[Any, tuple[Future, Cancellation, int | None]] = {}
+        self._inflight_lock = threading.Lock()
+        self._pending: int = 0
+        self._batch_bytes: int = 0
+        self._binary: bool = False
+        self.stats: DaemonStats = stats or DaemonStats()
+        self.stats_interval: float | None = stats_interval
 
-    def _reply(self, obj: dict[str, Any]) -> None:
-        sys.stdout.write(json.dumps(obj, ensure_ascii=False) + "\n")
-        sys.stdout.flush()
+    def _reply(self, obj: dict[str, Any], frame: int | None = None) -> None:
+        """
+        Queue a reply. frame is None for JSON Lines, otherwise the op of the
+        binary frame being answered. A raw "data" payload is sent as "b64"
+        in JSON and as the frame payload in binary mode.
+        """
+        if "data" in obj:
+            self.stats.sent(len(obj["data"]))
+        if frame is None or frame == OP_JSON:
+            if "data" in obj:
+                obj = dict(obj)
+                obj["b64"] = base64.b64encode(obj.pop("data")).decode("ascii")
+            line = json.dumps(obj, ensure_ascii=False).encode("utf-8") + b"\n"
+            if frame is None:
+                self._send(line)
+                return
+            payload = line
+            status = STATUS_OK if obj.get("ok") else STATUS_ERROR
+        elif obj.get("ok"):
+            payload = obj.get("data", b"")
+            status = STATUS_OK
+        else:
+            payload = str(obj.get("error", "")).encode("utf-8")
+            status = STATUS_ERROR
+        rid = obj.get("id")
+        self._send(
+            encode_frame(rid if isinstance(rid, int) else 0, frame, payload, status)
+        )
 
-    def _reply_err(self, msg: str, rid: int | None = None) -> None:
+    def _send(self, data: bytes) -> None:
+        """Hand an encoded reply to the writer, from any thread."""
+        self._replies.put(data)
+
+    def _reply_err(
+        self,
+        msg: str,
+        rid: int | None = None,
+        frame: int | None = None,
+        index: int | None = None,
+    ) -> None:
+        self.stats.error(msg.split(":", 1)[0])
         payload: dict[str, Any] = {"ok": False, "error": msg}
         if rid is not None:
             payload["id"] = rid
-        self._reply(payload)
+        if index is not None:
+            payload["index"] = index
+        self._reply(payload, frame)
 
-    def serve(self) -> int:
+    def _writer(self) -> None:
+        # the only thread that touches stdout, so replies never interleave
+        out = sys.stdout.buffer
+        while True:
+            data = self._replies.get()
+            if data is None:
+                return
+            out.write(data)
+            out.flush()
+
+    def _format(
+        self,
+        rid: int | None,
+        in_bytes: bytes,
+        session: _Session | None,
+        frame: int | None,
+        index: int | None,
+        cancel: Cancellation,
+    ) -> None:
         try:
-            for raw in sys.stdin:
-                line = raw.strip()
-                if not line:
-                    continue
-                try:
-                    req = json.loads(line)
-                except Exception as e:
-                    self._reply_err(f"bad json: {e.__class__.__name__}: {e}")
-                    continue
+            if session is None:
+                out = self.wformat.format_bytes(in_bytes, cancel)
+            else:
+                with session.lock:
+                    out = self.wformat.format_bytes(
+                        in_bytes, cancel, session.normalizer
+                    )
+        except FormatCanceled:
+            self._reply_err("canceled", rid, frame, index)
+            return
+        except FormatTimeout as e:
+            self._reply_err(f"timeout: {e}", rid, frame, index)
+            return
+        except Exception:
+            sys.stderr.write("format failed:\n")
+            sys.stderr.write(traceback.format_exc())
+            sys.stderr.flush()
+            self._reply_err("internal error", rid, frame, index)
+            return
+        sys.stderr.flush()
+        reply: dict[str, Any] = {"id": rid, "ok": True, "data": out}
+        if index is not None:
+            reply["index"] = index
+        self._reply(reply, frame)
 
-                op = req.get("op")
-                rid = req.get("id")
+    def _format_item(
+        self,
+        batch: _Batch,
+        index: int,
+        in_bytes: bytes,
+        session: _Session | None,
+        cancel: Cancellation,
+    ) -> None:
+        try:
+            self._format(batch.rid, in_bytes, session, batch.frame, index, cancel)
+        finally:
+            with self._inflight_lock:
+                self._batch_bytes -= len(in_bytes) + self._BATCH_DOC_BYTES
+            self._finish_item(batch)
 
-                try:
-                    if op == "shutdown":
-                        self._reply({"ok": True})
-                        return 0
+    def _finish_item(self, batch: _Batch) -> None:
+        if not batch.finish_one():
+            return
+        with self._inflight_lock:
+            if self._inflight.get(batch.rid, (None,))[0] is batch.future:
+                del self._inflight[batch.rid]
+        batch.future.set_result(None)
+        self._reply(
+            {"id": batch.rid, "ok": True, "done": True, "count": batch.count},
+            batch.frame,
+        )
 
-                    if op == "ping":
-                        self._reply({"id": rid, "ok": True})
-                        continue
+    def _format_many(
+        self,
+        executor: ThreadPoolExecutor,
+        rid: Any,
+        req: dict[str, Any],
+        frame: int | None,
+    ) -> None:
+        docs = req.get("docs")
+        if not isinstance(docs, list) or not docs:
+            self._reply_err("missing 'docs'", rid, frame)
+            return
+        if len(docs) > self._MAX_BATCH_DOCS:
+            self._reply_err("too many documents", rid, frame)
+            return
+        items = [self._batch_document(doc) for doc in docs]
+        size = sum(
+            len(in_bytes) + self._BATCH_DOC_BYTES
+            for _, in_bytes, _ in items
+            if in_bytes is not None
+        )
+        with self._inflight_lock:
+            # one batch is always taken, however large, so none starves
+            busy = (
+                self._batch_bytes > 0
+                and self._batch_bytes + size > self._MAX_BATCH_BYTES
+            )
+            if not busy:
+                self._batch_bytes += size
+        if busy:
+            self._reply_err("busy", rid, frame)
+            return
+        batch = _Batch(rid, frame, len(docs))
+        if rid is not None:
+            with self._inflight_lock:
+                self._inflight[rid] = (batch.future, batch.cancel, frame)
+        for index, (error, in_bytes, session) in enumerate(items):
+            if error is not None:
+                self._reply_err(error, rid, frame, index)
+                self._finish_item(batch)
+                continue
+            assert in_bytes is not None
+            self.stats.received(len(in_bytes))
+            self._submit(
+                executor,
+                None,
+                frame,
+                "format",
+                self._format_item,
+                batch,
+                index,
+                in_bytes,
+                session,
+                cancel=batch.cancel,
+                # the documents are in memory already, waiting for slots
+                # would only keep the reader from seeing a cancel
+                slot=False,
+            )
 
-                    if op == "format":
-                        raw_text: str | None = None
-                        b64 = req.get("b64")
-
-                        try:
-                            in_bytes = base64.b64decode(b64, validate=True)
-                        except Exception:
-                            self._reply_err("invalid base64 in 'b64'", rid)
-                            continue
-
-                        if len(in_bytes) > self._MAX_REQUEST_BYTES:
-                            self._reply_err("request too large", rid)
-                            continue
-
-                        raw_text = in_bytes.decode("utf-8", "replace")
-
-                        try:
-                            out_text = self.wformat.format_memory(raw_text)
-                        except Exception:
-                            sys.stderr.write("format failed:\n")
-                            sys.stderr.write(traceback.format_exc())
-                            sys.stderr.flush()
-                            self._reply_err("internal error", rid)
-                            continue
-                        sys.stderr.flush()
-                        out_b64 = base64.b64encode(
-                            out_text.encode("utf-8", "replace")
-                        ).decode("ascii")
-                        self._reply({"id": rid, "ok": True, "b64": out_b64})
-                        continue
+    def _batch_document(
+        self, doc: Any
+    ) -> tuple[str | None, bytes | None, _Session | None]:
+        """(error, source, session) of one format_many document."""
+        if not isinstance(doc, dict):
+            return "invalid document", None, None
+        if "doc" in doc:
+            session = self._session(doc["doc"])
+            if session is None:
+                return "unknown document", None, None
+            return None, session.data, session
+        try:
+            in_bytes = base64.b64decode(doc.get("b64"), validate=True)
+        except Exception:
+            return "invalid base64 in 'b64'", None, None
+        if len(in_bytes) > self._MAX_REQUEST_BYTES:
+            return "request too large", None, None
+        return None, in_bytes, None
+
+    def _format_range(
+        self,
+        rid: int | None,
+        in_bytes: bytes,
+        lines: list[LineRange],
+        frame: int | None,
+        cancel: Cancellation,
+    ) -> None:
+        try:
+            raw_text = in_bytes.decode("utf-8", "replace")
+            out_text = self.wformat.format_memory_lines(raw_text, lines, cancel)
+        except FormatCanceled:
+            self._reply_err("canceled", rid, frame)
+            return
+        except FormatTimeout as e:
+            self._reply_err(f"timeout: {e}", rid, frame)
+            return
+        except Exception:
+            sys.stderr.write("format_range failed:\n")
+            sys.stderr.write(traceback.format_exc())
+            sys.stderr.flush()
+            self._reply_err("internal error", rid, frame)
+            return
+        sys.stderr.flush()
+        region = changed_region(raw_text, out_text)
+        if region is None:
+            self._reply({"id": rid, "ok": True, "unchanged": True}, frame)
+            return
+        first, last, replacement = region
+        self._reply(
+            {
+                "id": rid,
+                "ok": True,
+                "start_line": first,
+                "end_line": last,
+                "data": replacement.encode("utf-8", "replace"),
+            },
+            frame,
+        )
 
-                    self._reply_err(f"unknown op: {op}", rid)
+    def _session(self, doc: Any) -> _Session | None:
+        session = self._sessions.get(doc)
+        if session is not None:
+            self._sessions.move_to_end(doc)
+        return session
 
+    def _open_session(self, doc: Any, data: bytes) -> None:
+        self._sessions.pop(doc, None)
+        self._sessions[doc] = _Session(data)
+        self._evict_sessions()
+
+    def _evict_sessions(self) -> None:
+        total = sum(len(s.data) for s in self._sessions.values())
+        while len(self._sessions) > 1 and (
+            len(self._sessions) > self.max_sessions or total > self.max_session_bytes
+        ):
+            _, evicted = self._sessions.popitem(last=False)
+            total -= len(evicted.data)
+
+    def _handle_session_op(
+        self, op: str, rid: Any, req: dict[str, Any], frame: int | None
+    ) -> None:
+        doc = req.get("doc")
+        if doc is None:
+            self._reply_err("missing 'doc'", rid, frame)
+            return
+        if op == "open":
+            try:
+                data = base64.b64decode(req.get("b64", ""), validate=True)
+            except Exception:
+                self._reply_err("invalid base64 in 'b64'", rid, frame)
+                return
+            if len(data) > self._MAX_REQUEST_BYTES:
+                self._reply_err("request too large", rid, frame)
+                return
+            self._open_session(doc, data)
+        elif op == "close":
+            self._sessions.pop(doc, None)
+        else:
+            session = self._session(doc)
+            if session is None:
+                self._reply_err("unknown document", rid, frame)
+                return
+            try:
+                session.apply_changes(list(req.get("edits", [])))
+            except Exception as e:
+                # the client's view has diverged, make it open the document again
+                self._sessions.pop(doc, None)
+                self._reply_err(f"invalid edits: {e}", rid, frame)
+                return
+            self._evict_sessions()
+        self._reply({"id": rid, "ok": True}, frame)
+
+    def _submit(
+        self,
+        executor: ThreadPoolExecutor,
+        rid: Any,
+        frame: int | None,
+        op: str,
+        fn: Any,
+        *args: Any,
+        cancel: Cancellation | None = None,
+        slot: bool = True,
+    ) -> None:
+        """
+        Run fn(*args, cancel) on the pool, cancelable by request id. With
+        slot the reader waits for a free slot first.
+        """
+        cancel = cancel or Cancellation()
+        queued = time.perf_counter()
+        if slot:
+            self._slots.acquire()
+        with self._inflight_lock:
+            self._pending += 1
+        try:
+            fut = executor.submit(self._timed, op, queued, fn, *args, cancel)
+        except Exception:
+            with self._inflight_lock:
+                self._pending -= 1
+            if slot:
+                self._slots.release()
+            raise
+        if rid is not None:
+            with self._inflight_lock:
+                self._inflight[rid] = (fut, cancel, frame)
+
+        def done(f: Future) -> None:
+            with self._inflight_lock:
+                self._pending -= 1
+                if rid is not None and self._inflight.get(rid, (None,))[0] is f:
+                    del self._inflight[rid]
+            if slot:
+                self._slots.release()
+
+        fut.add_done_callback(done)
+
+    def _timed(self, op: str, queued: float, fn: Any, *args: Any) -> None:
+        start = time.perf_counter()
+        self.stats.observe("queue", start - queued)
+        try:
+            fn(*args)
+        finally:
+            self.stats.observe(op, time.perf_counter() - start)
+
+    def _cancel(self, rid: Any) -> None:
+        with self._inflight_lock:
+            entry = self._inflight.get(rid)
+        if entry is None:
+            return  # unknown or already answered
+        fut, cancel, frame = entry
+        if fut.cancel():
+            self._reply_err("canceled", rid, frame)
+        else:
+            cancel.cancel()
+
+    def _hello(self, rid: Any, req: dict[str, Any], frame: int | None) -> None:
+        framing = req.get("framing", "json")
+        if framing not in ("json", "binary"):
+            self._reply_err(f"unknown framing: {framing}", rid, frame)
+            return
+        if (framing == "binary") != self._binary:
+            with self._inflight_lock:
+                busy = self._pending > 0
+            if busy:
+                self._reply_err("hello requires no requests in flight", rid, frame)
+                return
+        # answered in the current framing, everything after uses the new one
+        self._reply({"id": rid, "ok": True, "framing": framing}, frame)
+        self._binary = framing == "binary"
+
+    def _dispatch(
+        self,
+        executor: ThreadPoolExecutor,
+        req: dict[str, Any],
+        frame: int | None = None,
+        payload: bytes | None = None,
+    ) -> bool:
+        """
+        Handle one request, return False when the daemon should stop. The
+        raw source of a binary format frame comes as payload, never from
+        the request itself.
+        """
+        op = req.get("op")
+        rid = req.get("id")
+        # the op comes from the client, stats only keep a bounded set
+        self.stats.request(op if isinstance(op, str) and op in _OPS else "unknown")
+
+        try:
+            if op == "shutdown":
+                return False
+
+            if op == "stats":
+                self._reply({"id": rid, "ok": True, "stats": self.snapshot()}, frame)
+                return True
+
+            if op == "ping":
+                self._reply({"id": rid, "ok": True}, frame)
+                return True
+
+            if op == "cancel":
+                self._cancel(rid)
+                return True
+
+            if op == "hello":
+                self._hello(rid, req, frame)
+                return True
+
+            if op == "format_many":
+                self._format_many(executor, rid, req, frame)
+                return True
+
+            if op in ("open", "change", "close"):
+                self._handle_session_op(op, rid, req, frame)
+                return True
+
+            if op in ("format", "format_range"):
+                in_bytes = payload
+                session: _Session | None = None
+                if "doc" in req:
+                    session = self._session(req["doc"])
+                    if session is None:
+                        self._reply_err("unknown document", rid, frame)
+                        return True
+                    in_bytes = session.data
+                elif in_bytes is None:
+                    try:
+                        in_bytes = base64.b64decode(req.get("b64"), validate=True)
+                    except Exception:
+                        self._reply_err("invalid base64 in 'b64'", rid, frame)
+                        return True
+
+                if len(in_bytes) > self._MAX_REQUEST_BYTES:
+                    self._reply_err("request too large", rid, frame)
+                    return True
+                self.stats.received(len(in_bytes))
+
+                if op == "format":
+                    self._submit(
+                        executor,
+                        rid,
+                        frame,
+                        op,
+                        self._format,
+                        rid,
+                        in_bytes,
+                        session,
+                        frame,
+                        None,
+                    )
+                    return True
+
+                try:
+                    if "bytes" in req:
+                        lines = byte_ranges_to_lines(
+                            in_bytes, [(int(a), int(b)) for a, b in req["bytes"]]
+                        )
+                    else:
+                        lines = [(int(a), int(b)) for a, b in req["lines"]]
                 except Exception:
-                    sys.stderr.write("daemon crash:\n")
-                    sys.stderr.write(traceback.format_exc())
-                    sys.stderr.flush()
-                    self._reply_err("internal error", rid)
+                    self._reply_err("invalid 'lines' or 'bytes' ranges", rid, frame)
+                    return True
+
+                self._submit(
+                    executor,
+                    rid,
+                    frame,
+                    op,
+                    self._format_range,
+                    rid,
+                    in_bytes,
+                    lines,
+                    frame,
+                )
+                return True
+
+            self._reply_err(f"unknown op: {op}", rid, frame)
+
+        except Exception:
+            sys.stderr.write("daemon crash:\n")
+            sys.stderr.write(traceback.format_exc())
+            sys.stderr.flush()
+            self._reply_err("internal error", rid, frame)
+        return True
+
+    def _read_line(self, stdin: BinaryIO) -> bytes | None:
+        """Read one JSON line, None at EOF. Overlong lines are skipped."""
+        line = stdin.readline(self._MAX_LINE_BYTES)
+        if not line:
+            return None
+        if len(line) == self._MAX_LINE_BYTES and not line.endswith(b"\n"):
+            while line and not line.endswith(b"\n"):
+                line = stdin.readline(self._MAX_LINE_BYTES)
+            self._reply_err("request too large")
+            return b""
+        return line.strip()
+
+    def _read_frame(
+        self, stdin: BinaryIO
+    ) -> tuple[dict[str, Any] | None, int, bytes | None] | None:
+        """
+        Read one binary frame as (request, op, payload), None at EOF. The
+        request is None when the frame was invalid and has already been
+        answered, the payload is the raw source of a format frame.
+        """
+        header = stdin.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            return None
+        rid, op, _, length = FRAME_HEADER.unpack(header)
+        limit = self._MAX_LINE_BYTES if op == OP_JSON else self._MAX_REQUEST_BYTES
+        if length > limit:
+            remaining = length
+            while remaining > 0:
+                chunk = stdin.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    return None
+                remaining -= len(chunk)
+            self._reply_err("request too large", rid, op)
+            return None, op, None
+        payload = stdin.read(length)
+        if len(payload) < length:
+            return None
+        req, source = self._frame_request(rid, op, payload)
+        return req, op, source
+
+    def _frame_request(
+        self, rid: int, op: int, payload: bytes
+    ) -> tuple[dict[str, Any] | None, bytes | None]:
+        """
+        The request of a binary frame and its raw source, if any. The
+        request is None if it was invalid and has been answered.
+        """
+        if op != OP_JSON:
+            return {"id": rid, "op": _FRAME_OPS.get(op, op)}, payload
+        try:
+            req = json.loads(payload)
+        except Exception as e:
+            self._reply_err(f"bad json: {e.__class__.__name__}: {e}", rid, op)
+            return None, None
+        if not isinstance(req, dict):
+            self._reply_err("request must be a JSON object", rid, op)
+            return None, None
+        return req, None
+
+    def _line_request(self, line: bytes) -> dict[str, Any] | None:
+        """The request of a JSON line, None if it was invalid and answered."""
+        try:
+            req = json.loads(line)
+        except Exception as e:
+            self._reply_err(f"bad json: {e.__class__.__name__}: {e}")
+            return None
+        if not isinstance(req, dict):
+            self._reply_err("request must be a JSON object")
+            return None
+        return req
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._inflight_lock:
+            pending = self._pending
+        return self.stats.snapshot(
+            queue_depth=pending,
+            workers=self.max_workers,
+            sessions=len(self._sessions),
+        )
+
+    def _dump_stats(self, stop: threading.Event) -> None:
+        assert self.stats_interval is not None
+        while not stop.wait(self.stats_interval):
+            sys.stderr.write(json.dumps({"stats": self.snapshot()}) + "\n")
+            sys.stderr.flush()
+
+    def serve(self) -> int:
+        stdin: BinaryIO = sys.stdin.buffer
+        writer = threading.Thread(target=self._writer, name="wformat-writer")
+        writer.start()
+        add_span_listener(self.stats.observe)
+        stop_dump = threading.Event()
+        if self.stats_interval:
+            threading.Thread(
+                target=self._dump_stats,
+                args=(stop_dump,),
+                name="wformat-stats",
+                daemon=True,
+            ).start()
+        executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="wformat-worker"
+        )
+        shutdown_frame: int | None = None
+        shutdown_requested = False
+        try:
+            while True:
+                frame: int | None = None
+                payload: bytes | None = None
+                if self._binary:
+                    framed = self._read_frame(stdin)
+                    if framed is None:
+                        break
+                    req, frame, payload = framed
+                    if req is None:
+                        continue
+                else:
+                    line = self._read_line(stdin)
+                    if line is None:
+                        break
+                    if not line:
+                        continue
+                    req = self._line_request(line)
+                    if req is None:
+                        continue
+
+                if not self._dispatch(executor, req, frame, payload):
+                    shutdown_requested = True
+                    shutdown_frame = frame
+                    break
 
         except KeyboardInterrupt:
-            return 0
+            pass
+        finally:
+            executor.shutdown(wait=True)
+            stop_dump.set()
+            remove_span_listener(self.stats.observe)
+            if shutdown_requested:
+                self._reply({"ok": True}, shutdown_frame)
+            self._replies.put(None)
+            writer.join()
         return 0
@@ -0,0 +1,60 @@
+"""BOM, UTF-16 and newline handling of source bytes."""
+
+import codecs
+import os
+
+_UTF16_BOMS: dict[bytes, str] = {
+    codecs.BOM_UTF16_LE: "utf-16-le",
+    codecs.BOM_UTF16_BE: "utf-16-be",
+}
+
+
+def split_bom(data: bytes) -> tuple[bytes, bytes]:
+    """
+    Split source bytes into (bom, body) with body in the form the formatters
+    take. A UTF-8 BOM is cut off, UTF-16 with a BOM is transcoded to UTF-8.
+    Anything else is kept as it is: invalid UTF-8 is taken to be an ASCII
+    compatible 8-bit encoding and is formatted as bytes, never decoded.
+    """
+    if data.startswith(codecs.BOM_UTF8):
+        return codecs.BOM_UTF8, data[len(codecs.BOM_UTF8) :]
+    # a UTF-32-LE BOM starts like the UTF-16-LE one, it is not supported
+    encoding = _UTF16_BOMS.get(data[:2])
+    if encoding is not None:
+        try:
+            return data[:2], data[2:].decode(encoding).encode("utf-8")
+        except UnicodeDecodeError:
+            # not UTF-16 after all, e.g. 8-bit text starting with "\xff\xfe"
+            pass
+    return b"", data
+
+
+def join_bom(bom: bytes, body: bytes) -> bytes:
+    """Undo split_bom on a formatted body."""
+    encoding = _UTF16_BOMS.get(bom)
+    if encoding is not None:
+        return bom + body.decode("utf-8").encode(encoding)
+    return bom + body
+
+
+def universal_newlines(data: bytes) -> bytes:
+    """The newline translation of text mode reads."""
+    return data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+
+def native_newlines(data: bytes) -> bytes:
+    """The newline translation of text mode writes."""
+    return data if os.linesep == "\n" else data.replace(b"\n", os.linesep.encode())
+
+
+def split_lines(text: str) -> list[str]:
+    """
+    str.splitlines(keepends=True), but only "\n" ends a line, the way the
+    tools, git and tree-sitter count them. Form feeds, a lone "\r" and the
+    Unicode line separators stay inside their line.
+    """
+    lines = [line + "\n" for line in text.split("\n")]
+    lines[-1] = lines[-1][:-1]
+    if not lines[-1]:
+        lines.pop()
+    return lines
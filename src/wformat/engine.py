@@ -0,0 +1,423 @@
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+from pathlib import Path
+import shutil
+import tempfile
+import threading
+import time
+from typing import Callable, Iterable, TypeVar
+
+from wformat.encoding import join_bom, native_newlines, split_bom, universal_newlines
+from wformat.normalizer import fix_bytes_with_tree_sitter
+from wformat.profile import span
+from wformat.wformat import (
+    FormatTimeout,
+    WFormat,
+    default_jobs,
+    progress_label,
+    schedule,
+)
+
+T = TypeVar("T")
+
+
+def default_stage_workers() -> tuple[int, int, int]:
+    """
+    Workers for the clang-format, uncrustify and normalizer stages. The
+    subprocess stages mostly wait on their tools, the normalizer stage is
+    CPU bound Python and gets a process per spare core.
+    """
+    tools = default_jobs()
+    return tools, tools, max(1, multiprocessing.cpu_count() // 4)
+
+
+def _normalize_worker(
+    data: bytes, timeout: float | None
+) -> tuple[bytes | None, float]:
+    # runs in a normalizer process, each one has its own tree-sitter parser;
+    # None when the normalizer took longer than timeout
+    start = time.perf_counter()
+    try:
+        out: bytes | None = fix_bytes_with_tree_sitter(data, timeout=timeout)
+    except TimeoutError:
+        out = None
+    return out, time.perf_counter() - start
+
+
+class _Source:
+    """A file on its way through the stages."""
+
+    def __init__(self, path: Path, deadline: float | None) -> None:
+        self.path: Path = path
+        self.deadline: float | None = deadline
+        self.raw: bytes = path.read_bytes()
+        bom, body = split_bom(self.raw)
+        self.bom: bytes = bom
+        # with text mode newlines
+        self.body: bytes = universal_newlines(body)
+        self.key: str | None = None
+        # the temporary copy the tools format in batch mode
+        self.copy: Path | None = None
+
+    def write(self, out: bytes) -> bool:
+        """Write the formatted body out, unless it is what is on disk."""
+        formatted = join_bom(self.bom, native_newlines(out))
+        if formatted == self.raw:
+            return False
+        self.path.write_bytes(formatted)
+        return True
+
+
+# the files of a batch chunk, None until read
+_BatchFiles = dict[Path, "_Source | None"]
+
+
+class StageStats:
+    """Busy time and throughput of one pipeline stage."""
+
+    def __init__(self, name: str, workers: int) -> None:
+        self.name: str = name
+        self.workers: int = workers
+        self.busy: float = 0.0
+        self.items: int = 0
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float, items: int = 1) -> None:
+        with self._lock:
+            self.busy += seconds
+            self.items += items
+
+    def utilization(self, wall: float) -> float:
+        if wall <= 0:
+            return 0.0
+        return min(1.0, self.busy / (wall * self.workers))
+
+
+class PipelineEngine:
+    """
+    Formats many files in place with clang-format, uncrustify and the
+    tree-sitter normalizer as three pipelined stages.
+
+    Each stage has its own pool, so the tool processes of different files
+    overlap while the normalizer runs in a process pool outside the GIL. At
+    most max_in_flight files are between reading and writing at any time.
+
+    With a batch_size, the tool stages format chunks of files with one
+    clang-format and one uncrustify process per chunk instead of two
+    processes per file. The tools work on temporary copies of the sources,
+    decoded like format_bytes does, and a file is only written once all
+    stages succeeded.
+    """
+
+    def __init__(
+        self,
+        formatter: WFormat,
+        clang_jobs: int | None = None,
+        uncrustify_jobs: int | None = None,
+        normalize_jobs: int | None = None,
+        max_in_flight: int | None = None,
+        batch_size: int | None = None,
+    ) -> None:
+        defaults = default_stage_workers()
+        self.formatter: WFormat = formatter
+        self.clang_jobs: int = max(1, clang_jobs or defaults[0])
+        self.uncrustify_jobs: int = max(1, uncrustify_jobs or defaults[1])
+        self.normalize_jobs: int = max(1, normalize_jobs or defaults[2])
+        self.max_in_flight: int = max_in_flight or 2 * (
+            self.clang_jobs + self.uncrustify_jobs + self.normalize_jobs
+        )
+        self.batch_size: int | None = batch_size
+        if batch_size:
+            # room for one chunk per clang-format worker, twice over
+            self.max_in_flight = max(
+                self.max_in_flight, 2 * self.clang_jobs * batch_size
+            )
+        self.stats: list[StageStats] = []
+        self.wall: float = 0.0
+
+    def _timed(self, stats: StageStats, fn: Callable[[], T], items: int = 1) -> T:
+        start = time.perf_counter()
+        try:
+            with span(stats.name, files=items):
+                return fn()
+        finally:
+            stats.add(time.perf_counter() - start, items)
+
+    def run(self, file_paths: Iterable[Path], on_timeout: str = "fail") -> int:
+        """
+        Format file_paths in place and return the number of failed files.
+        Files that exceed the formatter's timeouts are handled by on_timeout
+        like in WFormat.format_inplace_many_mt.
+        """
+        file_paths, total_count = schedule(file_paths)
+        if total_count == 0:
+            print("-- No files to process")
+            return 0
+        formatter = self.formatter
+        cache = formatter.cache
+        clean_index = formatter.clean_index
+        clang = StageStats("clang-format", self.clang_jobs)
+        uncrustify = StageStats("uncrustify", self.uncrustify_jobs)
+        normalize = StageStats("normalizer", self.normalize_jobs)
+        self.stats = [clang, uncrustify, normalize]
+        if total_count is not None:
+            print(f"-- Detected {total_count} files to process")
+        print(
+            f"-- Pipeline workers: {self.clang_jobs} clang-format, "
+            f"{self.uncrustify_jobs} uncrustify, {self.normalize_jobs} normalizer"
+        )
+
+        slots = threading.BoundedSemaphore(self.max_in_flight)
+        done = threading.Event()
+        lock = threading.Lock()
+        # files between submission and finish, plus one until all are submitted
+        remaining = 1
+        progress_counter = 0
+        errors: list[tuple[Path, BaseException]] = []
+        timed_out: list[Path] = []
+
+        clang_pool = ThreadPoolExecutor(self.clang_jobs, "wformat-clang")
+        uncrustify_pool = ThreadPoolExecutor(self.uncrustify_jobs, "wformat-uncr")
+        # spawn, forking a process that already runs threads is not safe
+        normalize_pool = ProcessPoolExecutor(
+            self.normalize_jobs, multiprocessing.get_context("spawn")
+        )
+
+        def release() -> None:
+            nonlocal remaining
+            remaining -= 1
+            if remaining == 0:
+                done.set()
+
+        def finish(p: Path, error: BaseException | None = None) -> None:
+            nonlocal progress_counter
+            with lock:
+                if error is None:
+                    progress_counter += 1
+                    print(f"-- {progress_label(progress_counter, total_count)} {p}")
+                elif isinstance(error, FormatTimeout):
+                    timed_out.append(p)
+                    print(f"-- TIMEOUT while processing {p}: {error}")
+                else:
+                    errors.append((p, error))
+                    print(f"-- ERROR while processing {p}: {error!r}")
+                release()
+            slots.release()
+
+        def chain(p: Path, fut: Future, then: Callable[[object], None]) -> None:
+            def callback(f: Future) -> None:
+                try:
+                    then(f.result())
+                except BaseException as e:
+                    finish(p, e)
+
+            fut.add_done_callback(callback)
+
+        def write(
+            src: _Source, expired: FormatTimeout, result: tuple[bytes | None, float]
+        ) -> None:
+            out, seconds = result
+            normalize.add(seconds)
+            if out is None:
+                raise expired
+            if cache is not None and src.key is not None:
+                cache.put(src.key, out)
+            store(src, out)
+            formatter.uncrustify.clear_temp_files(src.path)
+            finish(src.path)
+
+        def store(src: _Source, out: bytes) -> None:
+            with span("write", file=str(src.path)):
+                written = src.write(out)
+            if not written and clean_index is not None:
+                clean_index.mark_clean(src.raw)
+
+        def run_uncrustify(src: _Source, data: bytes) -> None:
+            fut = uncrustify_pool.submit(
+                self._timed,
+                uncrustify,
+                lambda: formatter._run_tool(
+                    "uncrustify",
+                    formatter.uncrustify.args_for_stdin(),
+                    data,
+                    deadline=src.deadline,
+                ),
+            )
+            chain(src.path, fut, lambda out: run_normalizer(src, out))
+
+        def run_normalizer(src: _Source, data: bytes) -> None:
+            timeout, expired = formatter.timeouts.limit("tree-sitter", src.deadline)
+            fut = normalize_pool.submit(_normalize_worker, data, timeout)
+            chain(src.path, fut, lambda result: write(src, expired, result))
+
+        def from_cache(src: _Source) -> bool:
+            # like WFormat._format_inplace, files are only written on change
+            if clean_index is not None and clean_index.is_clean(src.path, src.raw):
+                finish(src.path)
+                return True
+            if cache is None:
+                return False
+            src.key = cache.key(src.body)
+            cached = cache.get(src.key)
+            if cached is None:
+                return False
+            store(src, cached)
+            finish(src.path)
+            return True
+
+        def run_clang(p: Path) -> None:
+            src = _Source(p, formatter.timeouts.deadline())
+            if from_cache(src):
+                return
+            out = self._timed(
+                clang,
+                lambda: formatter._run_tool(
+                    "clang-format",
+                    formatter.clang_format.args_for_stdin(),
+                    src.body,
+                    deadline=src.deadline,
+                ),
+            )
+            run_uncrustify(src, out)
+
+        def run_batch(
+            stage: Callable[[_BatchFiles, Path], bool],
+            files: _BatchFiles,
+            copies: Path,
+        ) -> None:
+            # a stage takes files out of files once it finished or handed
+            # them on, and says whether it handed on the copies as well
+            handed_on = False
+            try:
+                handed_on = stage(files, copies)
+            except BaseException as e:
+                for p in files:
+                    finish(p, e)
+            finally:
+                if not handed_on:
+                    shutil.rmtree(copies, ignore_errors=True)
+
+        def run_clang_batch(files: _BatchFiles, copies: Path) -> bool:
+            for i, p in enumerate(list(files)):
+                try:
+                    # the tools of a chunk are not bounded, the normalizer is
+                    src = _Source(p, formatter.timeouts.deadline())
+                    hit = from_cache(src)
+                    if not hit:
+                        # the file name tells clang-format the language
+                        src.copy = copies / str(i) / p.name
+                        src.copy.parent.mkdir()
+                        src.copy.write_bytes(src.body)
+                except Exception as e:
+                    del files[p]
+                    finish(p, e)
+                    continue
+                if hit:
+                    del files[p]
+                else:
+                    files[p] = src
+            if not files:
+                return False
+            originals = {src.copy: p for p, src in files.items() if src and src.copy}
+            failed = self._timed(
+                clang,
+                lambda: formatter.clang_format.format_many(list(originals)),
+                len(originals),
+            )
+            for copy, message in failed.items():
+                p = originals[copy]
+                del files[p]
+                finish(p, RuntimeError(message))
+            if not files:
+                return False
+            uncrustify_pool.submit(
+                run_batch, run_uncrustify_batch, dict(files), copies
+            )
+            files.clear()
+            return True
+
+        def run_uncrustify_batch(files: _BatchFiles, copies: Path) -> bool:
+            originals = {src.copy: p for p, src in files.items() if src and src.copy}
+            failed = self._timed(
+                uncrustify,
+                lambda: formatter.uncrustify.format_many(list(originals)),
+                len(originals),
+            )
+            for copy, p in originals.items():
+                src = files.pop(p)
+                assert src is not None
+                if copy in failed:
+                    finish(p, RuntimeError(failed[copy]))
+                    continue
+                try:
+                    data = copy.read_bytes()
+                except Exception as e:
+                    finish(p, e)
+                    continue
+                run_normalizer(src, data)
+            return False
+
+        def submit_wave(wave: list[Path]) -> None:
+            # deal the files out so that every chunk gets some of the large ones
+            for i in range(self.clang_jobs):
+                chunk = wave[i :: self.clang_jobs]
+                if chunk:
+                    copies = Path(tempfile.mkdtemp(prefix="wformat-batch-"))
+                    files: _BatchFiles = dict.fromkeys(chunk)
+                    clang_pool.submit(run_batch, run_clang_batch, files, copies)
+
+        start = time.perf_counter()
+        try:
+            wave: list[Path] = []
+            wave_size = self.clang_jobs * (self.batch_size or 1)
+            for p in file_paths:
+                if formatter.known_clean(p):
+                    continue
+                slots.acquire()
+                with lock:
+                    remaining += 1
+                if not self.batch_size:
+                    fut = clang_pool.submit(run_clang, p)
+                    chain(p, fut, lambda _: None)
+                    continue
+                wave.append(p)
+                if len(wave) == wave_size:
+                    submit_wave(wave)
+                    wave = []
+            if wave:
+                submit_wave(wave)
+            with lock:
+                release()
+            done.wait()
+        finally:
+            self.wall = time.perf_counter() - start
+            clang_pool.shutdown()
+            uncrustify_pool.shutdown()
+            normalize_pool.shutdown()
+
+        self.print_stats()
+        error_counter = len(errors)
+        retry_errors = 0
+        if timed_out and on_timeout == "retry":
+            # few files, they do not need a pipeline of their own
+            print(f"-- Retrying {len(timed_out)} timed out file(s)")
+            with formatter._scaled_timeouts(2):
+                retry_errors = formatter.format_inplace_many_mt(
+                    timed_out, self.clang_jobs
+                )
+        elif timed_out and on_timeout == "fail":
+            error_counter += len(timed_out)
+        if timed_out and on_timeout == "skip":
+            print(f"-- Skipped {len(timed_out)} timed out file(s)")
+        if error_counter:
+            print(f"-- Completed with {error_counter} error(s)")
+        return error_counter + retry_errors
+
+    def print_stats(self) -> None:
+        print(f"-- Pipeline wall time: {self.wall:.2f} s")
+        for stats in self.stats:
+            print(
+                f"-- Stage {stats.name:12} {stats.workers:3} worker(s)  "
+                f"{stats.items:6} file(s)  busy {stats.busy:8.2f} s  "
+                f"utilization {stats.utilization(self.wall) * 100:5.1f}%"
+            )
@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import codecs
+from functools import lru_cache
+import os
+from pathlib import Path
+import re
+import subprocess
+import time
+from typing import TYPE_CHECKING, Sequence
+
+from wformat.profile import span
+from wformat.utils import command_chunks
+
+if TYPE_CHECKING:
+    from wformat.normalizer import LineRange
+
+_HUNK_HEADER = re.compile(rb"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
+
+
+@lru_cache(maxsize=None)
+def git_available() -> bool:
+    """Probe for git once per process."""
+    try:
+        subprocess.run(["git", "--version"], capture_output=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        print("[Warning] git not found!")
+        return False
+    return True
+
+
+def _git(args: Sequence[str]) -> "subprocess.CompletedProcess[bytes]":
+    with span(f"git {args[0]}"):
+        return subprocess.run(["git", *args], capture_output=True)
+
+
+def _paths(out: bytes) -> list[Path]:
+    # -z output: NUL terminated, unquoted names in the file system encoding
+    return [Path("./" + os.fsdecode(name)) for name in out.split(b"\0") if name]
+
+
+def _changed_files(args: Sequence[str], error: str) -> list[Path]:
+    if not git_available():
+        return []
+    # deleted files have nothing left to format
+    result = _git(["diff", "--name-only", "-z", "--diff-filter=d", *args])
+    if result.returncode != 0:
+        print(error)
+        return []
+    return _paths(result.stdout)
+
+
+def _unquote(name: bytes) -> str:
+    # names with special characters are C-quoted in patch headers
+    if name.startswith(b'"') and name.endswith(b'"'):
+        name = codecs.escape_decode(name[1:-1])[0]  # type: ignore[attr-defined]
+    return os.fsdecode(name)
+
+
+def _changed_lines(args: Sequence[str], error: str) -> dict[Path, list[LineRange]]:
+    """
+    Lines of the new side of a git diff, as 1-based inclusive ranges per
+    file. A pure deletion maps to the line it happened after.
+    """
+    if not git_available():
+        return {}
+    result = _git(
+        [
+            "diff",
+            "-U0",
+            "--no-color",
+            "--no-ext-diff",
+            "--src-prefix=a/",
+            "--dst-prefix=b/",
+            "--diff-filter=d",
+            *args,
+        ]
+    )
+    if result.returncode != 0:
+        print(error)
+        return {}
+    changes: dict[Path, list[LineRange]] = {}
+    ranges: list[LineRange] | None = None
+    previous = b""
+    for line in result.stdout.split(b"\n"):
+        # an added line can look like a header too, but never follows "--- "
+        is_header = line.startswith(b"+++ ") and previous.startswith(b"--- ")
+        previous = line
+        if is_header:
+            name = line[4:].rstrip(b"\t")
+            if name == b"/dev/null":
+                ranges = None
+                continue
+            ranges = changes.setdefault(Path("./" + _unquote(name)[2:]), [])
+        elif line.startswith(b"@@") and ranges is not None:
+            match = _HUNK_HEADER.match(line)
+            if match is None:
+                continue
+            start = int(match.group(1))
+            count = 1 if match.group(2) is None else int(match.group(2))
+            if count == 0:
+                ranges.append((max(start, 1), max(start, 1)))
+            else:
+                ranges.append((start, start + count - 1))
+    return changes
+
+
+def get_modified_files() -> list[Path]:
+    # like ls-files -m, relative to the current directory
+    return _changed_files(["--relative"], "[Error] Failed to get modified files")
+
+
+def get_modified_lines() -> dict[Path, list[LineRange]]:
+    return _changed_lines(["--relative"], "[Error] Failed to get modified lines")
+
+
+def get_staged_files() -> list[Path]:
+    return _changed_files(["--cached"], "[Error] Failed to get staged files")
+
+
+def get_staged_lines() -> dict[Path, list[LineRange]]:
+    return _changed_lines(["--cached"], "[Error] Failed to get staged lines")
+
+
+def get_files_in_last_n_commits(n: int) -> list[Path]:
+    return _changed_files(
+        [f"HEAD~{n}", "HEAD"], f"[Error] Failed to get files from last {n} commits"
+    )
+
+
+def get_lines_in_last_n_commits(n: int) -> dict[Path, list[LineRange]]:
+    return _changed_lines(
+        [f"HEAD~{n}", "HEAD"], f"[Error] Failed to get lines from last {n} commits"
+    )
+
+
+def get_files_changed_against_branch(
+    branch: str, use_merge_base: bool = True
+) -> list[Path]:
+    """Return files changed in the current HEAD compared to another branch.
+
+    Parameters
+    ----------
+    branch: str
+        The other branch to diff against.
+    use_merge_base: bool
+        If True (default) use three-dot syntax (branch...HEAD) which diffs
+        against the merge base. If False, use two-dot (branch..HEAD).
+    """
+    if not git_available():
+        return []
+
+    # Verify branch exists
+    if _git(["rev-parse", "--verify", "--quiet", branch]).returncode != 0:
+        print(f"[Error] Branch '{branch}' not found")
+        return []
+
+    diff_range = f"{branch}...HEAD" if use_merge_base else f"{branch}..HEAD"
+    return _changed_files(
+        [diff_range], f"[Error] Failed to diff against branch '{branch}'"
+    )
+
+
+def get_lines_changed_against_branch(
+    branch: str, use_merge_base: bool = True
+) -> dict[Path, list[LineRange]]:
+    """Like get_files_changed_against_branch, with the changed lines of each file."""
+    if not git_available():
+        return {}
+
+    if _git(["rev-parse", "--verify", "--quiet", branch]).returncode != 0:
+        print(f"[Error] Branch '{branch}' not found")
+        return {}
+
+    diff_range = f"{branch}...HEAD" if use_merge_base else f"{branch}..HEAD"
+    return _changed_lines(
+        [diff_range], f"[Error] Failed to diff against branch '{branch}'"
+    )
+
+
+def get_clean_blob_shas() -> dict[Path, str]:
+    """
+    Blob SHAs of the tracked files under the current directory whose
+    worktree content matches the git index, by path. git answers this from
+    its stat cache, so the files are normally not read.
+    """
+    if not git_available():
+        return {}
+    staged = _git(["ls-files", "-s", "-z"])
+    dirty = _git(["diff", "--name-only", "-z", "--relative"])
+    if staged.returncode != 0 or dirty.returncode != 0:
+        return {}
+    modified = {os.fsdecode(name) for name in dirty.stdout.split(b"\0") if name}
+    shas: dict[Path, str] = {}
+    for entry in staged.stdout.split(b"\0"):
+        # <mode> SP <sha> SP <stage> TAB <path>
+        info, _, name = entry.partition(b"\t")
+        fields = info.split(b" ")
+        if len(fields) != 3 or fields[2] != b"0" or fields[0] == b"160000":
+            continue  # unmerged or a submodule
+        path = os.fsdecode(name)
+        if path not in modified:
+            shas[Path(path)] = fields[1].decode("ascii")
+    return shas
+
+
+def restage_files(paths: Sequence[Path]) -> None:
+    """Restage files in git with as few git add calls as possible."""
+    if not paths or not git_available():
+        return
+    start = time.perf_counter()
+    calls = 0
+    restaged = 0
+    with span("restage_files", files=len(paths)):
+        for chunk in command_chunks([str(p) for p in paths]):
+            calls += 1
+            result = _git(["add", "--renormalize", "--", *chunk])
+            if result.returncode == 0:
+                restaged += len(chunk)
+                continue
+            # find out which files git refused
+            for path in chunk:
+                calls += 1
+                result = _git(["add", "--renormalize", "--", path])
+                if result.returncode != 0:
+                    message = result.stderr.decode("utf-8", "replace").strip()
+                    print(f"[Error] Failed to restage {path}: {message}")
+                else:
+                    restaged += 1
+    print(
+        f"-- Restaged {restaged} file(s) with {calls} git call(s) "
+        f"in {time.perf_counter() - start:.2f} s"
+    )
@@ -1,31 +1,116 @@
+from __future__ import annotations
+
+from functools import lru_cache
 import re
 from pathlib import Path
+import threading
+import time
 import traceback
-from typing import Any, Pattern, Match
-from tree_sitter import Language, Parser, Query, QueryCursor, Node
-import tree_sitter_cpp as ts_cpp
+from typing import TYPE_CHECKING, Any, Callable, Match, Pattern, Sequence
+
+if TYPE_CHECKING:
+    from tree_sitter import Language, Node, Parser, Query, QueryCursor
 
 # try https://tree-sitter.github.io/tree-sitter/7-playground.html
 
-_CPP_LANGUAGE: Language = Language(ts_cpp.language())
-_PARSER: Parser = Parser(_CPP_LANGUAGE)
-_QUERY: Query = Query(
-    _CPP_LANGUAGE,
-    """
+_PARSERS = threading.local()
+_QUERY_SOURCE = """
     (call_expression) @call
     (function_definition) @func
     (declaration) @func
     (field_declaration) @func
-    """.strip(),
-)
+    (number_literal) @number
+    (preproc_arg) @macro
+    """.strip()
 
 _INTEGER_LITERAL_PATTERN: Pattern[str] = re.compile(
     r"\b((0[bB]([01][01']*[01]|[01]+))|(0[xX]([\da-fA-F][\da-fA-F']*[\da-fA-F]|[\da-fA-F]+))|(0([0-7][0-7']*[0-7]|[0-7]+))|([1-9](\d[\d']*\d|\d*)))([uU]?[lL]{0,2}|[lL]{0,2}[uU]?)?\b"
 )
 
+# the same pattern for the tree-sitter pass, which works on utf-8 bytes
+_INTEGER_LITERAL_BYTES_PATTERN: Pattern[bytes] = re.compile(
+    _INTEGER_LITERAL_PATTERN.pattern.encode("ascii")
+)
+
 # (start_byte, end_byte, replacement_bytes)
 Edit = tuple[int, int, bytes]
 
+# (first_line, last_line), 1-based and inclusive like clang-format --lines
+LineRange = tuple[int, int]
+
+# nodes a partial format is widened to, so tools never see half a statement
+_UNIT_SUFFIXES: tuple[str, ...] = (
+    "_statement",
+    "declaration",
+    "function_definition",
+    "preproc_def",
+    "preproc_function_def",
+    "preproc_include",
+    "comment",
+)
+_MAX_UNIT_LINES = 400
+
+
+# tree-sitter is loaded on first use, so that entry points which never
+# normalize (--version, --ls, the git listings) start fast
+@lru_cache(maxsize=None)
+def _cpp_language() -> Language:
+    from tree_sitter import Language
+    import tree_sitter_cpp as ts_cpp
+
+    return Language(ts_cpp.language())
+
+
+@lru_cache(maxsize=None)
+def _query() -> Query:
+    from tree_sitter import Query
+
+    return Query(_cpp_language(), _QUERY_SOURCE)
+
+
+def _get_parser() -> Parser:
+    # tree-sitter parsers are not thread-safe, keep one per thread
+    parser: Parser | None = getattr(_PARSERS, "parser", None)
+    if parser is None:
+        from tree_sitter import Parser
+
+        parser = Parser(_cpp_language())
+        _PARSERS.parser = parser
+    return parser
+
+
+def _check_deadline(deadline: float | None) -> None:
+    if deadline is not None and time.monotonic() > deadline:
+        raise TimeoutError("tree-sitter normalization timed out")
+
+
+def _parse(src: bytes, old_tree: Any = None, deadline: float | None = None) -> Any:
+    """
+    Parse src, incrementally against old_tree if given. Past the monotonic
+    deadline, TimeoutError is raised.
+    """
+    parser = _get_parser()
+    args = (src,) if old_tree is None else (src, old_tree)
+    if deadline is None:
+        return parser.parse(*args)
+    _check_deadline(deadline)
+    # bindings before 0.25 abort the parse themselves; later ones only
+    # offer a progress callback that is not safe to use, so the deadline is
+    # checked after the parse and then between the passes
+    if not hasattr(parser, "timeout_micros"):
+        tree = parser.parse(*args)
+        _check_deadline(deadline)
+        return tree
+    parser.timeout_micros = max(1, int((deadline - time.monotonic()) * 1e6))
+    try:
+        tree = parser.parse(*args)
+    finally:
+        parser.timeout_micros = 0
+    if tree is None:
+        parser.reset()
+        raise TimeoutError("tree-sitter parse timed out")
+    return tree
+
 
 def normalize_integer_literal(file_path: Path, upper_case: bool = True) -> None:
     try:
@@ -37,95 +122,472 @@ def normalize_integer_literal(file_path: Path, upper_case: bool = True) -> None:
         print(traceback.format_exc())
 
 
-def normalize_integer_literal_in_memory(data: str, upper_case: bool = True) -> str:
+def _in_lines(row: int, lines: Sequence[LineRange] | None) -> bool:
+    """Whether the 0-based row falls into one of the 1-based line ranges."""
+    if lines is None:
+        return True
+    return any(first <= row + 1 <= last for first, last in lines)
+
+
+def _line_offsets(data: str, lines: Sequence[LineRange]) -> list[tuple[int, int]]:
+    """Character spans [start, end) of the given line ranges within data."""
+    starts = [0] + [m.end() for m in re.finditer("\n", data)]
+    spans: list[tuple[int, int]] = []
+    for first, last in sorted(lines):
+        if first > len(starts):
+            continue
+        start = starts[max(first, 1) - 1]
+        end = starts[last] if last < len(starts) else len(data)
+        if spans and start <= spans[-1][1]:
+            spans[-1] = (spans[-1][0], max(end, spans[-1][1]))
+        else:
+            spans.append((start, end))
+    return spans
+
+
+def _normalize_literal(literal: str, upper_case: bool = True) -> str:
+    update = literal.upper() if upper_case else literal.lower()
+    if len(update) > 1 and update[0] == "0":
+        update = update[0] + update[1].lower() + update[2:]
+    return update
+
+
+def normalize_integer_literal_in_memory(
+    data: str, upper_case: bool = True, lines: Sequence[LineRange] | None = None
+) -> str:
     def replace(match: Match[str]) -> str:
-        update = match.group(0)
-        update = update.upper() if upper_case else update.lower()
-        if len(update) > 1 and update[0] == "0":
-            update = update[0] + update[1].lower() + update[2:]
+        update = _normalize_literal(match.group(0), upper_case)
         if data[match.start() - 1] == "&":
             update = " " + update
         return update
 
-    return _INTEGER_LITERAL_PATTERN.sub(repl=replace, string=data)
+    if lines is None:
+        return _INTEGER_LITERAL_PATTERN.sub(repl=replace, string=data)
 
+    # only scan the requested lines, the regex still sees the text around them
+    pieces: list[str] = []
+    pos = 0
+    for start, end in _line_offsets(data, lines):
+        for match in _INTEGER_LITERAL_PATTERN.finditer(data, start, end):
+            pieces.append(data[pos : match.start()])
+            pieces.append(replace(match))
+            pos = match.end()
+    pieces.append(data[pos:])
+    return "".join(pieces)
 
-def fix_with_tree_sitter(code: str) -> str:
+
+def expand_lines_to_units(code: str, lines: Sequence[LineRange]) -> list[LineRange]:
+    """
+    Widen line ranges so they start and end on whole statements or
+    declarations, which lets them be formatted as standalone fragments.
+    """
+    if not code:
+        return list(lines)
+    tree = _get_parser().parse(code.encode("utf-8", "surrogateescape"))
+    root: Node = tree.root_node
+    src_lines = code.split("\n")
+
+    def unit_rows(row: int) -> tuple[int, int]:
+        if row >= len(src_lines):
+            return row, row
+        text = src_lines[row]
+        indent = text[: len(text) - len(text.lstrip())]
+        col = len(indent.encode("utf-8", "surrogateescape"))
+        node: Node | None = root.named_descendant_for_point_range(
+            (row, col), (row, col)
+        )
+        while node is not None and node.parent is not None:
+            if node.type.endswith(_UNIT_SUFFIXES):
+                first, last = node.start_point[0], node.end_point[0]
+                if last - first <= _MAX_UNIT_LINES:
+                    return min(first, row), max(last, row)
+                break
+            node = node.parent
+        return row, row
+
+    expanded: list[LineRange] = []
+    for first, last in sorted(lines):
+        lo, _ = unit_rows(first - 1)
+        _, hi = unit_rows(last - 1)
+        first, last = min(first, lo + 1), max(last, hi + 1)
+        if expanded and first <= expanded[-1][1] + 1:
+            expanded[-1] = (expanded[-1][0], max(last, expanded[-1][1]))
+        else:
+            expanded.append((first, last))
+    return expanded
+
+
+def fix_with_tree_sitter(code: str, lines: Sequence[LineRange] | None = None) -> str:
     if not code:
         return code
+    return fix_bytes_with_tree_sitter(code.encode("utf-8"), lines).decode("utf-8")
 
-    src: bytes = code.encode("utf-8")
-    tree = _PARSER.parse(src)
 
-    edits: list[Edit] = []
-    edits += fix_single_arg_func_calls(src, tree)
-    edits += fix_func_indent(src, tree)
+def fix_bytes_with_tree_sitter(
+    src: bytes,
+    lines: Sequence[LineRange] | None = None,
+    timeout: float | None = None,
+) -> bytes:
+    """
+    fix_with_tree_sitter on the UTF-8 bytes of the source. Raises
+    TimeoutError when it takes longer than timeout seconds.
+    """
+    if not src:
+        return src
+    deadline = None if timeout is None else time.monotonic() + timeout
+    tree = _parse(src, deadline=deadline)
+
+    owned = collect_edits(src, tree, lines, deadline=deadline)
+    edits: list[Edit] = [e for _, _, e in owned]
+    return apply_edits(src, edits)
+
+
+# A pass turns one captured node into zero or more minimal edits. Passes are
+# registered per capture name of _query() and all share a single capture run.
+NodePass = Callable[[bytes, "Node", Sequence[LineRange] | None], list[Edit]]
+_PASSES: dict[str, list[NodePass]] = {}
+
+
+def node_pass(capture: str) -> Callable[[NodePass], NodePass]:
+    """Register a pass for the nodes captured as @capture by _query()."""
 
-    edits.sort(key=lambda e: e[0], reverse=True)
+    def register(fn: NodePass) -> NodePass:
+        _PASSES.setdefault(capture, []).append(fn)
+        return fn
+
+    return register
+
+
+def collect_edits(
+    src: bytes,
+    tree: Any,
+    lines: Sequence[LineRange] | None = None,
+    byte_ranges: Sequence[tuple[int, int]] | None = None,
+    deadline: float | None = None,
+) -> list[tuple[int, int, Edit]]:
+    """
+    Run every registered pass over one capture of the tree and return
+    (owner_start, owner_end, edit) tuples, owner being the captured node.
+    lines or byte_ranges restrict the visit to nodes intersecting them.
+    Past the monotonic deadline, TimeoutError is raised.
+    """
+    cursor: QueryCursor = _query_cursor(lines)
+    windows: Sequence[tuple[int, int] | None] = byte_ranges or [None]
+    seen: set[tuple[str, int, int]] = set()
+    owned: list[tuple[int, int, Edit]] = []
+    for window in windows:
+        _check_deadline(deadline)
+        if window is not None:
+            cursor.set_byte_range(window[0], max(window[1], window[0] + 1))
+        captures: dict[str, list[Node]] = cursor.captures(tree.root_node)
+        for name, nodes in captures.items():
+            passes = _PASSES.get(name)
+            if not passes:
+                continue
+            for i, node in enumerate(nodes):
+                if i % 256 == 0:
+                    _check_deadline(deadline)
+                key = (name, node.start_byte, node.end_byte)
+                if key in seen:
+                    continue
+                seen.add(key)
+                if byte_ranges is not None and not _overlaps(
+                    node.start_byte, node.end_byte, byte_ranges
+                ):
+                    continue
+                for fn in passes:
+                    for edit in fn(src, node, lines):
+                        owned.append((node.start_byte, node.end_byte, edit))
+    return owned
+
+
+def apply_edits(src: bytes, edits: list[Edit]) -> bytes:
+    """
+    Apply non-overlapping edits in a single pass. Raises ValueError when
+    two edits overlap, since the result would depend on their order.
+    """
+    if not edits:
+        return src
+    edits.sort(key=lambda e: (e[0], e[1]))
+    pieces: list[bytes] = []
+    pos = 0
     for start, end, rep in edits:
-        src = src[:start] + rep + src[end:]
-    return src.decode("utf-8")
+        if start < pos:
+            raise ValueError(f"overlapping edits at bytes {start}..{end}")
+        pieces.append(src[pos:start])
+        pieces.append(rep)
+        pos = end
+    pieces.append(src[pos:])
+    return b"".join(pieces)
+
+
+def _query_cursor(lines: Sequence[LineRange] | None) -> QueryCursor:
+    from tree_sitter import QueryCursor
+
+    cursor: QueryCursor = QueryCursor(_query())
+    if lines:
+        # only visit nodes intersecting the requested lines
+        first = min(r[0] for r in lines)
+        last = max(r[1] for r in lines)
+        cursor.set_point_range((max(first - 1, 0), 0), (last, 0))
+    return cursor
 
 
-def fix_func_indent(src: bytes, tree: Any) -> list[Edit]:
-    cursor: QueryCursor = QueryCursor(_QUERY)
+def fix_func_indent(
+    src: bytes, tree: Any, lines: Sequence[LineRange] | None = None
+) -> list[Edit]:
+    cursor: QueryCursor = _query_cursor(lines)
     captures: dict[str, list[Node]] = cursor.captures(tree.root_node)
     func_nodes: list[Node] = captures.get("func", [])
-    edits: list[Edit] = []
-    for node in func_nodes:
-        type: Node | None = node.child_by_field_name("type")
-        declarator: Node | None = node.child_by_field_name("declarator")
-
-        if type and declarator and declarator.grammar_name == "function_declarator":
-            return_type_row: int = type.start_point[0]
-            return_type_col: int = type.start_point[1]
-            declarator_row: int = declarator.start_point[0]
-            declarator_col: int = declarator.start_point[1]
-
-            dist: int = declarator_col - return_type_col
-
-            if return_type_row < declarator_row and dist > 0:
-                edits.append(
-                    (
-                        declarator.start_byte - dist,
-                        declarator.end_byte,
-                        src[declarator.start_byte : declarator.end_byte],
-                    )
-                )
-    return edits
+    return [e for node in func_nodes for e in _fix_func_node(src, node, lines)]
+
+
+@node_pass("func")
+def _fix_func_node(
+    src: bytes, node: Node, lines: Sequence[LineRange] | None = None
+) -> list[Edit]:
+    type: Node | None = node.child_by_field_name("type")
+    declarator: Node | None = node.child_by_field_name("declarator")
+
+    if type and declarator and declarator.grammar_name == "function_declarator":
+        return_type_row: int = type.start_point[0]
+        return_type_col: int = type.start_point[1]
+        declarator_row: int = declarator.start_point[0]
+        declarator_col: int = declarator.start_point[1]
 
+        dist: int = declarator_col - return_type_col
 
-def fix_single_arg_func_calls(src: bytes, tree: Any) -> list[Edit]:
-    cursor: QueryCursor = QueryCursor(_QUERY)
+        if (
+            return_type_row < declarator_row
+            and dist > 0
+            and _in_lines(declarator_row, lines)
+        ):
+            # drop the extra indentation in front of the declarator
+            return [(declarator.start_byte - dist, declarator.start_byte, b"")]
+    return []
+
+
+def fix_single_arg_func_calls(
+    src: bytes, tree: Any, lines: Sequence[LineRange] | None = None
+) -> list[Edit]:
+    cursor: QueryCursor = _query_cursor(lines)
     captures: dict[str, list[Node]] = cursor.captures(tree.root_node)
     call_nodes: list[Node] = captures.get("call", [])
+    return [e for node in call_nodes for e in _fix_call_node(src, node, lines)]
+
+
+@node_pass("call")
+def _fix_call_node(
+    src: bytes, node: Node, lines: Sequence[LineRange] | None = None
+) -> list[Edit]:
+    function: Node | None = node.child_by_field_name("function")
+    arguments: Node | None = node.child_by_field_name("arguments")
+    if (
+        function
+        and arguments
+        and len(arguments.named_children) == 1
+        and _in_lines(arguments.start_point[0], lines)
+    ):
+
+        first_grammar_name = arguments.named_children[0].grammar_name
+        if (
+            first_grammar_name == "lambda_expression"
+            or first_grammar_name == "call_expression"
+        ):
+            return []
+
+        start, end = arguments.start_byte, arguments.end_byte
+        if not (src[start : start + 1] == b"(" and src[end - 1 : end] == b")"):
+            return []
+
+        # delete the whitespace just inside the parentheses, nothing else
+        # surrogateescape keeps byte counts right for input that is not UTF-8
+        inner: str = src[start + 1 : end - 1].decode("utf-8", "surrogateescape")
+        lead: int = len(
+            inner[: len(inner) - len(inner.lstrip())].encode("utf-8", "surrogateescape")
+        )
+        trail: int = len(inner[len(inner.rstrip()) :].encode("utf-8", "surrogateescape"))
+        if lead == end - start - 2:
+            return [(start + 1, end - 1, b"")] if lead else []
+        edits: list[Edit] = []
+        if lead:
+            edits.append((start + 1, start + 1 + lead, b""))
+        if trail:
+            edits.append((end - 1 - trail, end - 1, b""))
+        return edits
+    return []
+
+
+def _literal_edits(src: bytes, start: int, end: int) -> list[Edit]:
     edits: list[Edit] = []
-    for node in call_nodes:
-        function: Node | None = node.child_by_field_name("function")
-        arguments: Node | None = node.child_by_field_name("arguments")
-        if function and arguments and len(arguments.named_children) == 1:
-
-            first_grammar_name = arguments.named_children[0].grammar_name
-            if (
-                first_grammar_name == "lambda_expression"
-                or first_grammar_name == "call_expression"
-            ):
-                continue
+    # one byte past the node so that \b sees what follows the literal
+    for match in _INTEGER_LITERAL_BYTES_PATTERN.finditer(src, start, end + 1):
+        if match.end() > end:
+            continue
+        literal: bytes = match.group(0)
+        update: bytes = _normalize_literal(literal.decode("ascii")).encode("ascii")
+        if src[match.start() - 1 : match.start()] == b"&":
+            update = b" " + update
+        if update != literal:
+            edits.append((match.start(), match.end(), update))
+    return edits
 
-            args_text: str = src[arguments.start_byte : arguments.end_byte].decode(
-                "utf-8"
-            )
-            if not (args_text.startswith("(") and args_text.endswith(")")):
-                continue
 
-            new_args_text: str = f"({args_text[1:-1].strip()})"
-            if new_args_text != args_text:
-                edits.append(
-                    (
-                        arguments.start_byte,
-                        arguments.end_byte,
-                        new_args_text.encode("utf-8"),
-                    )
+@node_pass("number")
+def _fix_number_node(
+    src: bytes, node: Node, lines: Sequence[LineRange] | None = None
+) -> list[Edit]:
+    if not _in_lines(node.start_point[0], lines):
+        return []
+    return _literal_edits(src, node.start_byte, node.end_byte)
+
+
+@node_pass("macro")
+def _fix_macro_node(
+    src: bytes, node: Node, lines: Sequence[LineRange] | None = None
+) -> list[Edit]:
+    # macro bodies are not parsed, scan their text like a plain literal pass
+    if not _in_lines(node.start_point[0], lines):
+        return []
+    return _literal_edits(src, node.start_byte, node.end_byte)
+
+
+def _point_at(src: bytes, offset: int) -> tuple[int, int]:
+    row = src.count(b"\n", 0, offset)
+    return row, offset - (src.rfind(b"\n", 0, offset) + 1)
+
+
+def _common_prefix_len(a: bytes | memoryview, b: bytes | memoryview) -> int:
+    # binary search with slice compares, they run at memcmp speed
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _diff_span(old: bytes, new: bytes) -> tuple[int, int, int]:
+    """The single edit turning old into new as (start, old_end, new_end)."""
+    start = _common_prefix_len(old, new)
+    limit = min(len(old), len(new)) - start
+    suffix = _common_prefix_len(
+        memoryview(old)[start:][::-1][:limit], memoryview(new)[start:][::-1][:limit]
+    )
+    return start, len(old) - suffix, len(new) - suffix
+
+
+def _overlaps(start: int, end: int, ranges: Sequence[tuple[int, int]]) -> bool:
+    for lo, hi in ranges:
+        if (start < hi and lo < end) if lo < hi else (start <= lo <= end):
+            return True
+    return False
+
+
+class IncrementalNormalizer:
+    """
+    Stateful fix_with_tree_sitter for a document that is formatted again and
+    again with small changes in between (an editor session).
+
+    The tree of the previous input is kept; the next input is diffed
+    against it, the tree is updated with Tree.edit and reparsed
+    incrementally, and only the nodes intersecting the changed ranges are
+    visited again. Edits of untouched nodes are reused.
+    """
+
+    # beyond this share of the document changed, a full pass is cheaper
+    _FULL_PASS_RATIO = 0.5
+
+    def __init__(self) -> None:
+        self._src: bytes | None = None
+        self._tree: Any = None
+        # (owner_start, owner_end, edit) in the coordinates of self._src
+        self._edits: list[tuple[int, int, Edit]] = []
+        self.full_passes: int = 0
+        self.incremental_passes: int = 0
+
+    def reset(self) -> None:
+        self._src = None
+        self._tree = None
+        self._edits = []
+
+    def fix(self, code: str) -> str:
+        if not code:
+            self.reset()
+            return code
+        return self.fix_bytes(code.encode("utf-8")).decode("utf-8")
+
+    def fix_bytes(self, src: bytes, timeout: float | None = None) -> bytes:
+        """
+        Normalize src, reusing what is known about the previous input.
+        Raises TimeoutError when it takes longer than timeout seconds.
+        """
+        if not src:
+            self.reset()
+            return src
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            if self._src is None or self._tree is None:
+                self._full_pass(src, deadline)
+            elif src != self._src:
+                self._incremental_pass(src, deadline)
+        except TimeoutError:
+            # the old tree may already be edited, start over next time
+            self.reset()
+            raise
+        return apply_edits(src, [e for _, _, e in self._edits])
+
+    def _full_pass(self, src: bytes, deadline: float | None = None) -> None:
+        tree = _parse(src, deadline=deadline)
+        self._edits = collect_edits(src, tree, deadline=deadline)
+        self._tree = tree
+        self._src = src
+        self.full_passes += 1
+
+    def _incremental_pass(self, src: bytes, deadline: float | None = None) -> None:
+        old: bytes = self._src  # type: ignore[assignment]
+        start, old_end, new_end = _diff_span(old, src)
+        if max(old_end, new_end) - start > len(src) * self._FULL_PASS_RATIO:
+            self._full_pass(src, deadline)
+            return
+
+        old_tree = self._tree
+        old_tree.edit(
+            start_byte=start,
+            old_end_byte=old_end,
+            new_end_byte=new_end,
+            start_point=_point_at(old, start),
+            old_end_point=_point_at(old, old_end),
+            new_end_point=_point_at(src, new_end),
+        )
+        tree = _parse(src, old_tree, deadline)
+
+        # whole lines around the text change, fixes depend on columns
+        line_start = src.rfind(b"\n", 0, start) + 1
+        line_end = src.find(b"\n", new_end)
+        changed = [(line_start, len(src) if line_end < 0 else line_end + 1)]
+        changed += [(r.start_byte, r.end_byte) for r in old_tree.changed_ranges(tree)]
+
+        delta = new_end - old_end
+        edits: list[tuple[int, int, Edit]] = []
+        for owner_start, owner_end, (e_start, e_end, rep) in self._edits:
+            if owner_end <= start:
+                kept = (owner_start, owner_end, (e_start, e_end, rep))
+            elif owner_start >= old_end:
+                kept = (
+                    owner_start + delta,
+                    owner_end + delta,
+                    (e_start + delta, e_end + delta, rep),
                 )
+            else:
+                continue
+            if not _overlaps(kept[0], kept[1], changed):
+                edits.append(kept)
+        edits += collect_edits(src, tree, byte_ranges=changed, deadline=deadline)
 
-    return edits
+        self._src = src
+        self._tree = tree
+        self._edits = edits
+        self.incremental_passes += 1
@@ -0,0 +1,130 @@
+from contextlib import contextmanager
+import json
+import os
+from pathlib import Path
+import sys
+import threading
+import time
+from typing import Any, Callable, Iterator
+
+
+class Profiler:
+    """
+    Collects timed spans from every thread and writes them as a Chrome trace
+    (chrome://tracing, ui.perfetto.dev), one track per thread.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._origin: int = time.perf_counter_ns()
+        self._events: list[dict[str, Any]] = []
+        self._threads: dict[int, str] = {}
+
+    def add(self, name: str, start: int, end: int, args: dict[str, Any]) -> None:
+        """Record a span between two time.perf_counter_ns() readings."""
+        thread = threading.current_thread()
+        tid = threading.get_ident()
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": (start - self._origin) / 1000,
+            "dur": (end - start) / 1000,
+            "pid": os.getpid(),
+            "tid": tid,
+            "args": args,
+        }
+        with self._lock:
+            self._events.append(event)
+            self._threads.setdefault(tid, thread.name)
+
+    def trace(self) -> dict[str, Any]:
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+        names = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": os.getpid(),
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for tid, name in threads.items()
+        ]
+        return {"traceEvents": names + events, "displayTimeUnit": "ms"}
+
+    def write(self, path: Path) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.trace(), f)
+
+    def slowest_files(self, count: int = 10) -> list[tuple[str, float]]:
+        """The files with the longest spans in total, in seconds."""
+        totals: dict[str, float] = {}
+        with self._lock:
+            for event in self._events:
+                file = event["args"].get("file")
+                if file is not None and event["name"] in ("format_inplace", "check"):
+                    totals[file] = totals.get(file, 0.0) + event["dur"] / 1e6
+        return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:count]
+
+    def print_summary(self, count: int = 10) -> None:
+        stages: dict[str, tuple[int, float]] = {}
+        with self._lock:
+            for event in self._events:
+                calls, total = stages.get(event["name"], (0, 0.0))
+                stages[event["name"]] = (calls + 1, total + event["dur"] / 1e6)
+        sys.stderr.write("-- Profile: time per span\n")
+        for name, (calls, total) in sorted(
+            stages.items(), key=lambda item: item[1][1], reverse=True
+        ):
+            sys.stderr.write(f"--   {name:28} {calls:7} call(s) {total:9.3f} s\n")
+        slowest = self.slowest_files(count)
+        if slowest:
+            sys.stderr.write(f"-- Profile: {len(slowest)} slowest file(s)\n")
+            for file, seconds in slowest:
+                sys.stderr.write(f"--   {seconds:9.3f} s  {file}\n")
+        sys.stderr.flush()
+
+
+_profiler: Profiler | None = None
+# called with (name, seconds) for every finished span
+_listeners: list[Callable[[str, float], None]] = []
+
+
+def enable_profiling() -> Profiler:
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def active_profiler() -> Profiler | None:
+    return _profiler
+
+
+def add_span_listener(listener: Callable[[str, float], None]) -> None:
+    _listeners.append(listener)
+
+
+def remove_span_listener(listener: Callable[[str, float], None]) -> None:
+    _listeners.remove(listener)
+
+
+@contextmanager
+def span(name: str, **args: Any) -> Iterator[None]:
+    """
+    Time the enclosed block as a span of the active profiler and report it
+    to the span listeners, if there are any.
+    """
+    profiler = _profiler
+    if profiler is None and not _listeners:
+        yield
+        return
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        end = time.perf_counter_ns()
+        if profiler is not None:
+            profiler.add(name, start, end, args)
+        for listener in list(_listeners):
+            listener(name, (end - start) / 1e9)
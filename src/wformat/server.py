@@ -0,0 +1,260 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+from pathlib import Path
+import signal
+import sys
+import time
+from typing import Any
+
+from wformat.daemon import (
+    FRAME_HEADER,
+    OP_JSON,
+    WFormatDaemon,
+    default_daemon_workers,
+)
+from wformat.profile import add_span_listener, remove_span_listener
+from wformat.stats import DaemonStats
+from wformat.wformat import WFormat
+
+
+class _Connection(WFormatDaemon):
+    """One client of a WFormatServer: a daemon whose replies go to its socket."""
+
+    def __init__(self, server: "WFormatServer", writer: asyncio.StreamWriter) -> None:
+        super().__init__(
+            server.wformat,
+            max_workers=server.max_workers,
+            max_sessions=server.max_sessions,
+            stats=server.stats,
+        )
+        self._server = server
+        self._loop = asyncio.get_running_loop()
+        self._writer = writer
+
+    def _send(self, data: bytes) -> None:
+        # replies come from the worker threads, the socket belongs to the loop
+        self._loop.call_soon_threadsafe(self._write, data)
+
+    def _write(self, data: bytes) -> None:
+        if not self._writer.is_closing():
+            self._writer.write(data)
+
+    def cancel_all(self) -> None:
+        """Cancel every request of this client, it has gone away."""
+        with self._inflight_lock:
+            rids = list(self._inflight)
+        for rid in rids:
+            self._cancel(rid)
+
+    def snapshot(self) -> dict[str, Any]:
+        stats = super().snapshot()
+        stats["connections"] = len(self._server.connections)
+        return stats
+
+    async def read_request(
+        self, reader: asyncio.StreamReader
+    ) -> tuple[dict[str, Any] | None, int | None, bytes | None] | None:
+        """
+        Read one request as (request, frame, payload), None when the
+        connection is done. The request is None when it was invalid and has
+        been answered, the payload is the raw source of a format frame.
+        """
+        if self._binary:
+            try:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                rid, op, _, length = FRAME_HEADER.unpack(header)
+                limit = (
+                    self._MAX_LINE_BYTES if op == OP_JSON else self._MAX_REQUEST_BYTES
+                )
+                if length > limit:
+                    # unlike stdio, the rest of a shared server's stream is
+                    # not worth skipping, the client is dropped instead
+                    self._reply_err("request too large", rid, op)
+                    return None
+                payload = await reader.readexactly(length)
+            except asyncio.IncompleteReadError:
+                return None
+            req, source = self._frame_request(rid, op, payload)
+            return req, op, source
+        try:
+            line = await reader.readline()
+        except ValueError:  # longer than the stream limit
+            self._reply_err("request too large")
+            return None
+        if not line:
+            return None
+        line = line.strip()
+        return (self._line_request(line) if line else None), None, None
+
+
+class WFormatServer:
+    """
+    Shared wformat server on a Unix domain socket.
+
+    Any number of clients connect at once and speak the protocol of
+    WFormatDaemon (JSON Lines, or binary frames after "hello"). Each
+    connection has its own documents and framing, all of them share one
+    formatter, one worker pool and one set of stats. "shutdown" stops the
+    whole server once every in-flight request is answered. Without clients
+    for idle_timeout seconds the server stops by itself.
+
+    Only one server runs per socket: a lock file next to it is held while
+    serving, a second server exits right away.
+    """
+
+    def __init__(
+        self,
+        formatter: WFormat,
+        path: Path,
+        max_workers: int | None = None,
+        max_sessions: int = 32,
+        idle_timeout: float | None = 600.0,
+        stats_interval: float | None = None,
+    ) -> None:
+        self.wformat: WFormat = formatter
+        self.path: Path = path
+        self.max_workers: int = max(1, max_workers or default_daemon_workers())
+        self.max_sessions: int = max_sessions
+        self.idle_timeout: float | None = idle_timeout or None
+        self.stats_interval: float | None = stats_interval
+        self.stats: DaemonStats = DaemonStats()
+        self.connections: set[_Connection] = set()
+        self._executor: ThreadPoolExecutor | None = None
+        self._stop: asyncio.Event | None = None
+        self._last_active: float = time.monotonic()
+        # the connection that asked for shutdown, and the frame to answer in
+        self._shutdown_by: tuple[_Connection, int | None] | None = None
+
+    def _lock(self) -> int | None:
+        """Take the server lock of the socket, None if another server has it."""
+        import fcntl
+
+        directory = self.path.parent
+        directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        if directory.stat().st_uid != os.getuid():
+            raise PermissionError(f"{directory} belongs to another user")
+        fd = os.open(self.path.with_suffix(".lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        # left behind by a server that did not exit cleanly
+        if self.path.exists():
+            self.path.unlink()
+        return fd
+
+    def serve(self) -> int:
+        if not hasattr(asyncio, "start_unix_server"):
+            sys.stderr.write("[Error] Unix domain sockets are not supported here\n")
+            return 1
+        lock = self._lock()
+        if lock is None:
+            sys.stderr.write(f"-- A wformat server is already running on {self.path}\n")
+            return 0
+        try:
+            asyncio.run(self._serve())
+        finally:
+            if self.path.exists():
+                self.path.unlink()
+            os.close(lock)
+        return 0
+
+    async def _serve(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self._stop.set)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="wformat-worker"
+        )
+        server = await asyncio.start_unix_server(
+            self._client, path=str(self.path), limit=WFormatDaemon._MAX_LINE_BYTES
+        )
+        os.chmod(self.path, 0o600)
+        add_span_listener(self.stats.observe)
+        tasks = [asyncio.create_task(self._idle_watch())]
+        if self.stats_interval:
+            tasks.append(asyncio.create_task(self._dump_stats()))
+        sys.stderr.write(f"-- wformat server listening on {self.path}\n")
+        sys.stderr.flush()
+        try:
+            await self._stop.wait()
+        finally:
+            server.close()
+            for task in tasks:
+                task.cancel()
+            # replies of in-flight requests are still written while waiting
+            await loop.run_in_executor(None, self._executor.shutdown)
+            remove_span_listener(self.stats.observe)
+            if self._shutdown_by is not None:
+                conn, frame = self._shutdown_by
+                conn._reply({"ok": True}, frame)
+            # run the writes queued with call_soon_threadsafe
+            await asyncio.sleep(0)
+            writers = [conn._writer for conn in self.connections]
+            for writer in writers:
+                writer.close()
+            # closing flushes what is buffered, wait for it before the loop ends
+            await asyncio.wait_for(
+                asyncio.gather(
+                    *(writer.wait_closed() for writer in writers),
+                    return_exceptions=True,
+                ),
+                timeout=5,
+            )
+
+    async def _client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        assert self._executor is not None and self._stop is not None
+        conn = _Connection(self, writer)
+        self.connections.add(conn)
+        self._last_active = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                framed = await conn.read_request(reader)
+                if framed is None:
+                    break
+                req, frame, payload = framed
+                if req is None:
+                    continue
+                self._last_active = time.monotonic()
+                # _dispatch may wait for a free worker slot, off the loop
+                running = await asyncio.to_thread(
+                    conn._dispatch, self._executor, req, frame, payload
+                )
+                if not running:
+                    self._shutdown_by = (conn, frame)
+                    self._stop.set()
+                    return
+        except ConnectionError:
+            pass
+        conn.cancel_all()
+        self.connections.discard(conn)
+        self._last_active = time.monotonic()
+        writer.close()
+
+    async def _idle_watch(self) -> None:
+        if self.idle_timeout is None:
+            return
+        assert self._stop is not None
+        while True:
+            idle = time.monotonic() - self._last_active
+            if not self.connections and idle >= self.idle_timeout:
+                sys.stderr.write(
+                    f"-- No clients for {self.idle_timeout:g}s, stopping the server\n"
+                )
+                self._stop.set()
+                return
+            await asyncio.sleep(min(1.0, self.idle_timeout))
+
+    async def _dump_stats(self) -> None:
+        assert self.stats_interval is not None
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            stats = self.stats.snapshot(connections=len(self.connections))
+            sys.stderr.write(json.dumps({"stats": stats}) + "\n")
+            sys.stderr.flush()
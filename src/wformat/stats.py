@@ -0,0 +1,149 @@
+import math
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any
+
+# bucket i holds latencies up to _BASE_MS * _GROWTH ** i, four buckets per
+# doubling from 0.1 ms, the last one catches everything above ~110 s
+_BASE_MS = 0.1
+_GROWTH = 2 ** 0.25
+_BUCKETS = 81
+
+
+class LatencyHistogram:
+    """Log-bucketed latency histogram with approximate percentiles."""
+
+    def __init__(self) -> None:
+        self.counts: list[int] = [0] * _BUCKETS
+        self.count: int = 0
+        self.total: float = 0.0
+        self.max: float = 0.0
+
+    @staticmethod
+    def upper_ms(bucket: int) -> float:
+        return _BASE_MS * _GROWTH**bucket
+
+    def add(self, seconds: float) -> None:
+        ms = seconds * 1000
+        if ms <= _BASE_MS:
+            bucket = 0
+        else:
+            bucket = min(_BUCKETS - 1, math.ceil(math.log(ms / _BASE_MS, _GROWTH)))
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile_ms(self, q: float) -> float | None:
+        """Upper bound of the bucket holding the q-th percentile."""
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(self.upper_ms(bucket), self.max * 1000)
+        return self.max * 1000
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count * 1000 if self.count else None,
+            "p50_ms": self.percentile_ms(50),
+            "p95_ms": self.percentile_ms(95),
+            "p99_ms": self.percentile_ms(99),
+            "max_ms": self.max * 1000,
+            # [upper bound in ms, count] of every non-empty bucket
+            "histogram": [
+                [round(self.upper_ms(bucket), 3), count]
+                for bucket, count in enumerate(self.counts)
+                if count
+            ],
+        }
+
+
+def current_rss() -> int | None:
+    """Resident set size of this process in bytes, where it can be read."""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    return None
+
+
+def peak_rss() -> int | None:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class DaemonStats:
+    """
+    Request counters and per-stage latencies of a WFormatDaemon. Stage
+    latencies come from the daemon itself ("queue" and one per op) and from
+    the spans of the formatter (see wformat.profile.span).
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.started: float = time.time()
+        self.requests: dict[str, int] = {}
+        self.errors: dict[str, int] = {}
+        self.bytes_in: int = 0
+        self.bytes_out: int = 0
+        self.stages: dict[str, LatencyHistogram] = {}
+
+    def request(self, op: str) -> None:
+        with self._lock:
+            self.requests[op] = self.requests.get(op, 0) + 1
+
+    def error(self, kind: str) -> None:
+        with self._lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def received(self, bytes_in: int) -> None:
+        with self._lock:
+            self.bytes_in += bytes_in
+
+    def sent(self, bytes_out: int) -> None:
+        with self._lock:
+            self.bytes_out += bytes_out
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = LatencyHistogram()
+            histogram.add(seconds)
+
+    def snapshot(self, **extra: Any) -> dict[str, Any]:
+        """The stats as a JSON-ready dict, extra keys are added as they are."""
+        with self._lock:
+            stats: dict[str, Any] = {
+                "uptime_s": time.time() - self.started,
+                "requests": dict(self.requests),
+                "errors": dict(self.errors),
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "latency": {
+                    stage: histogram.summary()
+                    for stage, histogram in sorted(self.stages.items())
+                },
+            }
+        stats["rss_bytes"] = current_rss()
+        stats["peak_rss_bytes"] = peak_rss()
+        # only known when tracing, e.g. python -X tracemalloc
+        stats["tracemalloc_peak_bytes"] = (
+            tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None
+        )
+        stats.update(extra)
+        return stats
@@ -1,8 +1,9 @@
 from pathlib import Path
 import subprocess
 import traceback
+from typing import Sequence
 
-from wformat.utils import wheel_bin_path, wheel_data_path
+from wformat.utils import run_batched, wheel_bin_path, wheel_data_path
 
 
 class Uncrustify:
@@ -42,6 +43,37 @@ class Uncrustify:
                 check=True,
             )
 
+    def format_many(self, file_paths: Sequence[Path]) -> dict[Path, str]:
+        """
+        format the given files in place with one uncrustify process reading
+        the file list from stdin, returns the error message of every file
+        that failed
+        """
+
+        def run(paths: Sequence[Path]) -> "subprocess.CompletedProcess[bytes]":
+            return subprocess.run(
+                [
+                    self.exe_path,
+                    "-q",
+                    "-l",
+                    "CPP",
+                    "-c",
+                    self.config_path,
+                    "-F",
+                    "-",
+                    "--replace",
+                    "--no-backup",
+                ],
+                input="\n".join(str(p) for p in paths).encode("utf-8"),
+                capture_output=True,
+            )
+
+        errors = run_batched("uncrustify", run, file_paths)
+        # a failed run can leave its .uncrustify temp files behind
+        for file_path in errors:
+            self.clear_temp_files(file_path)
+        return errors
+
     def format_data(self, data: str) -> str:
         """
         Format in-memory source code and return the formatted text.
@@ -57,8 +89,8 @@ class Uncrustify:
         )
         return res.stdout
 
-    def args_for_stdin(self) -> list[str]:
-        return [
+    def args_for_stdin(self, fragment: bool = False) -> list[str]:
+        args = [
             self.exe_path,
             "-q",
             "-l",
@@ -66,6 +98,10 @@ class Uncrustify:
             "-c",
             self.config_path,
         ]
+        if fragment:
+            # code fragment, the first line is assumed to be indented correctly
+            args.append("--frag")
+        return args
 
     def clear_temp_files(self, file_path: Path) -> None:
         """Remove the .uncrustify temp file if it exists."""
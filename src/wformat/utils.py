@@ -3,8 +3,7 @@ import subprocess
 import os
 import sys
 from pathlib import Path
-from typing import Sequence
-import importlib.resources as ir
+from typing import Callable, Sequence
 
 
 def wheel_bin_path(name: str) -> Path:
@@ -12,6 +11,8 @@ def wheel_bin_path(name: str) -> Path:
     name = f"{name}.exe" if os.name == "nt" else name
     if getattr(sys, "frozen", False):
         return Path(getattr(sys, "_MEIPASS")) / "bin" / name
+    import importlib.resources as ir
+
     return Path(ir.files("wformat") / "bin" / name)
 
 
@@ -19,128 +20,90 @@ def wheel_data_path(name: str) -> Path:
     # wformat/data/<name>
     if getattr(sys, "frozen", False):
         return Path(getattr(sys, "_MEIPASS")) / "data" / name
-    return Path(ir.files("wformat") / "data" / name)
-
-
-def valid_path_in_args(path: str) -> str:
-    if os.path.exists(path):
-        return path
-    else:
-        raise argparse.ArgumentTypeError(f"{path} does not exist.")
-
-
-def restage_file(path: Path) -> None:
-    """Restage a file in git."""
-    try:
-        subprocess.run(["git", "add", "--renormalize", str(path.resolve())], check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"[Error] Failed to restage {path}: {e}")
+    import importlib.resources as ir
 
+    return Path(ir.files("wformat") / "data" / name)
 
-def restage_files(paths: Sequence[Path]) -> None:
-    for path in paths:
-        restage_file(path)
 
+# stay well below the 32767 character command line limit of Windows
+MAX_COMMAND_CHARS = 30000
 
-def get_modified_files() -> list[Path]:
-    try:
-        subprocess.run(["git", "--version"])
-    except subprocess.CalledProcessError:
-        print("[Warning] git not found!")
-        return []
 
-    result = subprocess.run(
-        ["git", "ls-files", "-m", "--no-empty-directory"],
-        capture_output=True,
-        text=True,
-    )
-    modified_files = [Path("./" + line) for line in result.stdout.splitlines()]
-    return modified_files
+def command_chunks(args: Sequence[str]) -> list[list[str]]:
+    """Split args into chunks that each fit on one command line."""
+    chunks: list[list[str]] = []
+    size = 0
+    for arg in args:
+        if not chunks or size + len(arg) + 1 > MAX_COMMAND_CHARS:
+            chunks.append([])
+            size = 0
+        chunks[-1].append(arg)
+        size += len(arg) + 1
+    return chunks
 
 
-def get_staged_files() -> list[Path]:
-    try:
-        subprocess.run(["git", "--version"], check=True)
-    except subprocess.CalledProcessError:
-        print("[Warning] git not found!")
-        return []
-
-    result = subprocess.run(
-        ["git", "diff", "--name-only", "--cached"],
-        capture_output=True,
-        text=True,
-    )
+def run_batched(
+    name: str,
+    run: Callable[[Sequence[Path]], "subprocess.CompletedProcess[bytes]"],
+    file_paths: Sequence[Path],
+) -> dict[Path, str]:
+    """
+    Run an in-place tool over many files with as few processes as the
+    command line length allows. If one fails, its files are restored and
+    the tool is run once per file, so that the errors can be attributed.
+    Returns the error message of every failed file.
+    """
+    errors: dict[Path, str] = {}
+    originals: dict[Path, bytes] = {}
+    for path in file_paths:
+        try:
+            originals[path] = path.read_bytes()
+        except OSError as e:
+            errors[path] = str(e)
+    for chunk in command_chunks([str(path) for path in originals]):
+        paths = [Path(path) for path in chunk]
+        res = run(paths)
+        if res.returncode == 0:
+            continue
+        for path in paths:
+            path.write_bytes(originals[path])
+            res = run([path])
+            if res.returncode != 0:
+                errors[path] = (
+                    res.stderr.decode("utf-8", "replace").strip()
+                    or f"{name} failed ({res.returncode})"
+                )
+    return errors
 
-    staged_files = [Path("./" + line) for line in result.stdout.splitlines()]
-    return staged_files
 
+def valid_path_in_args(path: str) -> str:
+    if os.path.exists(path):
+        return path
+    else:
+        raise argparse.ArgumentTypeError(f"{path} does not exist.")
 
-def get_files_in_last_n_commits(n: int) -> list[Path]:
-    try:
-        subprocess.run(["git", "--version"], check=True)
-    except subprocess.CalledProcessError:
-        print("[Warning] git not found!")
-        return []
 
+def valid_jobs_in_args(value: str) -> int | str:
+    if value == "auto":
+        return value
     try:
-        result = subprocess.run(
-            ["git", "diff", "--name-only", f"HEAD~{n}", "HEAD"],
-            capture_output=True,
-            text=True,
-            check=True,
+        jobs = int(value)
+    except ValueError:
+        jobs = 0
+    if jobs < 1:
+        raise argparse.ArgumentTypeError(
+            f"{value} is not a positive number of jobs or 'auto'."
         )
-    except subprocess.CalledProcessError:
-        print(f"[Error] Failed to get files from last {n} commits")
-        return []
-
-    return [Path("./" + line.strip()) for line in result.stdout.splitlines()]
+    return jobs
 
 
-def get_files_changed_against_branch(
-    branch: str, use_merge_base: bool = True
-) -> list[Path]:
-    """Return files changed in the current HEAD compared to another branch.
-
-    Parameters
-    ----------
-    branch: str
-        The other branch to diff against.
-    use_merge_base: bool
-        If True (default) use three-dot syntax (branch...HEAD) which diffs
-        against the merge base. If False, use two-dot (branch..HEAD).
-    """
+def valid_timeout_in_args(value: str) -> float:
     try:
-        subprocess.run(["git", "--version"], check=True)
-    except subprocess.CalledProcessError:
-        print("[Warning] git not found!")
-        return []
-
-    # Verify branch exists
-    try:
-        subprocess.run(
-            ["git", "rev-parse", "--verify", branch], capture_output=True, check=True
-        )
-    except subprocess.CalledProcessError:
-        print(f"[Error] Branch '{branch}' not found")
-        return []
-
-    diff_range = f"{branch}...HEAD" if use_merge_base else f"{branch}..HEAD"
-    try:
-        result = subprocess.run(
-            ["git", "diff", "--name-only", diff_range],
-            capture_output=True,
-            text=True,
-            check=True,
+        seconds = float(value)
+    except ValueError:
+        seconds = 0.0
+    if not seconds > 0:
+        raise argparse.ArgumentTypeError(
+            f"{value} is not a positive number of seconds."
         )
-    except subprocess.CalledProcessError:
-        print(f"[Error] Failed to diff against branch '{branch}'")
-        return []
-
-    return [
-        Path("./" + line.strip()) for line in result.stdout.splitlines() if line.strip()
-    ]
-
-
-def search_files(dir: Path) -> list[Path]:
-    """Recursively gather all files under a directory."""
-    return [p for p in dir.rglob("*") if p.is_file() and p.exists()]
+    return seconds
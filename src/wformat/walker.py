@@ -0,0 +1,173 @@
+import os
+from pathlib import Path
+import re
+from typing import IO, Iterable, Iterator, Pattern
+
+from wformat.profile import span
+
+# the files wformat formats, generated protobuf headers excluded
+SOURCE_FILE_PATTERN: Pattern[str] = re.compile(r"^.*(?<!\.pb)\.(h|cpp)$")
+
+IGNORE_FILES: tuple[str, ...] = (".gitignore", ".wformatignore")
+
+# never worth descending into, whatever the ignore files say
+_ALWAYS_PRUNED: frozenset[str] = frozenset({".git", ".hg", ".svn"})
+
+
+def is_source_file(path: Path) -> bool:
+    # match the name first, it is much cheaper than the stat in is_file()
+    return bool(SOURCE_FILE_PATTERN.match(path.name)) and path.is_file()
+
+
+def _translate(pattern: str) -> str:
+    """Translate a gitignore glob into a regular expression."""
+    out: list[str] = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("/**", i) and i + 3 == len(pattern):
+            out.append("(?:/.*)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            out.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            out.append("[^/]")
+            i += 1
+        elif pattern[i] == "[":
+            end = pattern.find("]", i + 2)
+            if end < 0:
+                out.append(re.escape(pattern[i]))
+                i += 1
+                continue
+            body = pattern[i + 1 : end]
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            out.append(f"[{body}]")
+            i = end + 1
+        elif pattern[i] == "\\" and i + 1 < len(pattern):
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            out.append(re.escape(pattern[i]))
+            i += 1
+    return "".join(out)
+
+
+class IgnoreRule:
+    """One line of a .gitignore-style file, relative to the file's directory."""
+
+    def __init__(self, base: str, line: str) -> None:
+        self.base: str = base
+        self.negated: bool = line.startswith("!")
+        if self.negated:
+            line = line[1:]
+        self.dir_only: bool = line.endswith("/")
+        line = line.rstrip("/")
+        anchored = "/" in line
+        line = line.lstrip("/")
+        regex = _translate(line)
+        if not anchored:
+            regex = "(?:.*/)?" + regex
+        self.pattern: Pattern[str] = re.compile(regex)
+
+    def match(self, rel: str, is_dir: bool) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        if self.base:
+            if not rel.startswith(self.base):
+                return False
+            rel = rel[len(self.base) :]
+        return self.pattern.fullmatch(rel) is not None
+
+
+def load_ignore_rules(directory: str, base: str) -> list[IgnoreRule]:
+    rules: list[IgnoreRule] = []
+    for name in IGNORE_FILES:
+        try:
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        except (OSError, UnicodeDecodeError):
+            continue
+        for line in lines:
+            line = line.rstrip()
+            if not line or line.startswith("#"):
+                continue
+            rules.append(IgnoreRule(base, line))
+    return rules
+
+
+def _ignored(rules: list[IgnoreRule], rel: str, is_dir: bool) -> bool:
+    # the last matching rule wins, deeper ignore files come later
+    ignored = False
+    for rule in rules:
+        if rule.negated == ignored and rule.match(rel, is_dir):
+            ignored = not rule.negated
+    return ignored
+
+
+def iter_source_files(root: Path) -> Iterator[Path]:
+    """
+    Walk root with os.scandir and yield source files as they are found.
+
+    Directories ignored by .gitignore / .wformatignore files met on the way
+    are not descended into, and names are filtered before anything is
+    stat'ed. Ignore files above root are not consulted.
+    """
+    stack: list[tuple[str, str, list[IgnoreRule]]] = [
+        (str(root), "", load_ignore_rules(str(root), ""))
+    ]
+    while stack:
+        directory, rel_dir, rules = stack.pop()
+        try:
+            with span("scandir", dir=directory):
+                entries = sorted(os.scandir(directory), key=lambda e: e.name)
+        except OSError:
+            continue
+        subdirs: list[tuple[str, str, list[IgnoreRule]]] = []
+        for entry in entries:
+            rel = rel_dir + entry.name
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name in _ALWAYS_PRUNED or _ignored(rules, rel, True):
+                        continue
+                    base = rel + "/"
+                    subdirs.append(
+                        (entry.path, base, rules + load_ignore_rules(entry.path, base))
+                    )
+                elif (
+                    SOURCE_FILE_PATTERN.match(entry.name)
+                    and entry.is_file()
+                    and not _ignored(rules, rel, False)
+                ):
+                    yield Path(entry.path)
+            except OSError:
+                continue
+        # depth first in name order
+        stack.extend(reversed(subdirs))
+
+
+def read_file_list(stream: IO[str], null_separated: bool = False) -> Iterator[Path]:
+    """Yield the paths listed in stream, one per line or NUL separated."""
+    if not null_separated:
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield Path(line)
+        return
+    pending = ""
+    for chunk in iter(lambda: stream.read(65536), ""):
+        pending += chunk
+        *names, pending = pending.split("\0")
+        yield from (Path(name) for name in names if name)
+    if pending:
+        yield Path(pending)
+
+
+def filter_source_files(paths: Iterable[Path]) -> Iterator[Path]:
+    return (p for p in paths if is_source_file(p))
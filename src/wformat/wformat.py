@@ -1,54 +1,464 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+import difflib
 import multiprocessing
+import os
 from pathlib import Path
 import shutil
 import subprocess
 import sys
 import threading
-from typing import Sequence
+import time
+from typing import Iterable, Iterator, Mapping, Sequence
 
+from wformat.cache import CleanIndex, FormatCache, toolchain_fingerprint
 from wformat.clang_format import ClangFormat
+from wformat.encoding import (
+    join_bom,
+    native_newlines,
+    split_bom,
+    split_lines,
+    universal_newlines,
+)
 from wformat.normalizer import (
-    fix_with_tree_sitter,
-    normalize_integer_literal_in_memory,
+    IncrementalNormalizer,
+    LineRange,
+    expand_lines_to_units,
+    fix_bytes_with_tree_sitter,
 )
+from wformat.profile import span
 from wformat.uncrustify import Uncrustify
 
+# wformat's own passes shape the output as much as the tools do, so a change
+# to them must invalidate cached results even when the version is not bumped
+_FORMATTER_SOURCES: list[Path] = [
+    Path(__file__).with_name(name)
+    for name in (
+        "wformat.py",
+        "normalizer.py",
+        "encoding.py",
+        "clang_format.py",
+        "uncrustify.py",
+    )
+]
+
 
 def _get_formatted_path(file_path: Path) -> Path:
     return file_path.with_suffix(f".formatted{file_path.suffix}")
 
 
-class WFormat:
+def default_jobs() -> int:
+    # every file runs a clang-format | uncrustify process pair
+    cpu = multiprocessing.cpu_count()
+    return 1 if cpu <= 2 else (cpu - 1) // 2
+
+
+def auto_jobs() -> int:
+    """
+    Like default_jobs, but only counts the cores the 1-minute load average
+    leaves idle, so a busy CI machine is not oversubscribed.
+    """
+    cpu = multiprocessing.cpu_count()
+    try:
+        load = os.getloadavg()[0]
+    except (AttributeError, OSError):  # not available on Windows
+        return default_jobs()
+    idle = cpu - int(round(load))
+    return max(1, min(default_jobs(), (idle - 1) // 2))
+
+
+def largest_first(file_paths: Sequence[Path]) -> list[Path]:
+    """Order files by descending size so that the long tail starts early."""
+
+    def size(p: Path) -> int:
+        try:
+            return p.stat().st_size
+        except OSError:
+            return 0
+
+    return sorted(file_paths, key=size, reverse=True)
+
+
+def _source_text(data: bytes) -> str:
+    """Source bytes as text for display, whatever their encoding."""
+    return universal_newlines(split_bom(data)[1]).decode("utf-8", "replace")
+
+
+def _unified_diff(file_path: Path, formatted_text: str) -> str:
+    original_text = _source_text(file_path.read_bytes())
+    return "".join(
+        difflib.unified_diff(
+            split_lines(original_text),
+            split_lines(formatted_text),
+            f"{file_path}",
+            f"{file_path} (formatted)",
+        )
+    )
+
+
+def schedule(file_paths: Iterable[Path]) -> tuple[Iterable[Path], int | None]:
+    """
+    Order a list of files largest first and count it. Other iterables (a
+    directory walk) are streamed as they come, their length is unknown.
+    """
+    if isinstance(file_paths, Sequence):
+        return largest_first(file_paths), len(file_paths)
+    return file_paths, None
+
+
+def progress_label(count: int, total_count: int | None) -> str:
+    return f"[{count}/{total_count}]" if total_count is not None else f"[{count}]"
+
+
+def merge_line_ranges(lines: Sequence[LineRange]) -> list[LineRange]:
+    """Sort 1-based inclusive line ranges and merge overlapping/adjacent ones."""
+    merged: list[LineRange] = []
+    for first, last in sorted((max(1, a), max(1, b)) for a, b in lines):
+        if last < first:
+            continue
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(last, merged[-1][1]))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def _map_line_ranges(
+    old: Sequence[str], new: Sequence[str], lines: Sequence[LineRange]
+) -> list[LineRange]:
+    """Map line ranges of old onto the lines of new that replaced them."""
+    prefix = 0
+    limit = min(len(old), len(new))
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while (
+        suffix < limit - prefix
+        and old[len(old) - 1 - suffix] == new[len(new) - 1 - suffix]
+    ):
+        suffix += 1
+    matcher = difflib.SequenceMatcher(
+        None, old[prefix : len(old) - suffix], new[prefix : len(new) - suffix], False
+    )
+    ops = [("equal", 0, prefix, 0, prefix)]
+    ops += [
+        (tag, i1 + prefix, i2 + prefix, j1 + prefix, j2 + prefix)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+    ]
+    ops.append(("equal", len(old) - suffix, len(old), len(new) - suffix, len(new)))
+
+    def to_new(x: int, end: bool) -> int:
+        for tag, i1, i2, j1, j2 in ops:
+            if tag == "equal":
+                if i1 <= x < i2 or (end and i1 < x <= i2):
+                    return j1 + x - i1
+            elif i1 <= x <= i2:
+                return j2 if end else j1
+        return len(new)
+
+    mapped: list[LineRange] = []
+    for first, last in lines:
+        start, stop = to_new(first - 1, False), to_new(last, True)
+        mapped.append((start + 1, max(stop, start + 1)))
+    return merge_line_ranges(mapped)
+
+
+class FormatCanceled(RuntimeError):
+    """Raised by format_memory when its Cancellation was triggered."""
+
+
+class Cancellation:
+    """
+    Cancellation handle for a single format_memory call.
+
+    cancel() may be called from any thread; it kills the clang-format and
+    uncrustify processes of the call if they are already running.
+    """
+
     def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._canceled: bool = False
+        self._procs: list[subprocess.Popen] = []
+
+    @property
+    def canceled(self) -> bool:
+        return self._canceled
+
+    def cancel(self) -> None:
+        with self._lock:
+            self._canceled = True
+            procs = list(self._procs)
+        for proc in procs:
+            if proc.poll() is None:
+                proc.kill()
+
+    def register(self, proc: subprocess.Popen) -> None:
+        with self._lock:
+            self._procs.append(proc)
+            canceled = self._canceled
+        if canceled:
+            proc.kill()
+
+    def check(self) -> None:
+        if self._canceled:
+            raise FormatCanceled("canceled")
+
+
+class FormatTimeout(RuntimeError):
+    """Raised by format_memory when a stage or the whole file took too long."""
+
+    def __init__(self, stage: str, seconds: float) -> None:
+        super().__init__(f"{stage} timed out after {seconds:g}s")
+        self.stage: str = stage
+        self.seconds: float = seconds
+
+
+class Timeouts:
+    """
+    Time limits in seconds for formatting one file, None for no limit.
+    clang-format, uncrustify and tree-sitter each have their own limit,
+    file bounds all of them together.
+    """
+
+    def __init__(
+        self,
+        clang_format: float | None = None,
+        uncrustify: float | None = None,
+        tree_sitter: float | None = None,
+        file: float | None = None,
+    ) -> None:
+        self.stages: dict[str, float | None] = {
+            "clang-format": clang_format,
+            "uncrustify": uncrustify,
+            "tree-sitter": tree_sitter,
+        }
+        self.file: float | None = file
+
+    def scaled(self, factor: float) -> "Timeouts":
+        """These limits multiplied by factor, for a retry."""
+        limits = [None if t is None else t * factor for t in self.stages.values()]
+        file = None if self.file is None else self.file * factor
+        return Timeouts(*limits, file=file)
+
+    def deadline(self) -> float | None:
+        """Monotonic deadline of a file started now."""
+        return None if self.file is None else time.monotonic() + self.file
+
+    def limit(
+        self, stage: str, deadline: float | None
+    ) -> tuple[float | None, FormatTimeout]:
+        """
+        Seconds stage may take within the file deadline, and the error to
+        raise when it takes longer.
+        """
+        limit = self.stages[stage]
+        if deadline is not None:
+            remaining = max(0.0, deadline - time.monotonic())
+            if limit is None or remaining < limit:
+                assert self.file is not None
+                return remaining, FormatTimeout("file", self.file)
+        return limit, FormatTimeout(stage, limit or 0.0)
+
+
+class WFormat:
+    def __init__(self, cache: FormatCache | None = None) -> None:
         self.clang_format: ClangFormat = ClangFormat()
         self.uncrustify: Uncrustify = Uncrustify()
+        self.cache: FormatCache | None = cache
+        self.clean_index: CleanIndex | None = None
+        self.timeouts: Timeouts = Timeouts()
 
-    def format_memory(self, data: str) -> str:
-        p1 = subprocess.Popen(
-            self.clang_format.args_for_stdin(),
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            bufsize=65536,
-            text=False,
+    def fingerprint(self) -> str:
+        """
+        Fingerprint of the formatter binaries, their configs and the Python
+        sources of the formatting passes.
+        """
+        return toolchain_fingerprint(
+            [
+                self.clang_format.exe_path,
+                self.clang_format.config_path,
+                self.uncrustify.exe_path,
+                self.uncrustify.config_path,
+                *_FORMATTER_SOURCES,
+            ]
         )
-        p2 = subprocess.Popen(
-            self.uncrustify.args_for_stdin(),
-            stdin=p1.stdout,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            bufsize=65536,
-            text=False,
+
+    def enable_cache(self, cache_dir: Path | None = None) -> FormatCache:
+        fingerprint = self.fingerprint()
+        self.cache = FormatCache(fingerprint, cache_dir)
+        self.clean_index = CleanIndex(fingerprint, cache_dir)
+        return self.cache
+
+    def known_clean(self, file_path: Path) -> bool:
+        """Whether git's index entry for file_path is a known-clean blob."""
+        return self.clean_index is not None and self.clean_index.is_clean(file_path)
+
+    def format_memory(
+        self,
+        data: str,
+        cancel: Cancellation | None = None,
+        normalizer: IncrementalNormalizer | None = None,
+    ) -> str:
+        """
+        Format source code in memory. A normalizer keeps tree-sitter state
+        between calls for the same document, so that only changed regions
+        are normalized again. Text wrapper around format_bytes.
+        """
+        out = self._format_utf8(data.encode("utf-8"), cancel, normalizer)
+        return out.decode("utf-8", "replace")
+
+    def format_bytes(
+        self,
+        data: bytes,
+        cancel: Cancellation | None = None,
+        normalizer: IncrementalNormalizer | None = None,
+    ) -> bytes:
+        """
+        Format source bytes in memory without decoding them. BOMs and
+        encodings are handled as described in split_bom.
+        """
+        bom, body = split_bom(data)
+        return join_bom(bom, self._format_utf8(body, cancel, normalizer))
+
+    def _format_utf8(
+        self,
+        data: bytes,
+        cancel: Cancellation | None = None,
+        normalizer: IncrementalNormalizer | None = None,
+    ) -> bytes:
+        if self.cache is None:
+            return self._format_memory(data, cancel, normalizer)
+        with span("cache get"):
+            key = self.cache.key(data)
+            cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        out = self._format_memory(data, cancel, normalizer)
+        with span("cache put"):
+            self.cache.put(key, out)
+        return out
+
+    def format_memory_lines(
+        self,
+        data: str,
+        lines: Sequence[LineRange],
+        cancel: Cancellation | None = None,
+    ) -> str:
+        """
+        Format only the given 1-based inclusive line ranges of data and
+        return the whole text, leaving everything else untouched.
+        """
+        lines = merge_line_ranges(lines)
+        if not lines:
+            return data
+        if self.cache is None:
+            return self._format_memory_lines(data, lines, cancel)
+        key = self.cache.key(data.encode("utf-8", "surrogateescape"), f"lines={lines}")
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached.decode("utf-8", "surrogateescape")
+        text = self._format_memory_lines(data, lines, cancel)
+        self.cache.put(key, text.encode("utf-8", "surrogateescape"))
+        return text
+
+    def _format_memory_lines(
+        self,
+        data: str,
+        lines: Sequence[LineRange],
+        cancel: Cancellation | None = None,
+    ) -> str:
+        deadline = self.timeouts.deadline()
+        # clang-format natively restricts itself to the requested lines
+        out = self._run_tool(
+            "clang-format",
+            self.clang_format.args_for_stdin(lines),
+            data.encode("utf-8", "surrogateescape"),
+            cancel,
+            deadline,
         )
-        p1.stdout.close()
-        assert p1.stdin is not None
-        p1.stdin.write(data.encode("utf-8"))
-        p1.stdin.close()
-        err1 = p1.stderr.read() if p1.stderr else b""
-        out2, err2 = p2.communicate()
-        rc1 = p1.wait()
-        rc2 = p2.returncode
+        text = out.decode("utf-8", "surrogateescape")
+
+        # uncrustify cannot, so feed it just the statements covering them
+        lines = _map_line_ranges(data.split("\n"), text.split("\n"), lines)
+        units = expand_lines_to_units(text, lines)
+        text_lines = split_lines(text)
+        formatted: list[LineRange] = []
+        shift = 0
+        for first, last in units:
+            first, last = first + shift, min(last + shift, len(text_lines))
+            if first > last:
+                continue
+            fragment = "".join(text_lines[first - 1 : last])
+            out = self._run_tool(
+                "uncrustify",
+                self.uncrustify.args_for_stdin(fragment=True),
+                fragment.encode("utf-8", "surrogateescape"),
+                cancel,
+                deadline,
+            )
+            result = out.decode("utf-8", "surrogateescape")
+            if not fragment.endswith("\n"):
+                result = result.rstrip("\n")
+            elif not result.endswith("\n"):
+                result += "\n"
+            new_lines = split_lines(result)
+            text_lines[first - 1 : last] = new_lines
+            shift += len(new_lines) - (last - first + 1)
+            formatted.append((first, first + max(len(new_lines), 1) - 1))
+
+        text = "".join(text_lines)
+        data = text.encode("utf-8", "surrogateescape")
+        out = self._normalize(data, None, deadline, formatted)
+        return out.decode("utf-8", "surrogateescape")
+
+    def _run_tool(
+        self,
+        name: str,
+        args: Sequence[str | Path],
+        data: bytes,
+        cancel: Cancellation | None = None,
+        deadline: float | None = None,
+    ) -> bytes:
+        """Run one tool on data, within its timeout and the file deadline."""
+        if cancel is not None:
+            cancel.check()
+        timeout, expired = self.timeouts.limit(name, deadline)
+        with span(name, bytes=len(data)):
+            proc = subprocess.Popen(
+                args,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            if cancel is not None:
+                cancel.register(proc)
+            try:
+                out, err = proc.communicate(data, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.communicate()
+                raise expired from None
+        if cancel is not None:
+            cancel.check()
+        if proc.returncode != 0:
+            raise RuntimeError(
+                err.decode("utf-8", "replace") or f"{name} failed ({proc.returncode})"
+            )
+        return out
+
+    def _format_memory(
+        self,
+        data: bytes,
+        cancel: Cancellation | None = None,
+        normalizer: IncrementalNormalizer | None = None,
+    ) -> bytes:
+        if cancel is not None:
+            cancel.check()
+        deadline = self.timeouts.deadline()
+        with span("clang-format | uncrustify", bytes=len(data)):
+            rc1, rc2, err1, out2, err2 = self._run_tools(data, cancel, deadline)
+        if cancel is not None:
+            cancel.check()
         if rc1 != 0:
             raise RuntimeError(
                 err1.decode("utf-8", "replace") or f"clang-format failed ({rc1})"
@@ -57,27 +467,142 @@ class WFormat:
             raise RuntimeError(
                 err2.decode("utf-8", "replace") or f"uncrustify failed ({rc2})"
             )
-        text = out2.decode("utf-8", "replace")
-        text = fix_with_tree_sitter(text)
-        text = normalize_integer_literal_in_memory(text)
-        return text
+        return self._normalize(out2, normalizer, deadline)
+
+    def _normalize(
+        self,
+        data: bytes,
+        normalizer: IncrementalNormalizer | None = None,
+        deadline: float | None = None,
+        lines: Sequence[LineRange] | None = None,
+    ) -> bytes:
+        timeout, expired = self.timeouts.limit("tree-sitter", deadline)
+        try:
+            with span("tree-sitter"):
+                if normalizer is not None:
+                    return normalizer.fix_bytes(data, timeout)
+                return fix_bytes_with_tree_sitter(data, lines, timeout)
+        except TimeoutError:
+            raise expired from None
+
+    def _run_tools(
+        self,
+        data: bytes,
+        cancel: Cancellation | None = None,
+        deadline: float | None = None,
+    ) -> tuple[int, int, bytes, bytes, bytes]:
+        """
+        Pipe data through clang-format and uncrustify. Every pipe is fed and
+        drained at the same time, so neither a large input nor a chatty
+        stderr can stall the pipeline. FormatTimeout is raised, and both
+        tools are killed, when one takes longer than its timeout.
+        """
+        with span("spawn"):
+            p1 = subprocess.Popen(
+                self.clang_format.args_for_stdin(),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                bufsize=65536,
+                text=False,
+            )
+            p2 = subprocess.Popen(
+                self.uncrustify.args_for_stdin(),
+                stdin=p1.stdout,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                bufsize=65536,
+                text=False,
+            )
+        if cancel is not None:
+            cancel.register(p1)
+            cancel.register(p2)
+        # uncrustify reads clang-format's stdout, communicate must not
+        assert p1.stdout is not None
+        p1.stdout.close()
+        p1.stdout = None
+
+        # uncrustify's pipes are drained on a thread while clang-format's
+        # are fed and drained here
+        drained: list[tuple[bytes, bytes]] = []
+        drainer = threading.Thread(
+            target=lambda: drained.append(p2.communicate()), daemon=True
+        )
+        drainer.start()
+        try:
+            timeout, expired = self.timeouts.limit("clang-format", deadline)
+            try:
+                _, err1 = p1.communicate(data, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                raise expired from None
+            # uncrustify's own time starts when its input is complete
+            timeout, expired = self.timeouts.limit("uncrustify", deadline)
+            drainer.join(timeout)
+            if drainer.is_alive():
+                raise expired
+        except BaseException:
+            for proc in (p1, p2):
+                if proc.poll() is None:
+                    proc.kill()
+            p1.wait()
+            drainer.join()
+            raise
+        out2, err2 = drained[0]
+        return p1.returncode, p2.returncode, err1, out2, err2
+
+    def _format_source(
+        self,
+        raw: bytes,
+        lines: Sequence[LineRange] | None = None,
+        cancel: Cancellation | None = None,
+    ) -> bytes:
+        """
+        Format the bytes of a source file, with the newline translation of
+        text mode reads and writes.
+        """
+        bom, body = split_bom(raw)
+        body = universal_newlines(body)
+        if lines is not None:
+            # 8-bit sources round-trip like in format_bytes
+            text = body.decode("utf-8", "surrogateescape")
+            text = self.format_memory_lines(text, lines, cancel)
+            out = text.encode("utf-8", "surrogateescape")
+        else:
+            out = self._format_utf8(body, cancel)
+        return join_bom(bom, native_newlines(out))
 
     def run_stdin_pipeline(self) -> int:
-        data = sys.stdin.read()
-        text = self.format_memory(data)
-        sys.stdout.write(text)
+        sys.stdout.buffer.write(self._format_source(sys.stdin.buffer.read()))
         sys.stdout.flush()
         return 0
 
-    def format_inplace(self, file_path: Path) -> None:
-        original_text = file_path.read_text(encoding="utf-8")
-        formatted_text = self.format_memory(original_text)
-        file_path.write_text(formatted_text, encoding="utf-8")
+    def format_inplace(
+        self, file_path: Path, lines: Sequence[LineRange] | None = None
+    ) -> None:
+        with span("format_inplace", file=str(file_path)):
+            self._format_inplace(file_path, lines)
+
+    def _format_inplace(
+        self, file_path: Path, lines: Sequence[LineRange] | None = None
+    ) -> None:
+        clean_index = self.clean_index if lines is None else None
+        with span("read"):
+            raw = file_path.read_bytes()
+        if clean_index is not None and clean_index.is_clean(file_path, raw):
+            return
+        formatted = self._format_source(raw, lines)
+        if formatted == raw:
+            if clean_index is not None:
+                clean_index.mark_clean(raw)
+        else:
+            with span("write"):
+                file_path.write_bytes(formatted)
         self.uncrustify.clear_temp_files(file_path)
 
     def format_inplace_many(self, file_paths: Sequence[Path]) -> None:
         for p in file_paths:
-            self.format_inplace(p)
+            if not self.known_clean(p):
+                self.format_inplace(p)
 
     def format(self, file_path: Path) -> Path:
         formatted_file_path = _get_formatted_path(file_path)
@@ -88,38 +613,382 @@ class WFormat:
     def format_many(self, file_paths: Sequence[Path]) -> list[Path]:
         return [self.format(p) for p in file_paths]
 
-    def format_inplace_many_mt(self, file_paths: Sequence[Path]) -> None:
-        total_count = len(file_paths)
+    def format_inplace_many_mt(
+        self,
+        file_paths: Iterable[Path],
+        jobs: int | None = None,
+        lines: Mapping[Path, Sequence[LineRange]] | None = None,
+        on_timeout: str = "fail",
+    ) -> int:
+        """
+        Format files in place on a thread pool and return the number of
+        files that failed. With lines, only those line ranges of each file
+        are formatted. Files that exceed self.timeouts are reported and, by
+        on_timeout, counted as errors ("fail"), left alone ("skip") or
+        retried once with doubled timeouts after all other files ("retry").
+        """
+        file_paths, total_count = schedule(file_paths)
         if total_count == 0:
             print("-- No files to process")
-            return
-        cpu = multiprocessing.cpu_count()
-        process_num = 1 if cpu <= 2 else (cpu - 1) // 2
-        process_num = max(1, min(process_num, total_count))
-        print(f"-- Detected {total_count} files to process")
+            return 0
+        process_num = max(1, jobs or default_jobs())
+        if total_count is not None:
+            process_num = min(process_num, total_count)
+            print(f"-- Detected {total_count} files to process")
         print(f"-- Will spawn {process_num} worker threads")
         progress_counter = 0
+        error_counter = 0
+        timed_out: list[Path] = []
         progress_counter_lock = threading.Lock()
+        # keep the number of queued futures bounded on very large trees
+        slots = threading.BoundedSemaphore(2 * process_num)
 
-        def worker(p: Path) -> None:
-            nonlocal progress_counter
-            self.format_inplace(p)
-            with progress_counter_lock:
-                progress_counter += 1
-                print(f"-- [{progress_counter}/{total_count}] {p}")
+        def done(p: Path, fut: Future) -> None:
+            nonlocal progress_counter, error_counter
+            try:
+                with progress_counter_lock:
+                    try:
+                        fut.result()
+                    except FormatTimeout as e:
+                        timed_out.append(p)
+                        print(f"-- TIMEOUT while processing {p}: {e}")
+                    except Exception as e:
+                        error_counter += 1
+                        print(f"-- ERROR while processing {p}: {e!r}")
+                    else:
+                        progress_counter += 1
+                        print(f"-- {progress_label(progress_counter, total_count)} {p}")
+            finally:
+                slots.release()
 
-        error_counter = 0
         with ThreadPoolExecutor(max_workers=process_num) as executor:
-            fut_to_path = {executor.submit(worker, p): p for p in file_paths}
-            for fut in as_completed(fut_to_path):
-                p = fut_to_path[fut]
-                try:
-                    fut.result()
-                except Exception as e:
-                    error_counter += 1
-                    print(f"-- ERROR while processing {p}: {e!r}")
+            for p in file_paths:
+                if lines is None and self.known_clean(p):
+                    continue
+                slots.acquire()
+                fut = executor.submit(
+                    self.format_inplace, p, None if lines is None else lines[p]
+                )
+                fut.add_done_callback(lambda f, p=p: done(p, f))
+        retry_errors = 0
+        if timed_out and on_timeout == "retry":
+            print(f"-- Retrying {len(timed_out)} timed out file(s)")
+            with self._scaled_timeouts(2):
+                retry_errors = self.format_inplace_many_mt(timed_out, jobs, lines)
+        elif timed_out and on_timeout == "fail":
+            error_counter += len(timed_out)
+        if progress_counter + error_counter + len(timed_out) == 0:
+            print("-- No files to process")
+        if timed_out and on_timeout == "skip":
+            print(f"-- Skipped {len(timed_out)} timed out file(s)")
         if error_counter:
             print(f"-- Completed with {error_counter} error(s)")
+        return error_counter + retry_errors
+
+    def check(
+        self,
+        file_path: Path,
+        cancel: Cancellation | None = None,
+        lines: Sequence[LineRange] | None = None,
+    ) -> str | None:
+        """
+        Format file_path (or just the given lines of it) in memory and
+        compare with its bytes on disk. Returns the formatted text if the
+        file would change, None otherwise.
+        """
+        with span("check", file=str(file_path)):
+            return self._check(file_path, cancel, lines)
+
+    def _check(
+        self,
+        file_path: Path,
+        cancel: Cancellation | None = None,
+        lines: Sequence[LineRange] | None = None,
+    ) -> str | None:
+        clean_index = self.clean_index if lines is None else None
+        with span("read"):
+            raw = file_path.read_bytes()
+        if clean_index is not None and clean_index.is_clean(file_path, raw):
+            return None
+        expected = self._format_source(raw, lines, cancel)
+        if expected != raw:
+            return _source_text(expected)
+        if clean_index is not None:
+            clean_index.mark_clean(raw)
+        return None
+
+    def check_many(
+        self,
+        file_paths: Iterable[Path],
+        jobs: int | None = None,
+        diff: bool = False,
+        fail_fast: bool = False,
+        lines: Mapping[Path, Sequence[LineRange]] | None = None,
+        on_timeout: str = "fail",
+    ) -> int:
+        """
+        Check files in parallel without writing them. Returns the number of
+        files that are not formatted or could not be checked. on_timeout
+        treats files exceeding self.timeouts like format_inplace_many_mt.
+        """
+        file_paths, total_count = schedule(file_paths)
+        if total_count == 0:
+            print("-- No files to check")
+            return 0
+        process_num = max(1, jobs or default_jobs())
+        if total_count is not None:
+            process_num = min(process_num, total_count)
+            print(f"-- Checking {total_count} files with {process_num} worker threads")
+        else:
+            print(f"-- Checking files with {process_num} worker threads")
+        checked = 0
+        lock = threading.Lock()
+        slots = threading.BoundedSemaphore(2 * process_num)
+        stop = threading.Event()
+        cancels: dict[Path, Cancellation] = {}
+        failed: list[Path] = []
+        timed_out: list[Path] = []
+
+        def worker(p: Path, cancel: Cancellation) -> str | None:
+            if stop.is_set():
+                raise FormatCanceled("canceled")
+            return self.check(p, cancel, None if lines is None else lines[p])
+
+        def done(p: Path, fut: Future) -> None:
+            try:
+                with lock:
+                    cancels.pop(p, None)
+                    report(p, fut)
+                    if failed and fail_fast and not stop.is_set():
+                        stop.set()
+                        for cancel in cancels.values():
+                            cancel.cancel()
+            finally:
+                slots.release()
+
+        def report(p: Path, fut: Future) -> None:
+            try:
+                formatted = fut.result()
+            except FormatCanceled:
+                return
+            except FormatTimeout as e:
+                print(f"-- TIMEOUT while checking {p}: {e}")
+                if on_timeout == "fail":
+                    failed.append(p)
+                else:
+                    timed_out.append(p)
+                return
+            except Exception as e:
+                failed.append(p)
+                print(f"-- ERROR while checking {p}: {e!r}")
+                return
+            if formatted is not None:
+                failed.append(p)
+                print(f"-- Needs formatting: {p}")
+                if diff:
+                    print(_unified_diff(p, formatted), end="")
+
+        with ThreadPoolExecutor(max_workers=process_num) as executor:
+            for p in file_paths:
+                if lines is None and self.known_clean(p):
+                    checked += 1
+                    continue
+                slots.acquire()
+                if stop.is_set():
+                    break
+                checked += 1
+                cancel = Cancellation()
+                with lock:
+                    cancels[p] = cancel
+                fut = executor.submit(worker, p, cancel)
+                fut.add_done_callback(lambda f, p=p: done(p, f))
+
+        failures = len(failed)
+        if timed_out and on_timeout == "retry" and not stop.is_set():
+            print(f"-- Retrying {len(timed_out)} timed out file(s)")
+            with self._scaled_timeouts(2):
+                failures += self.check_many(timed_out, jobs, diff, fail_fast, lines)
+        if stop.is_set():
+            print("-- Stopped at the first violation (--fail-fast)")
+        elif failures:
+            print(f"-- {failures} of {checked} file(s) need formatting")
+        else:
+            print(f"-- All {checked} file(s) are formatted")
+        if timed_out and on_timeout == "skip":
+            print(f"-- Skipped {len(timed_out)} timed out file(s)")
+        return failures
+
+    @contextmanager
+    def _scaled_timeouts(self, factor: float) -> Iterator[None]:
+        timeouts = self.timeouts
+        self.timeouts = timeouts.scaled(factor)
+        try:
+            yield
+        finally:
+            self.timeouts = timeouts
+
+    async def format_memory_async(self, data: str) -> str:
+        """Coroutine version of format_memory that never blocks the loop."""
+        out = await self.format_bytes_async(data.encode("utf-8"))
+        return out.decode("utf-8", "replace")
+
+    async def format_bytes_async(self, data: bytes) -> bytes:
+        """Coroutine version of format_bytes that never blocks the loop."""
+        bom, body = split_bom(data)
+        return join_bom(bom, await self._format_utf8_async(body))
+
+    async def format_paths_async(
+        self,
+        file_paths: Iterable[Path],
+        limit: int | None = None,
+        check: bool = False,
+    ) -> dict[Path, bool | Exception]:
+        """
+        Format files in place (or with check, only compare them) with at
+        most limit files formatting at once (default: default_jobs()). The
+        result maps every file to whether it changed (with check, whether
+        it needs formatting) or to the exception it failed with.
+        """
+        import asyncio
+
+        slots = asyncio.Semaphore(max(1, limit or default_jobs()))
+
+        async def run(p: Path) -> bool | Exception:
+            async with slots:
+                try:
+                    return await self._format_path_async(p, check)
+                except Exception as e:
+                    return e
+
+        paths = list(file_paths)
+        results = await asyncio.gather(*(run(p) for p in paths))
+        return dict(zip(paths, results))
+
+    async def _format_path_async(self, file_path: Path, check: bool) -> bool:
+        import asyncio
+
+        clean_index = self.clean_index
+        if clean_index is None:
+            raw = await asyncio.to_thread(file_path.read_bytes)
+        else:
+            # both the lookup and the read may hash or stat files
+            if await asyncio.to_thread(clean_index.is_clean, file_path):
+                return False
+            raw = await asyncio.to_thread(file_path.read_bytes)
+            if await asyncio.to_thread(clean_index.is_clean, file_path, raw):
+                return False
+        bom, body = split_bom(raw)
+        out = await self._format_utf8_async(universal_newlines(body))
+        formatted = join_bom(bom, native_newlines(out))
+        if formatted == raw:
+            if clean_index is not None:
+                await asyncio.to_thread(clean_index.mark_clean, raw)
+            return False
+        if not check:
+            await asyncio.to_thread(file_path.write_bytes, formatted)
+        return True
+
+    async def _format_utf8_async(self, data: bytes) -> bytes:
+        import asyncio
+
+        cache = self.cache
+        key: str | None = None
+        if cache is not None:
+            # hashing a large source and the cache file read stay off the loop
+            key = await asyncio.to_thread(cache.key, data)
+            cached = await asyncio.to_thread(cache.get, key)
+            if cached is not None:
+                return cached
+        deadline = self.timeouts.deadline()
+        rc1, rc2, err1, out2, err2 = await self._run_tools_async(data, deadline)
+        if rc1 != 0:
+            raise RuntimeError(
+                err1.decode("utf-8", "replace") or f"clang-format failed ({rc1})"
+            )
+        if rc2 != 0:
+            raise RuntimeError(
+                err2.decode("utf-8", "replace") or f"uncrustify failed ({rc2})"
+            )
+        # the normalizer is CPU bound Python, it runs on the default executor
+        timeout, expired = self.timeouts.limit("tree-sitter", deadline)
+        try:
+            out = await asyncio.to_thread(
+                fix_bytes_with_tree_sitter, out2, None, timeout
+            )
+        except TimeoutError:
+            raise expired from None
+        if cache is not None and key is not None:
+            await asyncio.to_thread(cache.put, key, out)
+        return out
+
+    async def _run_tools_async(
+        self, data: bytes, deadline: float | None = None
+    ) -> tuple[int, int, bytes, bytes, bytes]:
+        """
+        Pipe data through clang-format and uncrustify like _run_tools, with
+        asyncio subprocesses and the same timeouts. Cancelling the awaiting
+        task kills both.
+        """
+        import asyncio
+
+        # an OS pipe between the tools, like p1.stdout -> p2.stdin in _run_tools
+        read_end, write_end = os.pipe()
+        p1: asyncio.subprocess.Process | None = None
+        p2: asyncio.subprocess.Process | None = None
+        drain: "asyncio.Future[tuple[bytes, bytes]] | None" = None
+        try:
+            try:
+                p1 = await asyncio.create_subprocess_exec(
+                    *self.clang_format.args_for_stdin(),
+                    stdin=subprocess.PIPE,
+                    stdout=write_end,
+                    stderr=subprocess.PIPE,
+                )
+                p2 = await asyncio.create_subprocess_exec(
+                    *self.uncrustify.args_for_stdin(),
+                    stdin=read_end,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                )
+            finally:
+                os.close(read_end)
+                os.close(write_end)
+
+            async def feed() -> None:
+                assert p1 is not None and p1.stdin is not None
+                try:
+                    p1.stdin.write(data)
+                    await p1.stdin.drain()
+                    p1.stdin.close()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # clang-format failed, its exit code says why
+
+            async def run_clang_format() -> tuple[bytes, int]:
+                assert p1 is not None and p1.stderr is not None
+                _, err = await asyncio.gather(feed(), p1.stderr.read())
+                return err, await p1.wait()
+
+            drain = asyncio.ensure_future(p2.communicate())
+            timeout, expired = self.timeouts.limit("clang-format", deadline)
+            try:
+                err1, rc1 = await asyncio.wait_for(run_clang_format(), timeout)
+                # uncrustify's own time starts when its input is complete
+                timeout, expired = self.timeouts.limit("uncrustify", deadline)
+                out2, err2 = await asyncio.wait_for(drain, timeout)
+            except asyncio.TimeoutError:
+                raise expired from None
+        except BaseException:
+            procs = [p for p in (p1, p2) if p is not None and p.returncode is None]
+            for proc in procs:
+                proc.kill()
+            # reap them, also when the task itself was cancelled
+            for proc in procs:
+                await proc.wait()
+            if drain is not None:
+                await asyncio.gather(drain, return_exceptions=True)
+            raise
+        assert p2.returncode is not None
+        return rc1, p2.returncode, err1, out2, err2
 
     def self_clean_configs(self) -> None:
         self.clang_format.self_clean_config()
@@ -1,4 +1,7 @@
+import multiprocessing
 import runpy
 
 if __name__ == "__main__":
+    # the pipeline engine starts normalizer processes from the frozen binary
+    multiprocessing.freeze_support()
     runpy.run_module("wformat", run_name="__main__")
\ No newline at end of file
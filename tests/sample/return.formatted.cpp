@@ -0,0 +1,8 @@
+bool
+Test()
+{
+    bool iDigitizerFlags = 0x01 | 0x02;
+
+    return iDigitizerFlags & 0x01 &&
+           iDigitizerFlags & (0x02 | 0x04);
+}
\ No newline at end of file
@@ -0,0 +1,57 @@
+import asyncio
+import codecs
+
+from wformat.wformat import WFormat
+
+SOURCE = "int   main( ) {  return  0 ; }\n"
+
+
+def test_format_memory_async():
+    formatter = WFormat()
+
+    async def run():
+        return await asyncio.gather(
+            *(formatter.format_memory_async(SOURCE) for _ in range(4))
+        )
+
+    assert asyncio.run(run()) == [formatter.format_memory(SOURCE)] * 4
+
+
+def test_format_paths_async(tmp_path):
+    formatter = WFormat()
+    paths = []
+    for i in range(6):
+        path = tmp_path / f"f{i}.cpp"
+        path.write_text(SOURCE)
+        paths.append(path)
+    clean = tmp_path / "clean.cpp"
+    clean.write_text(formatter.format_memory(SOURCE))
+    broken = tmp_path / "broken.cpp"
+    # a UTF-16 BOM followed by a truncated code unit
+    broken.write_bytes(codecs.BOM_UTF16_LE + b"\x00")
+
+    checked = asyncio.run(
+        formatter.format_paths_async([*paths, clean], limit=2, check=True)
+    )
+    assert checked == {**{p: True for p in paths}, clean: False}
+    assert paths[0].read_text() == SOURCE
+
+    results = asyncio.run(formatter.format_paths_async([*paths, clean, broken]))
+    # kept as bytes, clang-format refuses the stray BOM
+    assert isinstance(results.pop(broken), RuntimeError)
+    assert results == {**{p: True for p in paths}, clean: False}
+    assert all(p.read_text() == clean.read_text() for p in paths)
+
+
+def test_format_paths_async_with_cache(tmp_path):
+    formatter = WFormat()
+    formatter.enable_cache(tmp_path / "cache")
+    path = tmp_path / "f.cpp"
+    path.write_text(SOURCE)
+    assert asyncio.run(formatter.format_paths_async([path])) == {path: True}
+    # formatted now, and remembered as clean
+    assert asyncio.run(formatter.format_paths_async([path])) == {path: False}
+    assert formatter.clean_index is not None
+    assert formatter.clean_index.skipped == 0
+    assert asyncio.run(formatter.format_paths_async([path])) == {path: False}
+    assert formatter.clean_index.skipped == 1
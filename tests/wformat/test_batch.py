@@ -0,0 +1,58 @@
+import subprocess
+import sys
+
+from wformat.utils import run_batched
+
+# upper-cases files in place, but gives up on the whole batch at a "bad" file
+TOOL = """
+import sys
+for path in sys.argv[1:]:
+    data = open(path).read()
+    if "bad" in data:
+        sys.exit(f"cannot format {path}")
+    open(path, "w").write(data.upper())
+"""
+
+
+def test_run_batched_attributes_errors(tmp_path):
+    paths = []
+    for name, text in (("a.cpp", "a"), ("b.cpp", "bad"), ("c.cpp", "c")):
+        path = tmp_path / name
+        path.write_text(text)
+        paths.append(path)
+    calls = []
+
+    def run(batch):
+        calls.append(len(batch))
+        return subprocess.run(
+            [sys.executable, "-c", TOOL, *map(str, batch)], capture_output=True
+        )
+
+    errors = run_batched("tool", run, paths + [tmp_path / "missing.cpp"])
+    assert set(errors) == {paths[1], tmp_path / "missing.cpp"}
+    assert "cannot format" in errors[paths[1]]
+    # the failed batch is restored and retried file by file
+    assert calls == [3, 1, 1, 1]
+    assert [p.read_text() for p in paths] == ["A", "bad", "C"]
+
+
+def test_run_batched_chunks_the_command_line(tmp_path, monkeypatch):
+    from wformat import utils
+
+    paths = []
+    for i in range(6):
+        path = tmp_path / f"{i}.cpp"
+        path.write_text("x")
+        paths.append(path)
+    monkeypatch.setattr(utils, "MAX_COMMAND_CHARS", 3 * (len(str(paths[0])) + 1))
+    calls = []
+
+    def run(batch):
+        calls.append(len(batch))
+        return subprocess.run(
+            [sys.executable, "-c", TOOL, *map(str, batch)], capture_output=True
+        )
+
+    assert run_batched("tool", run, paths) == {}
+    assert calls == [3, 3]
+    assert [p.read_text() for p in paths] == ["X"] * 6
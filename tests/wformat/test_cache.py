@@ -0,0 +1,112 @@
+import os
+import time
+
+from wformat.cache import (
+    CleanIndex,
+    FormatCache,
+    git_blob_sha,
+    toolchain_fingerprint,
+)
+
+
+def test_cache_roundtrip(tmp_path):
+    cache = FormatCache("fp", tmp_path)
+    key = cache.key(b"int main(){}")
+    assert cache.get(key) is None
+    cache.put(key, b"int main() {}\n")
+    assert cache.get(key) == b"int main() {}\n"
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_cache_key_depends_on_fingerprint(tmp_path):
+    a = FormatCache("fp-a", tmp_path)
+    b = FormatCache("fp-b", tmp_path)
+    assert a.key(b"x") != b.key(b"x")
+    assert a.key(b"x") != a.key(b"y")
+
+
+def test_fingerprint_tracks_config(tmp_path):
+    cfg = tmp_path / "uncrustify.cfg"
+    cfg.write_text("indent_columns = 4\n", encoding="utf-8")
+    before = toolchain_fingerprint([cfg])
+    cfg.write_text("indent_columns = 2\n", encoding="utf-8")
+    assert toolchain_fingerprint([cfg]) != before
+
+
+def test_fingerprint_tracks_formatter_sources(tmp_path, monkeypatch):
+    from wformat import wformat
+
+    source = tmp_path / "normalizer.py"
+    source.write_text("PASSES = 1\n", encoding="utf-8")
+    monkeypatch.setattr(wformat, "_FORMATTER_SOURCES", [source])
+    before = wformat.WFormat().fingerprint()
+    source.write_text("PASSES = 2\n", encoding="utf-8")
+    assert wformat.WFormat().fingerprint() != before
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = FormatCache("fp", tmp_path, max_bytes=250)
+    keys = [cache.key(str(i).encode()) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, b"x" * 100)
+        # make the access order explicit regardless of timestamp resolution
+        stamp = time.time() - 100 + i
+        os.utime(cache._entry_path(key), (stamp, stamp))
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[1]) is not None
+    assert cache.get(keys[2]) is not None
+    assert cache.stats()["evictions"] >= 1
+
+
+def test_git_blob_sha_matches_git():
+    # git hash-object of "hello\n"
+    assert git_blob_sha(b"hello\n") == "ce013625030ba8dba906f756967f9e9ca394464a"
+
+
+def test_clean_index_persists(tmp_path):
+    index = CleanIndex("fp", tmp_path)
+    assert not index.is_clean(tmp_path / "a.cpp", b"int a;\n")
+    index.mark_clean(b"int a;\n")
+    index.save()
+
+    index = CleanIndex("fp", tmp_path)
+    assert index.is_clean(tmp_path / "a.cpp", b"int a;\n")
+    assert not index.is_clean(tmp_path / "a.cpp", b"int b;\n")
+    assert index.skipped == 1
+    assert not CleanIndex("other", tmp_path).is_clean(tmp_path / "a.cpp", b"int a;\n")
+
+
+def test_clean_index_is_bounded(tmp_path):
+    index = CleanIndex("fp", tmp_path, max_entries=10)
+    for i in range(8):
+        index.mark_clean(b"%d" % i)
+    index.save()
+    index = CleanIndex("fp", tmp_path, max_entries=10)
+    assert index.is_clean(tmp_path / "a.cpp", b"0")
+    for i in range(8, 12):
+        index.mark_clean(b"%d" % i)
+    index.save()
+
+    # rewritten with the 9 most recently added or used entries
+    index = CleanIndex("fp", tmp_path, max_entries=10)
+    assert len(index.path.read_text("ascii").split()) == 9
+    kept = [i for i in range(12) if index.is_clean(tmp_path / "a.cpp", b"%d" % i)]
+    assert kept == [0, 4, 5, 6, 7, 8, 9, 10, 11]
+
+
+def test_clean_index_removes_other_fingerprints(tmp_path):
+    old = CleanIndex("old", tmp_path)
+    old.mark_clean(b"int a;\n")
+    old.save()
+    recent = CleanIndex("recent", tmp_path)
+    recent.mark_clean(b"int a;\n")
+    recent.save()
+    a_while_ago = time.time() - 2 * 24 * 60 * 60
+    os.utime(old.path, (a_while_ago, a_while_ago))
+
+    index = CleanIndex("fp", tmp_path)
+    index.mark_clean(b"int a;\n")
+    index.save()
+    assert not old.path.exists()
+    assert recent.path.exists()
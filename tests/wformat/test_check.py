@@ -0,0 +1,28 @@
+from wformat.wformat import WFormat
+
+SOURCE = "int   main( ) {  return  0 ; }\n"
+
+
+def test_check_is_read_only(tmp_path, capsys):
+    formatter = WFormat()
+    clean = tmp_path / "clean.cpp"
+    clean.write_text(formatter.format_memory(SOURCE), encoding="utf-8")
+    dirty = tmp_path / "dirty.cpp"
+    dirty.write_text(SOURCE, encoding="utf-8")
+
+    assert formatter.check(clean) is None
+    assert formatter.check_many([clean, dirty], jobs=2, diff=True) == 1
+    assert dirty.read_text(encoding="utf-8") == SOURCE
+    out = capsys.readouterr().out
+    assert f"-- Needs formatting: {dirty}" in out
+    assert f"+++ {dirty} (formatted)" in out
+
+
+def test_check_fail_fast(tmp_path, capsys):
+    paths = []
+    for i in range(8):
+        path = tmp_path / f"f{i}.cpp"
+        path.write_text(SOURCE, encoding="utf-8")
+        paths.append(path)
+    assert 1 <= WFormat().check_many(paths, jobs=1, fail_fast=True) < len(paths)
+    assert "--fail-fast" in capsys.readouterr().out
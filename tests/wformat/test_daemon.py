@@ -0,0 +1,294 @@
+import base64
+import json
+import subprocess
+import sys
+
+from wformat.wformat import WFormat
+
+
+def run_daemon(requests: list[dict], *args: str) -> list[dict]:
+    lines = "".join(json.dumps(r) + "\n" for r in requests)
+    proc = subprocess.run(
+        [sys.executable, "-m", "wformat", "--serve", "--no-cache", *args],
+        input=lines,
+        text=True,
+        capture_output=True,
+        timeout=120,
+    )
+    assert proc.returncode == 0, proc.stderr
+    return [json.loads(line) for line in proc.stdout.splitlines() if line.strip()]
+
+
+def b64(text: str) -> str:
+    return base64.b64encode(text.encode("utf-8")).decode("ascii")
+
+
+def test_daemon_replies_by_id():
+    sources = {
+        i: f"int   f{i}( ) {{  return  {i} ; }}\n" for i in range(1, 9)
+    }
+    requests = [{"id": i, "op": "format", "b64": b64(s)} for i, s in sources.items()]
+    requests += [{"id": 100, "op": "ping"}, {"op": "shutdown"}]
+    replies = run_daemon(requests, "--serve-jobs", "4")
+
+    # shutdown is acknowledged last, after every in-flight request
+    assert replies[-1] == {"ok": True}
+    by_id = {r["id"]: r for r in replies[:-1]}
+    assert set(by_id) == set(sources) | {100}
+
+    formatter = WFormat()
+    for i, source in sources.items():
+        assert by_id[i]["ok"], by_id[i]
+        out = base64.b64decode(by_id[i]["b64"]).decode("utf-8")
+        assert out == formatter.format_memory(source)
+
+
+def test_daemon_bad_requests():
+    replies = run_daemon(
+        [
+            {"id": 1, "op": "format", "b64": "***"},
+            {"id": 2, "op": "nope"},
+            # raw "data" only comes with binary frames, JSON must use b64
+            {"id": 3, "op": "format_range", "data": "int a;\n", "lines": [[1, 1]]},
+            {"id": 4, "op": "open", "doc": "a", "data": "int a;\n"},
+            [1, 2],
+        ]
+    )
+    by_id = {r.get("id"): r for r in replies}
+    assert by_id[1] == {"id": 1, "ok": False, "error": "invalid base64 in 'b64'"}
+    assert by_id[2]["ok"] is False
+    assert by_id[3] == {"id": 3, "ok": False, "error": "invalid base64 in 'b64'"}
+    assert by_id[4] == {"id": 4, "ok": True}
+    assert by_id[None] == {"ok": False, "error": "request must be a JSON object"}
+
+
+def test_daemon_cancel():
+    # a single worker is busy with request 1, so request 2 is still queued
+    big = "int   f( ) {  return  0 ; }\n" * 20000
+    replies = run_daemon(
+        [
+            {"id": 1, "op": "format", "b64": b64(big)},
+            {"id": 2, "op": "format", "b64": b64(big)},
+            {"id": 2, "op": "cancel"},
+            {"id": 3, "op": "cancel"},
+            {"op": "shutdown"},
+        ],
+        "--serve-jobs",
+        "1",
+    )
+    assert replies[-1] == {"ok": True}
+    by_id = {r["id"]: r for r in replies[:-1]}
+    assert set(by_id) == {1, 2}
+    assert by_id[1]["ok"]
+    assert by_id[2] == {"id": 2, "ok": False, "error": "canceled"}
+
+
+def test_daemon_binary_framing():
+    from wformat.daemon import FRAME_HEADER, OP_FORMAT, OP_JSON, OP_PING, encode_frame
+
+    source = "int   main( ) {  return  0 ; }\n"
+    stream = b'{"id": 1, "op": "hello", "framing": "binary"}\n'
+    stream += encode_frame(2, OP_FORMAT, source.encode("utf-8"))
+    stream += encode_frame(3, OP_PING, b"")
+    stream += encode_frame(4, OP_JSON, b'{"id": 4, "op": "shutdown"}')
+    proc = subprocess.run(
+        [sys.executable, "-m", "wformat", "--serve", "--no-cache"],
+        input=stream,
+        capture_output=True,
+        timeout=120,
+    )
+    assert proc.returncode == 0, proc.stderr
+
+    hello, _, rest = proc.stdout.partition(b"\n")
+    assert json.loads(hello) == {"id": 1, "ok": True, "framing": "binary"}
+    frames = {}
+    while rest:
+        rid, op, status, length = FRAME_HEADER.unpack_from(rest)
+        end = FRAME_HEADER.size + length
+        frames[rid] = (op, status, rest[FRAME_HEADER.size : end])
+        rest = rest[end:]
+
+    assert frames[2] == (
+        OP_FORMAT,
+        0,
+        WFormat().format_memory(source).encode("utf-8"),
+    )
+    assert frames[3] == (OP_PING, 0, b"")
+    assert json.loads(frames[0][2]) == {"ok": True}
+
+
+def test_daemon_format_range():
+    source = (
+        "int   a( ) {  return  0xff ; }\n"
+        "int   b( ) {\n"
+        "  int x=foo(  3 );\n"
+        "    return  x ;\n"
+        "}\n"
+        "int   c( ) {  return  0xff ; }\n"
+    )
+    replies = run_daemon(
+        [
+            {"id": 1, "op": "format_range", "b64": b64(source), "lines": [[3, 3]]},
+            {"id": 2, "op": "format_range", "b64": b64(source), "bytes": [[0, 4]]},
+        ]
+    )
+    by_id = {r["id"]: r for r in replies}
+    expected = WFormat().format_memory_lines(source, [(3, 3)])
+    assert expected.splitlines()[0] == source.splitlines()[0]
+    assert expected.splitlines()[-1] == source.splitlines()[-1]
+
+    reply = by_id[1]
+    assert reply["ok"], reply
+    lines = source.splitlines(keepends=True)
+    patched = (
+        "".join(lines[: reply["start_line"] - 1])
+        + base64.b64decode(reply["b64"]).decode("utf-8")
+        + "".join(lines[reply["end_line"] :])
+    )
+    assert patched == expected
+    assert by_id[2]["ok"], by_id[2]
+
+
+def test_daemon_document_sessions():
+    source = "int   main( ) {  return  0 ; }\n"
+    changed = source.replace("0", "1")
+    at = source.index("0")
+    replies = run_daemon(
+        [
+            {"id": 1, "op": "open", "doc": "a.cpp", "b64": b64(source)},
+            {"id": 2, "op": "format", "doc": "a.cpp"},
+            {
+                "id": 3,
+                "op": "change",
+                "doc": "a.cpp",
+                "edits": [{"start": at, "end": at + 1, "b64": b64("1")}],
+            },
+            {"id": 4, "op": "format", "doc": "a.cpp"},
+            {"id": 5, "op": "close", "doc": "a.cpp"},
+            {"id": 6, "op": "format", "doc": "a.cpp"},
+            {"op": "shutdown"},
+        ]
+    )
+    by_id = {r["id"]: r for r in replies[:-1]}
+    formatter = WFormat()
+    assert by_id[1] == {"id": 1, "ok": True}
+    assert base64.b64decode(by_id[2]["b64"]).decode() == formatter.format_memory(source)
+    assert by_id[3] == {"id": 3, "ok": True}
+    assert base64.b64decode(by_id[4]["b64"]).decode() == formatter.format_memory(changed)
+    assert by_id[5] == {"id": 5, "ok": True}
+    assert by_id[6] == {"id": 6, "ok": False, "error": "unknown document"}
+
+
+def test_daemon_stats():
+    source = "int   main( ) {  return  0 ; }\n"
+    replies = run_daemon(
+        [
+            {"id": 1, "op": "format", "b64": b64(source)},
+            {"id": 2, "op": "format", "b64": "***"},
+            {"id": 3, "op": "stats"},
+            {"op": "shutdown"},
+        ]
+    )
+    stats = {r["id"]: r for r in replies[:-1]}[3]["stats"]
+    # counted when read, the format itself may still be running
+    assert stats["requests"] == {"format": 2, "stats": 1}
+    assert stats["errors"] == {"invalid base64 in 'b64'": 1}
+    assert stats["bytes_in"] == len(source)
+    assert stats["workers"] >= 1
+
+
+def test_daemon_stats_counts_requests():
+    from wformat.daemon import WFormatDaemon
+
+    daemon = WFormatDaemon(WFormat())
+    daemon.stats.request("format")
+    daemon.stats.received(10)
+    daemon.stats.observe("format", 0.002)
+    daemon.stats.observe("format", 0.050)
+    daemon._reply_err("bad json: oops", 1)
+    # whatever ops a client makes up, they share one counter
+    for op in ("nope", "nope2", ["x"]):
+        daemon._dispatch(None, {"id": 2, "op": op})
+    stats = daemon.snapshot()
+    assert stats["requests"] == {"format": 1, "unknown": 3}
+    assert stats["errors"] == {"bad json": 1, "unknown op": 3}
+    assert stats["bytes_in"] == 10
+    assert stats["queue_depth"] == 0
+    latency = stats["latency"]["format"]
+    assert latency["count"] == 2
+    assert 2 <= latency["p50_ms"] <= 2.5
+    assert 45 <= latency["p99_ms"] <= 50
+
+
+def test_daemon_format_many():
+    sources = [f"int   f{i}( ) {{  return  {i} ; }}\n" for i in range(6)]
+    docs = [{"b64": b64(s)} for s in sources]
+    docs += [{"b64": "***"}, {"doc": "file:///b.cpp"}]
+    replies = run_daemon(
+        [
+            {"id": 1, "op": "open", "doc": "file:///a.cpp", "b64": b64(sources[0])},
+            {"id": 2, "op": "format_many", "docs": [{"doc": "file:///a.cpp"}, *docs]},
+            {"id": 3, "op": "format_many", "docs": []},
+            {"op": "shutdown"},
+        ],
+        "--serve-jobs",
+        "4",
+    )
+    assert replies[-1] == {"ok": True}
+    batch = [r for r in replies if r.get("id") == 2]
+    # one reply per document, then the done reply
+    assert batch[-1] == {"id": 2, "ok": True, "done": True, "count": 9}
+    by_index = {r["index"]: r for r in batch[:-1]}
+    assert sorted(by_index) == list(range(9))
+
+    formatter = WFormat()
+    for index, source in enumerate([sources[0], *sources]):
+        assert by_index[index]["ok"], by_index[index]
+        out = base64.b64decode(by_index[index]["b64"]).decode("utf-8")
+        assert out == formatter.format_memory(source)
+    assert by_index[7]["error"] == "invalid base64 in 'b64'"
+    assert by_index[8]["error"] == "unknown document"
+    assert {r["id"]: r for r in replies[:-1]}[3] == {
+        "id": 3,
+        "ok": False,
+        "error": "missing 'docs'",
+    }
+
+
+def test_daemon_format_many_cancel():
+    big = b64("int   f( ) {  return  0 ; }\n" * 20000)
+    replies = run_daemon(
+        [
+            {"id": 1, "op": "format_many", "docs": [{"b64": big}] * 3},
+            {"id": 1, "op": "cancel"},
+            {"op": "shutdown"},
+        ],
+        "--serve-jobs",
+        "1",
+    )
+    assert replies[-1] == {"ok": True}
+    assert replies[-2] == {"id": 1, "ok": True, "done": True, "count": 3}
+    by_index = {r["index"]: r for r in replies[:-2]}
+    assert sorted(by_index) == [0, 1, 2]
+    # the last document is still queued when the cancel is read
+    assert by_index[2] == {"id": 1, "index": 2, "ok": False, "error": "canceled"}
+
+
+def test_daemon_format_many_busy():
+    from concurrent.futures import ThreadPoolExecutor
+
+    from wformat.daemon import WFormatDaemon
+
+    daemon = WFormatDaemon(WFormat(), max_workers=1)
+    daemon._MAX_BATCH_BYTES = 64 * 1024
+    big = {"b64": b64("int   f( ) {  return  0 ; }\n" * 2000)}
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # the first batch is taken however large, the next one is refused
+        daemon._dispatch(executor, {"id": 1, "op": "format_many", "docs": [big] * 3})
+        daemon._dispatch(executor, {"id": 2, "op": "format_many", "docs": [big]})
+    assert daemon._batch_bytes == 0
+    replies = []
+    while not daemon._replies.empty():
+        replies.append(json.loads(daemon._replies.get()))
+    assert {"id": 2, "ok": False, "error": "busy"} in replies
+    assert {"id": 1, "ok": True, "done": True, "count": 3} in replies
@@ -0,0 +1,59 @@
+import codecs
+
+import pytest
+
+from wformat.daemon import changed_region
+from wformat.encoding import join_bom, split_bom, split_lines
+from wformat.wformat import WFormat
+
+SOURCE = "int   main( ) {  return  0 ; }\n"
+
+
+def test_split_bom_roundtrip():
+    utf16 = codecs.BOM_UTF16_LE + "int a; // é\n".encode("utf-16-le")
+    bom, body = split_bom(utf16)
+    assert bom == codecs.BOM_UTF16_LE
+    assert body == "int a; // é\n".encode("utf-8")
+    assert join_bom(bom, body) == utf16
+
+    assert split_bom(codecs.BOM_UTF8 + b"int a;\n") == (codecs.BOM_UTF8, b"int a;\n")
+    latin1 = "int a; // \xe9\n".encode("latin-1")
+    assert split_bom(latin1) == (b"", latin1)
+    # what only looks like a UTF-16 BOM is kept as bytes too
+    odd = codecs.BOM_UTF16_LE + b"int a;\n"
+    assert split_bom(odd) == (b"", odd)
+    # and left to clang-format to judge, which reports it like any other error
+    with pytest.raises(RuntimeError, match="byte order mark"):
+        WFormat().format_bytes(odd)
+
+
+def test_format_bytes_matches_format_memory():
+    formatter = WFormat()
+    expected = formatter.format_memory(SOURCE).encode("utf-8")
+    assert formatter.format_bytes(SOURCE.encode("utf-8")) == expected
+    # the BOM survives, and the body is formatted as without it
+    data = codecs.BOM_UTF8 + SOURCE.encode("utf-8")
+    assert formatter.format_bytes(data) == codecs.BOM_UTF8 + expected
+
+
+def test_format_inplace_keeps_non_utf8_bytes(tmp_path):
+    # a comment in latin-1 must come back byte for byte, not as U+FFFD
+    path = tmp_path / "latin1.cpp"
+    path.write_bytes(b"// caf\xe9\n" + SOURCE.encode("ascii"))
+    WFormat().format_inplace(path)
+    assert path.read_bytes().startswith(b"// caf\xe9\n")
+
+    # the same with --lines-changed
+    path.write_bytes(b"// caf\xe9\n" + SOURCE.encode("ascii"))
+    WFormat().format_inplace(path, [(2, 2)])
+    expected = WFormat().format_memory(SOURCE).encode("ascii")
+    assert path.read_bytes() == b"// caf\xe9\n" + expected
+
+
+def test_only_newlines_split_lines():
+    assert split_lines("a\x0cb\rc\u2028d\ne\n") == ["a\x0cb\rc\u2028d\n", "e\n"]
+    assert split_lines("a\nb") == ["a\n", "b"]
+    assert split_lines("") == []
+    # a form feed in a comment must not shift the changed line
+    old = "// a\x0cb\nint  x;\n"
+    assert changed_region(old, "// a\x0cb\nint x;\n") == (2, 2, "int x;\n")
@@ -0,0 +1,79 @@
+import codecs
+
+from wformat.engine import PipelineEngine
+from wformat.wformat import WFormat
+
+SOURCES = [
+    "int   main( ) {  return  0 ; }\n",
+    "struct  S{int a ;int b;};\nint f( int x ){return x*0xff;}\n",
+    "",
+]
+
+
+def test_pipeline_matches_format_memory(tmp_path):
+    formatter = WFormat()
+    paths = []
+    for i, source in enumerate(SOURCES):
+        path = tmp_path / f"f{i}.cpp"
+        path.write_text(source, encoding="utf-8")
+        paths.append(path)
+    bad = tmp_path / "missing.cpp"
+
+    engine = PipelineEngine(formatter, 2, 2, 1)
+    assert engine.run(paths + [bad]) == 1
+
+    for path, source in zip(paths, SOURCES):
+        assert path.read_text(encoding="utf-8") == formatter.format_memory(source)
+    assert [s.items for s in engine.stats] == [3, 3, 3]
+
+
+def test_batches_format_copies_of_the_sources(tmp_path):
+    formatter = WFormat()
+    source = SOURCES[1]
+    utf16 = tmp_path / "utf16.cpp"
+    utf16.write_bytes(codecs.BOM_UTF16_LE + source.encode("utf-16-le"))
+    plain = tmp_path / "plain.cpp"
+    plain.write_text(SOURCES[0], encoding="utf-8")
+
+    engine = PipelineEngine(formatter, 1, 1, 1, batch_size=4)
+    assert engine.run([utf16, plain]) == 0
+
+    expected = formatter.format_bytes(source.encode("utf-8")).decode("utf-8")
+    assert utf16.read_bytes() == codecs.BOM_UTF16_LE + expected.encode("utf-16-le")
+    assert plain.read_text(encoding="utf-8") == formatter.format_memory(SOURCES[0])
+    assert [s.items for s in engine.stats] == [2, 2, 2]
+
+
+def test_pipeline_timeouts(tmp_path, capsys):
+    from wformat.wformat import Timeouts
+
+    formatter = WFormat()
+    formatter.timeouts = Timeouts(tree_sitter=1e-6)
+    big = tmp_path / "big.cpp"
+    big.write_text("int f() { return g(1, 2) + 0xff; }\n" * 2000, encoding="utf-8")
+    engine = PipelineEngine(formatter, 1, 1, 1)
+    assert engine.run([big]) == 1
+    assert f"-- TIMEOUT while processing {big}: tree-sitter timed out" in (
+        capsys.readouterr().out
+    )
+    assert engine.run([big], on_timeout="skip") == 0
+    assert "-- Skipped 1 timed out file(s)" in capsys.readouterr().out
+
+
+def test_pipeline_uses_the_clean_index(tmp_path):
+    import os
+
+    formatter = WFormat()
+    formatter.enable_cache(tmp_path / "cache")
+    path = tmp_path / "f.cpp"
+    path.write_text(formatter.format_memory(SOURCES[1]), encoding="utf-8")
+    os.utime(path, ns=(0, 0))
+
+    engine = PipelineEngine(formatter, 1, 1, 1)
+    assert engine.run([path]) == 0
+    # formatted already, so left untouched and remembered as clean
+    assert path.stat().st_mtime_ns == 0
+    assert engine.run([path]) == 0
+    assert formatter.clean_index is not None
+    assert formatter.clean_index.skipped == 1
+    assert [s.items for s in engine.stats] == [0, 0, 0]
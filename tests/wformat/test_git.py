@@ -0,0 +1,61 @@
+import subprocess
+
+import pytest
+
+from wformat import git
+from wformat.cache import git_blob_sha
+
+
+def run_git(cwd, *args):
+    subprocess.run(
+        ["git", "-c", "user.name=t", "-c", "user.email=t@t", *args],
+        cwd=cwd,
+        check=True,
+        capture_output=True,
+    )
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    if not git.git_available():
+        pytest.skip("git not available")
+    run_git(tmp_path, "init", "-q")
+    for name in ("a.cpp", "gone.cpp", "with space.h"):
+        (tmp_path / name).write_text("int a;\n", encoding="utf-8")
+    run_git(tmp_path, "add", ".")
+    run_git(tmp_path, "commit", "-q", "-m", "init")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_git_lists_skip_deleted_and_keep_odd_names(repo, capsys):
+    (repo / "a.cpp").write_text("int b;\n", encoding="utf-8")
+    (repo / "with space.h").write_text("int c;\n", encoding="utf-8")
+    (repo / "gone.cpp").unlink()
+    names = sorted(p.name for p in git.get_modified_files())
+    assert names == ["a.cpp", "with space.h"]
+
+    git.restage_files(git.get_modified_files())
+    assert sorted(p.name for p in git.get_staged_files()) == names
+    assert git.get_modified_files() == []
+    assert "with 1 git call(s)" in capsys.readouterr().out
+
+
+def test_git_changed_lines(repo):
+    (repo / "a.cpp").write_text("int a;\nint b;\nint c;\nint d;\n", encoding="utf-8")
+    run_git(repo, "commit", "-q", "-am", "more")
+    (repo / "a.cpp").write_text("int a;\nint  B;\nint c;\n", encoding="utf-8")
+    (repo / "gone.cpp").unlink()
+    (repo / "new.cpp").write_text("int x;\nint y;\n", encoding="utf-8")
+    run_git(repo, "add", "-A")
+    changes = {p.name: lines for p, lines in git.get_staged_lines().items()}
+    # the deleted last line maps to the line before it
+    assert changes == {"a.cpp": [(2, 2), (3, 3)], "new.cpp": [(1, 2)]}
+
+
+def test_git_clean_blob_shas(repo):
+    (repo / "a.cpp").write_text("int b;\n", encoding="utf-8")
+    shas = {p.name: sha for p, sha in git.get_clean_blob_shas().items()}
+    # the modified file is left out, it has to be read and hashed
+    assert sorted(shas) == ["gone.cpp", "with space.h"]
+    assert shas["gone.cpp"] == git_blob_sha(b"int a;\n")
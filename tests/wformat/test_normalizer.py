@@ -0,0 +1,45 @@
+import pytest
+
+from wformat.normalizer import IncrementalNormalizer, apply_edits, fix_with_tree_sitter
+
+SOURCE = """int
+    f(int a);
+
+void g()
+{
+    foo( x );
+    bar( y, z );
+}
+"""
+
+
+def test_incremental_normalizer_matches_full_pass():
+    normalizer = IncrementalNormalizer()
+    text = SOURCE
+    edits = [
+        ("foo( x )", "foo(  x  )"),
+        ("int\n    f", "int\n      f"),
+        ("bar( y, z )", "bar( y )"),
+        ("void g()", "void g(int)"),
+        ("{\n", "{\n    baz( 1 );\n"),
+    ]
+    assert normalizer.fix(text) == fix_with_tree_sitter(text)
+    for old, new in edits:
+        text = text.replace(old, new, 1)
+        assert normalizer.fix(text) == fix_with_tree_sitter(text)
+    assert normalizer.incremental_passes >= 1
+
+
+def test_apply_edits_is_order_independent_and_rejects_overlaps():
+    src = b"0123456789"
+    edits = [(8, 9, b"x"), (0, 2, b""), (4, 4, b"-")]
+    assert apply_edits(src, edits) == b"23-4567x9"
+    with pytest.raises(ValueError):
+        apply_edits(src, [(0, 5, b""), (3, 6, b"")])
+
+
+def test_integer_literals_are_normalized_outside_strings_and_comments():
+    code = 'int a = 0XFFu & 0xab;\nint b = x &0x1f;\nconst char* s = "0xff"; // 0xff\n'
+    assert fix_with_tree_sitter(code) == (
+        'int a = 0xFFU & 0xAB;\nint b = x & 0x1F;\nconst char* s = "0xff"; // 0xff\n'
+    )
@@ -0,0 +1,68 @@
+import json
+import subprocess
+import sys
+import threading
+
+from wformat import profile
+from wformat.profile import Profiler, span
+from wformat.wformat import WFormat
+
+
+def test_span_is_noop_without_profiler():
+    assert profile.active_profiler() is None
+    with span("nothing"):
+        pass
+
+
+def test_trace_has_a_track_per_thread(tmp_path, monkeypatch):
+    profiler = Profiler()
+    monkeypatch.setattr(profile, "_profiler", profiler)
+
+    # keep the threads alive together so that their idents differ
+    barrier = threading.Barrier(3)
+
+    def work(i):
+        with span("format_inplace", file=f"f{i}.cpp"):
+            with span("read"):
+                barrier.wait()
+
+    threads = [
+        threading.Thread(target=work, args=(i,), name=f"w{i}") for i in range(3)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    out = tmp_path / "trace.json"
+    profiler.write(out)
+    events = json.loads(out.read_text(encoding="utf-8"))["traceEvents"]
+    names = {e["args"]["name"] for e in events if e["ph"] == "M"}
+    assert names == {"w0", "w1", "w2"}
+    spans = [e for e in events if e["ph"] == "X"]
+    assert sorted(e["name"] for e in spans) == ["format_inplace"] * 3 + ["read"] * 3
+    slowest = sorted(f for f, _ in profiler.slowest_files())
+    assert slowest == ["f0.cpp", "f1.cpp", "f2.cpp"]
+
+
+def test_format_memory_stages_are_traced(monkeypatch):
+    profiler = Profiler()
+    monkeypatch.setattr(profile, "_profiler", profiler)
+    WFormat().format_memory("int   main( ) {  return  0 ; }\n")
+    names = {e["name"] for e in profiler.trace()["traceEvents"]}
+    assert {"spawn", "clang-format | uncrustify", "tree-sitter"} <= names
+
+
+def test_cli_writes_profile_without_files(tmp_path):
+    out = tmp_path / "trace.json"
+    notes = tmp_path / "notes.txt"
+    notes.write_text("not C++\n", encoding="utf-8")
+    run = subprocess.run(
+        [sys.executable, "-m", "wformat", "--profile", str(out), str(notes)],
+        stdin=subprocess.DEVNULL,
+        capture_output=True,
+        text=True,
+    )
+    assert run.returncode == 0, run.stderr
+    assert "No file found" in run.stdout
+    assert "traceEvents" in json.loads(out.read_text(encoding="utf-8"))
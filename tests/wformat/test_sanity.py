@@ -1,7 +1,10 @@
+import subprocess
+import sys
+
 import pytest
 
 from wformat.cli_app import cli_app
-from wformat.wformat import WFormat
+from wformat.wformat import WFormat, largest_first
 
 
 def test_wformat():
@@ -17,3 +20,28 @@ def test_cli(capsys):
     if e.value.code != 0:
         print(capsys.readouterr().out)
     assert e.value.code == 0
+
+
+def test_cli_startup_skips_tree_sitter():
+    # --version and --ls must not pay for tree-sitter and the formatter
+    code = (
+        "import sys; sys.argv = ['wformat', '--version']; "
+        "from wformat.cli_app import cli_app; cli_app(sys.argv[1:]); "
+        "assert 'tree_sitter' not in sys.modules, 'tree_sitter imported'; "
+        "assert 'wformat.wformat' not in sys.modules, 'wformat.wformat imported'"
+    )
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+
+
+def test_largest_first(tmp_path):
+    sizes = {"a.cpp": 10, "b.cpp": 300, "c.cpp": 20}
+    for name, size in sizes.items():
+        (tmp_path / name).write_text("x" * size)
+    paths = [tmp_path / name for name in sizes] + [tmp_path / "gone.cpp"]
+    assert [p.name for p in largest_first(paths)] == [
+        "b.cpp",
+        "c.cpp",
+        "a.cpp",
+        "gone.cpp",
+    ]
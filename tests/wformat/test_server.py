@@ -0,0 +1,144 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from wformat.client import ServerClient, ServerError
+from wformat.wformat import WFormat
+
+pytestmark = pytest.mark.skipif(
+    not hasattr(os, "getuid"), reason="needs Unix domain sockets"
+)
+
+SOURCE = "int   main( ) {  return  0 ; }\n"
+
+
+def start_server(path, *args):
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "wformat", "--serve-socket", "--socket", str(path)]
+        + ["--no-cache", *args],
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    deadline = time.monotonic() + 30
+    while not path.exists():
+        assert proc.poll() is None, proc.stderr.read()
+        assert time.monotonic() < deadline, "server did not start"
+        time.sleep(0.02)
+    return proc
+
+
+def test_server_shared_by_clients(tmp_path):
+    path = tmp_path / "w.sock"
+    proc = start_server(path)
+    try:
+        expected = WFormat().format_bytes(SOURCE.encode())
+        results = []
+
+        def client():
+            with ServerClient.connect(path) as c:
+                results.append(c.format_bytes(SOURCE.encode()))
+
+        threads = [threading.Thread(target=client) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert results == [expected] * 4
+
+        # a second server on the same socket leaves the first one alone
+        second = subprocess.run(
+            [sys.executable, "-m", "wformat", "--serve-socket", "--socket", str(path)],
+            capture_output=True,
+            text=True,
+            timeout=60,
+        )
+        assert second.returncode == 0
+        assert "already running" in second.stderr
+
+        with ServerClient.connect(path) as c:
+            with pytest.raises(ServerError, match="unknown op"):
+                c.request({"op": "nope"})
+            stats = c.request({"op": "stats"})["stats"]
+            assert stats["requests"]["format"] == 4
+            assert stats["connections"] == 1
+            c.shutdown()
+        assert proc.wait(timeout=30) == 0
+        assert not path.exists()
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+
+
+def test_format_files_with_server_reports_unreadable_files(tmp_path, capsys):
+    from wformat.client import format_files_with_server
+
+    path = tmp_path / "w.sock"
+    proc = start_server(path)
+    try:
+        good = tmp_path / "good.cpp"
+        good.write_text(SOURCE, encoding="utf-8")
+        missing = tmp_path / "missing.cpp"
+        with ServerClient.connect(path) as c:
+            assert format_files_with_server(c, [missing, good]) == 1
+            c.shutdown()
+        assert good.read_text(encoding="utf-8") == WFormat().format_memory(SOURCE)
+        assert f"-- ERROR while processing {missing}" in capsys.readouterr().out
+        assert proc.wait(timeout=30) == 0
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+
+
+def test_server_idle_timeout(tmp_path):
+    path = tmp_path / "w.sock"
+    proc = start_server(path, "--serve-idle-timeout", "0.5")
+    try:
+        assert proc.wait(timeout=30) == 0
+        assert "No clients" in proc.stderr.read()
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+
+
+def test_cli_use_server_starts_server(tmp_path):
+    path = tmp_path / "w.sock"
+    # the client formats without tree-sitter or the formatter in its process
+    code = (
+        "import sys\n"
+        "from wformat.cli_app import cli_app\n"
+        "sys.argv = ['wformat', '--stdin', '--use-server', '--no-cache',"
+        f" '--socket', {str(path)!r}]\n"
+        "try:\n"
+        "    cli_app(sys.argv[1:])\n"
+        "except SystemExit as e:\n"
+        "    assert e.code == 0, e.code\n"
+        "assert 'tree_sitter' not in sys.modules, 'tree_sitter imported'\n"
+        "assert 'wformat.wformat' not in sys.modules, 'wformat.wformat imported'\n"
+    )
+    try:
+        proc = subprocess.run(
+            [sys.executable, "-c", code],
+            input=SOURCE,
+            capture_output=True,
+            text=True,
+            timeout=60,
+        )
+        assert proc.returncode == 0, proc.stderr
+        assert proc.stdout == WFormat().format_memory(SOURCE)
+    finally:
+        if path.exists():
+            with ServerClient.connect(path) as c:
+                c.shutdown()
+
+
+def test_client_refuses_shared_socket_directory(tmp_path):
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    shared.chmod(0o777)
+    with pytest.raises(PermissionError, match="mode 0700"):
+        ServerClient.connect(shared / "w.sock", start=True)
+    assert not (shared / "w.log").exists()
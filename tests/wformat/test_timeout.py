@@ -0,0 +1,121 @@
+import asyncio
+import subprocess
+import sys
+import time
+
+import pytest
+
+from wformat.normalizer import IncrementalNormalizer, fix_bytes_with_tree_sitter
+from wformat.wformat import FormatTimeout, Timeouts, WFormat
+
+# stand-ins for the tools: copy stdin to stdout, stall on inputs containing
+# "slow", and optionally write a lot to stderr before reading any input
+TOOL = """
+import sys, time
+sys.stderr.buffer.write(b"w" * int(sys.argv[1]))
+sys.stderr.flush()
+data = sys.stdin.buffer.read()
+if b"slow" in data:
+    time.sleep(60)
+sys.stdout.buffer.write(data)
+"""
+
+
+def tool(stderr_bytes=0):
+    return lambda *args, **kwargs: [sys.executable, "-c", TOOL, str(stderr_bytes)]
+
+
+def test_stalled_stage_times_out():
+    formatter = WFormat()
+    formatter.uncrustify.args_for_stdin = tool()
+    formatter.timeouts = Timeouts(uncrustify=0.5)
+    start = time.monotonic()
+    with pytest.raises(FormatTimeout, match="uncrustify timed out after 0.5s"):
+        formatter.format_bytes(b"int slow;\n")
+    assert time.monotonic() - start < 30
+
+
+def test_file_timeout_bounds_all_stages():
+    formatter = WFormat()
+    formatter.clang_format.args_for_stdin = tool()
+    formatter.timeouts = Timeouts(clang_format=60, file=0.5)
+    with pytest.raises(FormatTimeout, match="file timed out after 0.5s"):
+        formatter.format_bytes(b"int slow;\n")
+
+
+def test_large_input_and_chatty_stderr_do_not_stall():
+    formatter = WFormat()
+    # far more than a pipe buffer both ways, written before any input is read
+    formatter.clang_format.args_for_stdin = tool(4 * 1024 * 1024)
+    formatter.uncrustify.args_for_stdin = tool()
+    formatter.timeouts = Timeouts(file=60)
+    data = b"int a;\n" * (512 * 1024)
+    rc1, rc2, err1, out2, err2 = formatter._run_tools(data)
+    assert (rc1, rc2) == (0, 0)
+    assert len(err1) == 4 * 1024 * 1024
+    assert out2 == data
+
+
+def test_tree_sitter_timeout():
+    src = b"int f() { return g(1, 2) + 0xff; }\n" * 20000
+    with pytest.raises(TimeoutError):
+        fix_bytes_with_tree_sitter(src, timeout=1e-6)
+    normalizer = IncrementalNormalizer()
+    with pytest.raises(TimeoutError):
+        normalizer.fix_bytes(src, timeout=1e-6)
+    # a timed out normalizer starts over, with the same result
+    assert normalizer.fix_bytes(src) == fix_bytes_with_tree_sitter(src)
+
+
+@pytest.mark.parametrize("on_timeout,failures", [("fail", 1), ("skip", 0)])
+def test_check_many_on_timeout(tmp_path, capsys, on_timeout, failures):
+    formatter = WFormat()
+    formatter.uncrustify.args_for_stdin = tool()
+    formatter.timeouts = Timeouts(uncrustify=0.5)
+    fast = tmp_path / "fast.cpp"
+    fast.write_text("int fast;\n", encoding="utf-8")
+    slow = tmp_path / "slow.cpp"
+    slow.write_text("int slow;\n", encoding="utf-8")
+    assert formatter.check_many([fast, slow], jobs=2, on_timeout=on_timeout) == failures
+    assert f"-- TIMEOUT while checking {slow}" in capsys.readouterr().out
+
+
+def test_format_many_retries_timed_out_files(tmp_path, capsys):
+    formatter = WFormat()
+    formatter.uncrustify.args_for_stdin = tool()
+    formatter.timeouts = Timeouts(uncrustify=0.25)
+    slow = tmp_path / "slow.cpp"
+    slow.write_text("int slow;\n", encoding="utf-8")
+    assert formatter.format_inplace_many_mt([slow], jobs=1, on_timeout="retry") == 1
+    out = capsys.readouterr().out
+    assert "-- Retrying 1 timed out file(s)" in out
+    assert "uncrustify timed out after 0.5s" in out
+    assert "-- Completed with 1 error(s)" in out
+    # the retry ran with doubled limits, they are restored afterwards
+    assert formatter.timeouts.stages["uncrustify"] == 0.25
+
+
+def test_async_stalled_stage_times_out():
+    formatter = WFormat()
+    formatter.uncrustify.args_for_stdin = tool()
+    formatter.timeouts = Timeouts(uncrustify=0.5)
+    with pytest.raises(FormatTimeout, match="uncrustify timed out after 0.5s"):
+        asyncio.run(formatter.format_bytes_async(b"int slow;\n"))
+
+
+def test_cli_fails_on_timed_out_files(tmp_path):
+    path = tmp_path / "f.cpp"
+    path.write_text("int   main( ) {  return  0 ; }\n", encoding="utf-8")
+    args = [sys.executable, "-m", "wformat", "--no-cache", "--timeout", "0.001"]
+    run = subprocess.run(
+        [*args, str(path)], stdin=subprocess.DEVNULL, capture_output=True, text=True
+    )
+    assert run.returncode == 1
+    assert "-- TIMEOUT while processing" in run.stdout
+    run = subprocess.run(
+        [*args, "--on-timeout", "skip", str(path)],
+        stdin=subprocess.DEVNULL,
+        capture_output=True,
+        text=True,
+    )
+    assert run.returncode == 0
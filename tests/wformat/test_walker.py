@@ -0,0 +1,44 @@
+import io
+from pathlib import Path
+
+from wformat.walker import iter_source_files, read_file_list
+
+
+def touch(root: Path, *names: str) -> None:
+    for name in names:
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("", encoding="utf-8")
+
+
+def test_walker_prunes_ignored(tmp_path):
+    touch(
+        tmp_path,
+        "a.cpp",
+        "a.txt",
+        "msg.pb.h",
+        "build/gen.cpp",
+        ".git/x.cpp",
+        "src/b.h",
+        "src/skip.cpp",
+        "src/keep_gen.cpp",
+        "src/sub/c.cpp",
+        "src/sub/d_gen.cpp",
+    )
+    (tmp_path / ".gitignore").write_text("build/\n*_gen.cpp\n", encoding="utf-8")
+    (tmp_path / "src" / ".wformatignore").write_text(
+        "/skip.cpp\n!keep_gen.cpp\n", encoding="utf-8"
+    )
+    found = [p.relative_to(tmp_path).as_posix() for p in iter_source_files(tmp_path)]
+    assert found == ["a.cpp", "src/b.h", "src/keep_gen.cpp", "src/sub/c.cpp"]
+
+
+def test_read_file_list():
+    assert list(read_file_list(io.StringIO("a.cpp\n\nb c.h\n"))) == [
+        Path("a.cpp"),
+        Path("b c.h"),
+    ]
+    assert list(read_file_list(io.StringIO("a.cpp\0b\nc.h\0"), True)) == [
+        Path("a.cpp"),
+        Path("b\nc.h"),
+    ]